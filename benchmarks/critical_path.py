@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""Compare the makespan of FIFO and critical-path (upward rank) scheduling.
+
+The benchmark generates random layered task graphs with random task durations and
+simulates their execution on a fixed number of workers with the same `Scheduler` that
+`Pipeline.run_pipeline` uses, once with tasks dispatched in topological order and once
+with tasks prioritized by their upward rank. Usage::
+
+    python benchmarks/critical_path.py --graphs 20 --tasks 200 --workers 4
+"""
+import argparse
+import heapq
+import random
+import statistics
+import sys
+
+from pathlib import Path
+
+import networkx as nx
+
+# run from a checkout without installing the package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from yenta.pipeline.Scheduler import Scheduler, upward_ranks  # noqa: E402
+
+
+def random_graph(rng: random.Random, num_tasks: int, num_layers: int, max_fan_in: int) -> nx.DiGraph:
+
+    graph = nx.DiGraph()
+    layers = [[] for _ in range(num_layers)]
+    for index in range(num_tasks):
+        layer = 0 if index < num_layers else rng.randrange(num_layers)
+        task_name = f'task_{index:05d}'
+        layers[layer].append(task_name)
+        graph.add_node(task_name, duration=rng.lognormvariate(0, 1.2))
+
+    for layer in range(1, num_layers):
+        upstream = [task_name for earlier in layers[:layer] for task_name in earlier]
+        for task_name in layers[layer]:
+            for dependency in rng.sample(upstream, min(len(upstream), rng.randint(1, max_fan_in))):
+                graph.add_edge(dependency, task_name)
+
+    return graph
+
+
+def simulate(graph: nx.DiGraph, workers: int, priorities=None) -> float:
+
+    task_names = list(nx.lexicographical_topological_sort(graph))
+    scheduler = Scheduler(graph, task_names, priorities=priorities)
+    clock = 0.0
+    running = []
+    while scheduler.has_pending():
+        for task_name in scheduler.next_tasks(workers - len(running)):
+            heapq.heappush(running, (clock + graph.nodes[task_name]['duration'], task_name))
+        clock, task_name = heapq.heappop(running)
+        scheduler.complete(task_name)
+
+    return clock
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--graphs', type=int, default=20, help='The number of random graphs.')
+    parser.add_argument('--tasks', type=int, default=200, help='The number of tasks per graph.')
+    parser.add_argument('--layers', type=int, default=10, help='The number of layers per graph.')
+    parser.add_argument('--fan-in', type=int, default=3, help='The maximum number of dependencies per task.')
+    parser.add_argument('--workers', type=int, default=4, help='The number of simulated workers.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    speedups = []
+    print(f'{"graph":>5} {"fifo":>10} {"critical":>10} {"bound":>10} {"speedup":>8}')
+    for index in range(options.graphs):
+        graph = random_graph(rng, options.tasks, options.layers, options.fan_in)
+        durations = nx.get_node_attributes(graph, 'duration')
+        order = list(nx.lexicographical_topological_sort(graph))
+        ranks = upward_ranks(graph, order, durations)
+        bound = max(max(ranks.values()), sum(durations.values()) / options.workers)
+
+        fifo = simulate(graph, options.workers)
+        critical = simulate(graph, options.workers, priorities=ranks)
+        speedups.append(fifo / critical)
+        print(f'{index:>5} {fifo:>10.2f} {critical:>10.2f} {bound:>10.2f} {fifo / critical:>8.3f}')
+
+    print(f'mean speedup of critical-path over FIFO: {statistics.mean(speedups):.3f} '
+          f'(min {min(speedups):.3f}, max {max(speedups):.3f})')
+
+
+if __name__ == '__main__':
+    main()
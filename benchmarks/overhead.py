@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Measure the per-task overhead of `Pipeline.run_pipeline` on graphs of tiny tasks.
+
+The benchmark builds a layered graph of tasks that each add up a few values produced by
+earlier tasks, runs it once to populate the store, and then times runs in which every
+task is reused: once with the results read from the store, and once with the files of the
+store already held in an in-memory cache, as in `yenta daemon` or `yenta watch`. Every run is
+repeated and the fastest one reported. Usage::
+
+    python benchmarks/overhead.py --tasks 100000
+
+With `--max-overhead`, the script fails when a task reused from the store costs more than the
+given number of microseconds, so that it can guard against regressions, as `make benchmark` does.
+"""
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+# run from a checkout without installing the package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from yenta.config import settings  # noqa: E402
+from yenta.pipeline import Pipeline  # noqa: E402
+from yenta.tasks import task  # noqa: E402
+from yenta.utils.cache import LRUCache  # noqa: E402
+
+
+def _tiny(name, arity):
+
+    params = [f'x{index}' for index in range(arity)]
+    total = ' + '.join(['1'] + params)
+    namespace = {}
+    exec(f'def {name}({", ".join(params)}):\n    return {{"values": {{"x": {total}}}}}', namespace)
+    return namespace[name]
+
+
+def build_tasks(rng: random.Random, num_tasks: int, width: int, fan_in: int):
+
+    tasks = []
+    names = []
+    for index in range(num_tasks):
+        name = f'task_{index:06d}'
+        upstream = names[max(0, index - width * 2):max(0, index - index % width)]
+        dependencies = rng.sample(upstream, min(len(upstream), fan_in))
+        tasks.append(task(depends_on=[f'{dependency}.x' for dependency in dependencies])(
+            _tiny(name, len(dependencies))))
+        names.append(name)
+
+    return tasks
+
+
+def timed(pipeline: Pipeline, repeat: int = 1) -> float:
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pipeline.run_pipeline()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tasks', type=int, default=100000, help='The number of tasks.')
+    parser.add_argument('--width', type=int, default=100, help='The number of tasks per layer.')
+    parser.add_argument('--fan-in', type=int, default=2, help='The number of dependencies per task.')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+    parser.add_argument('--store', type=Path, help='The store to use; defaults to a temporary directory.')
+    parser.add_argument('--repeat', type=int, default=3, help='The number of times to time each reused run.')
+    parser.add_argument('--max-overhead', type=float,
+                        help='Fail if a task reused from the store costs more than this many microseconds.')
+    options = parser.parse_args()
+
+    store = options.store or Path(tempfile.mkdtemp(prefix='yenta-overhead-'))
+    settings.YENTA_STORE_PATH = store
+    try:
+        tasks = build_tasks(random.Random(options.seed), options.tasks, options.width, options.fan_in)
+        cache = LRUCache(maxsize=4 * options.tasks)
+
+        start = time.perf_counter()
+        pipeline = Pipeline(*tasks)
+        print(f'build:          {time.perf_counter() - start:8.2f} s')
+        print(f'first run:      {timed(pipeline):8.2f} s')
+
+        elapsed = timed(pipeline, options.repeat)
+        overhead = elapsed / options.tasks * 1e6
+        print(f'reused (disk):  {elapsed:8.2f} s, {overhead:8.1f} us/task')
+        pipeline = Pipeline(*tasks, result_cache=cache)
+        timed(pipeline)
+        elapsed = timed(pipeline, options.repeat)
+        print(f'reused (cache): {elapsed:8.2f} s, {elapsed / options.tasks * 1e6:8.1f} us/task')
+    finally:
+        if options.store is None:
+            shutil.rmtree(store)
+
+    if options.max_overhead is not None and overhead > options.max_overhead:
+        print(f'A reused task costs {overhead:.1f} us, more than the allowed {options.max_overhead:.1f} us')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+import os
+
+from pathlib import Path
+
+from yenta.tasks.Task import task
+from yenta.pipeline.Pipeline import TaskResult
+
+
+@task
+def numbers():
+    return TaskResult({'values': [1, 2, 3], 'pid': os.getpid()})
+
+
+@task(depends_on=['numbers.values'])
+def total(values):
+    # the first worker to run this task dies, to check that it gets rescheduled
+    marker = Path(os.environ['YENTA_TEST_MARKER'])
+    if not marker.exists():
+        marker.touch()
+        os._exit(1)
+    return TaskResult({'total': sum(values), 'pid': os.getpid()})
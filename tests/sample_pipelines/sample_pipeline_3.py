@@ -0,0 +1,17 @@
+from yenta.tasks.Task import task
+from yenta.pipeline.Pipeline import TaskResult
+
+
+@task
+def load():
+    return TaskResult({'data': [1, 2, 3, 4]})
+
+
+@task(depends_on=['load.data'], params=['scale'])
+def scaled(data, scale):
+    return TaskResult({'data': [value * scale for value in data]})
+
+
+@task(depends_on=['scaled.data'], params=['offset'])
+def total(data, offset=0):
+    return TaskResult({'total': sum(data) + offset})
@@ -1,3 +1,4 @@
+import os
 import string
 
 from datetime import datetime
@@ -42,3 +43,29 @@ def test_file_artifact_hash():
 
     output_file.unlink()
 
+
+def test_file_artifact_freshness(tmp_path, monkeypatch):
+
+    output_file = tmp_path / 'artifact.test'
+    output_file.write_text('some nice data')
+    art = FileArtifact(location=output_file)
+
+    def no_hash(self):
+        raise AssertionError(f'{self.location} should not be hashed')
+
+    # an untouched file is checked by its modification time, size and inode alone
+    monkeypatch.setattr(FileArtifact, 'artifact_hash', no_hash)
+    assert art.is_fresh()
+    monkeypatch.undo()
+
+    # a file that was rewritten with the same contents is hashed once, and then trusted again
+    os.utime(output_file, ns=(0, 0))
+    assert art.is_fresh()
+    monkeypatch.setattr(FileArtifact, 'artifact_hash', no_hash)
+    assert art.is_fresh()
+    monkeypatch.undo()
+
+    output_file.write_text('some other data')
+    assert not art.is_fresh()
+    output_file.unlink()
+    assert not art.is_fresh()
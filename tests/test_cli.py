@@ -2,17 +2,29 @@
 
 """Tests for `yenta` package."""
 
+import click
+import io
 import pytest
 import json
+import os
+import pickle
 import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+
+import yenta
 
 from pathlib import Path
 from click.testing import CliRunner
 
 from yenta import cli
 from yenta.tasks import task
-from yenta.pipeline import Pipeline, PipelineResult
+from yenta.pipeline import Pipeline, PipelineResult, TaskResult, Coordinator, DirectoryBroker, Worker, TaskStatus
 from yenta.config import settings
+from yenta.daemon import Daemon, socket_path_for
+from yenta.utils.cache import LRUCache, load_pickle
 
 
 @pytest.fixture
@@ -53,7 +65,8 @@ def test_run_tasks(store_path):
     runner = CliRunner()
     entry_point = 'sample_pipelines/sample_pipeline_1.py'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       'run', '--verbose'])
 
     assert result.exit_code == 0
 
@@ -64,7 +77,7 @@ def test_run_tasks(store_path):
     assert output_lines[ind + 1] == 'hello from foo task'
     assert output_lines[ind + 2] == '[\u2714] foo'
 
-    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run', '-v'])
 
     # bar still errors, foo recycles the old value, baz still not called
     output_lines = result.output.split('\n')
@@ -177,6 +190,30 @@ def test_rm_task(store_path):
     assert result.output == 'Unknown task nonexistent-task specified.\n'
 
 
+def test_rm_shared_task(store_path):
+
+    runner = CliRunner()
+    args = ['--entry-point', 'sample_pipelines/sample_pipeline_1.py', '--pipeline-store', store_path, '--no-daemon']
+
+    result = runner.invoke(cli.yenta, args + ['run', '--share-results'])
+    assert 'hello from foo task' in result.output
+    result = runner.invoke(cli.yenta, args + ['run', '--share-results', '--pipeline-name', 'other'])
+    assert 'hello from foo task' not in result.output
+
+    # without its shared result, the task is executed again rather than adopted from the other pipeline
+    result = runner.invoke(cli.yenta, args + ['rm', 'foo'])
+    assert result.exit_code == 0
+    assert result.output == ''
+    result = runner.invoke(cli.yenta, args + ['run', '--share-results'])
+    assert 'hello from foo task' in result.output
+
+    result = runner.invoke(cli.yenta, args + ['cache', 'prune'])
+    assert result.output == 'Removed 0 shared results\n'
+    result = runner.invoke(cli.yenta, args + ['cache', 'prune', '--max-age', '0'])
+    assert result.output == 'Removed 1 shared results\n'
+    assert list((store_path / '.index').iterdir()) == []
+
+
 def test_dump_task_graph():
 
     runner = CliRunner()
@@ -193,5 +230,332 @@ def test_dump_task_graph():
 
     assert result.exit_code == 0
     assert Path(task_graph).exists()
+    assert 'Wrote 3 of 3 tasks' in result.output
 
     Path(task_graph).unlink()
+
+
+def test_dump_filtered_task_graph(store_path, tmp_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_3.py'
+    args = ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon']
+
+    assert runner.invoke(cli.yenta, args + ['run', '-p', 'scale=2']).exit_code == 0
+    result = runner.invoke(cli.yenta, args + ['dump-task-graph', str(tmp_path / 'graph.json'),
+                                              '--around', 'total', '--depth', '1'])
+    assert result.exit_code == 0
+    assert 'Wrote 2 of 3 tasks' in result.output
+    graph = json.loads((tmp_path / 'graph.json').read_text())
+    assert [(node['id'], node['cache']) for node in graph['nodes']] == [('scaled', 'cached'), ('total', 'cached')]
+
+    result = runner.invoke(cli.yenta, args + ['dump-task-graph', str(tmp_path / 'graph.dot'), '--only-stale'])
+    assert 'Wrote 0 of 3 tasks' in result.output
+
+    result = runner.invoke(cli.yenta, args + ['dump-task-graph', str(tmp_path / 'graph.dot'), '--around', 'nope'])
+    assert result.exit_code == 2
+    assert 'Unknown task nope' in result.output
+
+
+def test_distributed_workers(store_path, tmp_path):
+
+    entry_point = 'sample_pipelines/sample_pipeline_2.py'
+    broker_path = tmp_path / 'broker'
+    env = {**os.environ,
+           'PYTHONPATH': str(Path(yenta.__file__).parent.parent),
+           'YENTA_TEST_MARKER': str(tmp_path / 'marker')}
+    command = [sys.executable, '-m', 'yenta.cli', '--entry-point', entry_point,
+               '--pipeline-store', str(tmp_path / 'store'), 'worker', '--broker', str(broker_path),
+               '--heartbeat-interval', '0.2', '--idle-timeout', '30']
+    workers = [subprocess.Popen(command, env=env) for _ in range(2)]
+
+    try:
+        tasks = cli.load_tasks(entry_point)
+        coordinator = Coordinator(DirectoryBroker(broker_path), poll_interval=0.05, worker_timeout=1.0)
+        pipeline = Pipeline(*tasks, max_workers=2, invoker=coordinator)
+        result = pipeline.run_pipeline()
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+
+    assert result.values('total', 'total') == 6
+    assert result.values('numbers', 'pid') != os.getpid()
+    assert (tmp_path / 'marker').exists()
+    assert sum(worker.returncode == 1 for worker in workers) == 1
+
+
+def test_distributed_without_workers(store_path, tmp_path):
+
+    tasks = cli.load_tasks('sample_pipelines/sample_pipeline_2.py')
+    broker = DirectoryBroker(tmp_path / 'broker')
+    coordinator = Coordinator(broker, poll_interval=0.05, worker_timeout=0.5)
+    pipeline = Pipeline(*tasks, invoker=coordinator)
+    result = pipeline.run_pipeline()
+
+    assert result.task_results['numbers'].status == TaskStatus.FAILURE
+    assert 'No worker has sent a heartbeat' in result.task_results['numbers'].error
+    assert not list(broker.queue_path.iterdir())
+
+
+def test_distributed_unpicklable_result(store_path, tmp_path):
+
+    @task
+    def bad():
+        return TaskResult({'f': lambda x: x})
+
+    @task
+    def good():
+        return TaskResult({'x': 1})
+
+    broker = DirectoryBroker(tmp_path / 'broker')
+    worker = Worker(broker, [bad, good], lambda name: Pipeline(bad, good, name=name), poll_interval=0.01)
+    working = threading.Thread(target=worker.run, kwargs={'idle_timeout': 30})
+    working.start()
+    try:
+        coordinator = Coordinator(broker, poll_interval=0.05, worker_timeout=5.0)
+        pipeline = Pipeline(bad, good, invoker=coordinator)
+        result = pipeline.run_pipeline()
+        assert working.is_alive()
+    finally:
+        worker.stop()
+        working.join()
+
+    # the task fails, while the worker lives on to run the other one
+    assert result.task_results['bad'].status == TaskStatus.FAILURE
+    assert 'cannot be pickled' in result.task_results['bad'].error
+    assert result.values('good', 'x') == 1
+    assert not list(broker.claimed_path.iterdir())
+
+
+def test_daemon(store_path, monkeypatch):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_1.py'
+    cwd = os.getcwd()
+
+    monkeypatch.setattr(settings, 'YENTA_USE_DAEMON', True)
+    monkeypatch.setattr(cli, 'RESULT_CACHE', LRUCache())
+    server = Daemon(socket_path_for(store_path), cli.handle_daemon_request)
+    serving = threading.Thread(target=server.serve_forever, daemon=True)
+    serving.start()
+
+    try:
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, 'run'])
+        assert result.exit_code == 0
+        assert '[✘] bar' in result.output.split('\n')
+        assert 'hello from foo task' in result.output
+
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                           'list-tasks'])
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                           'list-tasks'])
+        output_lines = result.output.split('\n')
+        assert output_lines[0] == 'The following tasks are available:'
+        assert output_lines[1] == '[✘] bar'
+        assert output_lines[2] == '[✔] foo'
+        assert cli.RESULT_CACHE.hits > 0
+
+        result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                           'daemon', 'status'])
+        assert 'Daemon listening on' in result.output
+    finally:
+        server.shutdown()
+        server.server_close()
+        os.chdir(cwd)
+
+    assert not socket_path_for(store_path).exists()
+
+
+def test_daemon_request_environment(store_path, tmp_path, monkeypatch):
+
+    seen = {}
+
+    def record():
+        seen['marker'] = os.environ.get('YENTA_TEST_MARKER', None)
+        seen['prefetch'] = settings.YENTA_PREFETCH
+
+    monkeypatch.setattr(cli.yenta, 'get_command', lambda ctx, name: click.Command(name, callback=record))
+    monkeypatch.delenv('YENTA_TEST_MARKER', raising=False)
+    cwd = os.getcwd()
+    request = {'command': 'record', 'params': {}, 'cwd': cwd, 'entry_point': 'main.py', 'store_path': str(store_path),
+               'log_file': None, 'event_log': None,
+               'env': {**os.environ, 'YENTA_TEST_MARKER': 'client', 'YENTA_PREFETCH': '3'}}
+    try:
+        assert cli.handle_daemon_request(request) == ('', 0)
+    finally:
+        os.chdir(cwd)
+
+    # the command sees the environment of the client, and the daemon gets its own back afterwards
+    assert seen == {'marker': 'client', 'prefetch': 3}
+    assert 'YENTA_TEST_MARKER' not in os.environ
+    assert settings.YENTA_PREFETCH == 0
+    assert settings.YENTA_STORE_PATH == store_path
+
+    # cached results are handed out as fresh objects, which callers may modify
+    cache = LRUCache()
+    value_path = tmp_path / 'value.pk'
+    value_path.write_bytes(pickle.dumps([1, 2]))
+    load_pickle(value_path, cache).append(3)
+    assert load_pickle(value_path, cache) == [1, 2]
+    assert cache.hits == 1
+
+
+def test_event_log(store_path, tmp_path, monkeypatch):
+
+    monkeypatch.setattr(settings, 'YENTA_EVENT_LOG', None)
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_1.py'
+    event_log = tmp_path / 'events.jsonl'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path,
+                                       '--event-log', event_log, 'run'])
+    assert result.exit_code == 0
+    assert 'Traceback' not in result.output
+
+    events = [json.loads(line) for line in event_log.read_text().splitlines()]
+    assert events[0]['type'] == 'run_started'
+    assert events[-1]['type'] == 'run_finished'
+    outcomes = {event['task']: event for event in events if event['type'] in ('finished', 'failed')}
+    assert outcomes['foo']['type'] == 'finished'
+    assert outcomes['bar']['type'] == 'failed'
+    assert 'Traceback' in outcomes['bar']['traceback']
+
+
+def test_profile(store_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_1.py'
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon',
+                                       'profile-report', 'foo'])
+    assert result.exit_code == 1
+    assert 'No profile recorded for task foo' in result.output
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon',
+                                       'run', '--profile', 'foo', '--profile-memory'])
+    assert result.exit_code == 0
+    assert (store_path / 'default' / 'foo' / 'profile.pstats').exists()
+    assert not (store_path / 'default' / 'bar' / 'profile.pstats').exists()
+
+    result = runner.invoke(cli.yenta, ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon',
+                                       'profile-report', 'foo', '--limit', '5'])
+    assert result.exit_code == 0
+    assert 'Profile of task foo: 1 call(s)' in result.output
+    assert 'function calls' in result.output
+    assert 'Peak traced memory' in result.output
+
+
+def test_history(store_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_1.py'
+    args = ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon']
+
+    result = runner.invoke(cli.yenta, args + ['history'])
+    assert 'No runs recorded for pipeline default' in result.output
+
+    runner.invoke(cli.yenta, args + ['run'])
+    runner.invoke(cli.yenta, args + ['run'])
+    result = runner.invoke(cli.yenta, args + ['history'])
+    assert result.exit_code == 0
+    rows = [line for line in result.output.split('\n') if line.startswith('│ ')]
+    assert [row.split('│')[1].strip() for row in rows] == ['1', '2']
+
+    result = runner.invoke(cli.yenta, args + ['history', '--limit', '1'])
+    rows = [line for line in result.output.split('\n') if line.startswith('│ ')]
+    assert [row.split('│')[1].strip() for row in rows] == ['2']
+
+    result = runner.invoke(cli.yenta, args + ['compare', 'previous', 'latest'])
+    assert result.exit_code == 0
+    assert 'No task regressed by more than 20%' in result.output
+
+    result = runner.invoke(cli.yenta, args + ['compare', '1', '5'])
+    assert result.exit_code == 2
+    assert 'There is no run number 5' in result.output
+
+
+def test_cache_export_import(store_path, tmp_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_1.py'
+    args = ['--entry-point', entry_point, '--no-daemon']
+    bundle = tmp_path / 'cache.tar'
+
+    runner.invoke(cli.yenta, args + ['--pipeline-store', store_path, 'run'])
+    result = runner.invoke(cli.yenta, args + ['--pipeline-store', store_path, 'cache', 'export', '--tasks', 'foo,bar',
+                                              '--compression', 'none', str(bundle)])
+    assert result.exit_code == 0
+    assert 'Exported 2 tasks' in result.output
+
+    # corrupt the result of bar in a copy of the bundle
+    corrupt = tmp_path / 'corrupt.tar'
+    with tarfile.open(bundle) as source, tarfile.open(corrupt, 'w') as target:
+        for member in source.getmembers():
+            data = source.extractfile(member).read()
+            if member.name == 'tasks/bar/result.pk':
+                data = data[:-1] + b'!'
+            target.addfile(member, io.BytesIO(data))
+
+    fresh_store = tmp_path / 'fresh'
+    try:
+        result = runner.invoke(cli.yenta, args + ['--pipeline-store', fresh_store, 'cache', 'import', str(corrupt)])
+        assert result.exit_code == 0
+        assert '[-] bar: corrupt' in result.output
+        assert f'[{cli.CHECK_MARK}] foo: imported' in result.output
+
+        result = runner.invoke(cli.yenta, args + ['--pipeline-store', fresh_store, 'run', '-v'])
+        assert '[\u2014] foo' in result.output.split('\n')
+    finally:
+        settings.YENTA_STORE_PATH = store_path
+
+
+def test_sweep(store_path, tmp_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_3.py'
+    args = ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon']
+
+    result = runner.invoke(cli.yenta, args + ['run'])
+    assert result.exit_code == 2
+    assert 'Task scaled requires the pipeline parameter scale' in result.output
+
+    result = runner.invoke(cli.yenta, args + ['run', '-p', 'scale=2', '-p', 'offset=1'])
+    assert result.exit_code == 0
+    assert Pipeline.load_pipeline(store_path / 'default').values('total', 'total') == 21
+
+    sweep = tmp_path / 'sweep.json'
+    sweep.write_text(json.dumps({'scale': [1, 2, 3]}))
+    result = runner.invoke(cli.yenta, args + ['run', '--sweep', str(sweep), '-p', 'offset=1'])
+    assert result.exit_code == 0
+    assert 'Ran 3 configurations of default' in result.output
+
+    totals = {}
+    for path in store_path.glob('default@*'):
+        params = json.loads((path / 'params.json').read_text())
+        totals[params['scale']] = Pipeline.load_pipeline(path).values('total', 'total')
+    assert totals == {1: 11, 2: 21, 3: 31}
+
+    sweep.write_text('[1, 2]')
+    result = runner.invoke(cli.yenta, args + ['run', '--sweep', str(sweep)])
+    assert result.exit_code == 2
+    assert 'must be a dict of parameter values' in result.output
+
+
+def test_run_several_pipelines(store_path):
+
+    runner = CliRunner()
+    entry_point = 'sample_pipelines/sample_pipeline_3.py'
+    args = ['--entry-point', entry_point, '--pipeline-store', store_path, '--no-daemon']
+
+    result = runner.invoke(cli.yenta, args + ['run', '-p', 'scale=2', '--pipeline-name', 'a', '--pipeline-name', 'b',
+                                              '-j', '2'])
+    assert result.exit_code == 0
+    assert 'Ran 2 pipelines' in result.output
+    assert 'a 3 executed, 0 reused' in result.output
+    assert Pipeline.load_pipeline(store_path / 'b').values('total', 'total') == 20
+
+    result = runner.invoke(cli.yenta, args + ['run', '-p', 'scale=2', '--all'])
+    assert result.exit_code == 0
+    assert 'a 0 executed, 3 reused' in result.output
+    assert 'b 0 executed, 3 reused' in result.output
@@ -1,15 +1,34 @@
+import importlib.util
+import io
 import json
+import os
 import pytest
 import networkx as nx
 import shutil
+import sys
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from xml.etree import ElementTree
 
 from yenta.config import settings
-from yenta.tasks.Task import task
-from yenta.pipeline import Pipeline, TaskResult, PipelineResult, InvalidTaskResultError
-from yenta.artifacts import FileArtifact
+from yenta.tasks.Task import task, InvalidTaskDefinitionError
+from yenta.pipeline import (
+    Pipeline, TaskResult, PipelineResult, TaskStatus, InvalidTaskResultError, Delta, Scheduler, compute_delta,
+    upward_ranks, Watcher, StoredResults, EventBus, EventType, JsonlSink, ProgressDisplay, compare_runs,
+    export_bundle, import_bundle, InvalidParameterError, Sweep, load_sweep, Prefetcher, PipelineGroup,
+    stored_pipelines, PipelineConfigError, export_task_graph, critical_path, GraphExportError
+)
+from yenta.pipeline.Index import ResultIndex
+from yenta.pipeline.Store import MISSING, MemoryStore
+from yenta.artifacts import FileArtifact, FileHandle
+from yenta.utils.locks import LeaseLock
+from yenta.utils.trace import Tracer
+from yenta.testing import assert_executed, assert_reused
+from rich.console import Console
 
 
 @pytest.fixture
@@ -17,7 +36,7 @@ def store_path(monkeypatch):
 
     monkeypatch.setattr(settings, 'YENTA_STORE_PATH', Path('tests/tmp/pipeline'))
     yield settings.YENTA_STORE_PATH
-    for path in settings.YENTA_STORE_PATH.iterdir():
+    for path in Path('tests/tmp/pipeline').iterdir():
         shutil.rmtree(path)
 
 
@@ -253,3 +272,1213 @@ def test_non_serializable_result(store_path):
 
     assert result == cached_result
     assert 'baz' not in cached_result.task_results
+
+
+def test_mapped_task(store_path):
+
+    files = ['a', 'b', 'c']
+    calls = []
+
+    @task
+    def foo():
+        return TaskResult({'files': list(files)})
+
+    @task(depends_on=['foo.files'], map=True)
+    def bar(file_name):
+        calls.append(file_name)
+        return TaskResult({'upper': file_name.upper()})
+
+    pipeline = Pipeline(foo, bar)
+    result = pipeline.run_pipeline()
+
+    assert result.values('bar', 'upper') == ['A', 'B', 'C']
+    assert sorted(calls) == ['a', 'b', 'c']
+
+    calls.clear()
+    files[1] = 'd'
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+
+    assert result.values('bar', 'upper') == ['A', 'D', 'C']
+    assert calls == ['d']
+    assert len(list((pipeline.store_path / 'bar' / 'elements').iterdir())) == 3
+
+
+def test_mapped_task_failure(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'numbers': [1, 0, 2]})
+
+    @task(depends_on=['foo.numbers'], map=True)
+    def bar(number):
+        return TaskResult({'inverse': 1 / number})
+
+    pipeline = Pipeline(foo, bar)
+    result = pipeline.run_pipeline()
+
+    assert result.task_results['bar'].status == TaskStatus.FAILURE
+    assert 'element 1' in result.task_results['bar'].error
+
+
+def test_incremental_task(store_path):
+
+    partitions = [1, 2, 3]
+    seen = []
+    kind = [list]
+
+    @task
+    def foo():
+        return TaskResult({'partitions': kind[0](partitions)})
+
+    @task(depends_on=['foo.partitions'], incremental=True)
+    def bar(partitions, previous):
+        seen.append(partitions.added)
+        total = previous.values['total'] if previous else 0
+        total += sum(partitions.added) - sum(partitions.removed)
+        return TaskResult({'total': total})
+
+    pipeline = Pipeline(foo, bar)
+    result = pipeline.run_pipeline()
+    assert result.values('bar', 'total') == 6
+    assert seen == [[1, 2, 3]]
+
+    partitions.append(4)
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert result.values('bar', 'total') == 10
+    assert seen[-1] == [4]
+
+    partitions.remove(1)
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert result.values('bar', 'total') == 9
+    assert seen[-1] == []
+
+    result = pipeline.run_pipeline(force_rerun=['foo', 'bar'])
+    assert result.values('bar', 'total') == 9
+    assert seen[-1] == [2, 3, 4]
+
+    # a collection whose type changed cannot be diffed, so the task starts over
+    kind[0] = tuple
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert result.values('bar', 'total') == 9
+    assert seen[-1] == (2, 3, 4)
+
+
+def test_incremental_task_with_default_parameter(store_path):
+
+    partitions = [1, 2, 3]
+    seen = []
+
+    @task
+    def foo():
+        return TaskResult({'partitions': list(partitions)})
+
+    @task(depends_on=['foo.partitions'], params=['scale'], incremental=True)
+    def bar(partitions, previous, scale=1):
+        seen.append(partitions.added)
+        total = previous.values['total'] if previous else 0
+        total += (sum(partitions.added) - sum(partitions.removed)) * scale
+        return TaskResult({'total': total})
+
+    # a parameter left at its default in both runs does not make the task start over
+    pipeline = Pipeline(foo, bar)
+    assert pipeline.run_pipeline().values('bar', 'total') == 6
+    partitions.append(4)
+    assert pipeline.run_pipeline(force_rerun=['foo']).values('bar', 'total') == 10
+    assert seen == [[1, 2, 3], [4]]
+
+    # while giving it, or leaving it at its default again, does
+    pipeline = Pipeline(foo, bar, params={'scale': 2})
+    assert pipeline.run_pipeline().values('bar', 'total') == 20
+    assert seen[-1] == [1, 2, 3, 4]
+    assert Pipeline(foo, bar).run_pipeline().values('bar', 'total') == 10
+    assert seen[-1] == [1, 2, 3, 4]
+
+
+def test_compute_delta():
+
+    delta = compute_delta({'a': 1, 'b': 2}, {'b': 3, 'c': 4})
+    assert delta == Delta(added={'c': 4}, removed={'a': 1}, changed={'b': 3})
+
+    delta = compute_delta({1, 2}, {2, 3})
+    assert delta == Delta(added={3}, removed={1}, changed=set())
+
+    delta = compute_delta([[1], [2], [3]], [[3], [4], [1]])
+    assert delta == Delta(added=[[4]], removed=[[2]], changed=[])
+
+    assert compute_delta(None, [1, 2]).added == [1, 2]
+    assert compute_delta([1, 2], [1, 2]).is_empty
+
+
+def test_pipeline_with_selectors(store_path):
+
+    data = {'x': [1, 2, 3], 'unrelated': 'a'}
+
+    @task
+    def foo() -> TaskResult:
+        return TaskResult(dict(data))
+
+    @task
+    def bar():
+        return TaskResult({'y': [4, 5, 6]})
+
+    def foo_x_selector(result: PipelineResult):
+        return sum(result.values('foo', 'x'))
+
+    def bar_y_selector(result: PipelineResult):
+        return sum(result.values('bar', 'y'))
+
+    @task(depends_on=['foo', 'bar'], selectors={'x': foo_x_selector, 'y': bar_y_selector})
+    def baz(x, y):
+        return TaskResult({'sum': x + y})
+
+    pipeline = Pipeline(foo, bar, baz)
+    result = pipeline.run_pipeline()
+
+    assert result.values('baz', 'sum') == 21
+    assert result.task_inputs['baz'].task_results == {
+        'baz': TaskResult({'x': 6, 'y': 15}, status=TaskStatus.SUCCESS)
+    }
+
+    data['unrelated'] = 'b'
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert result.values('foo', 'unrelated') == 'b'
+    assert pipeline._tasks_reused == {'bar', 'baz'}
+
+    data['x'] = [1, 2]
+    result = pipeline.run_pipeline(force_rerun=['foo'])
+    assert result.values('baz', 'sum') == 18
+    assert pipeline._tasks_executed == {'foo', 'baz'}
+
+
+def test_explicit_inputs_are_projected(store_path):
+
+    @task
+    def foo():
+        return TaskResult({'x': 1, 'big': list(range(100))})
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        return TaskResult({'y': x + 1})
+
+    pipeline = Pipeline(foo, bar)
+    result = pipeline.run_pipeline()
+
+    assert result.task_inputs['bar'].task_results['foo'].values == {'x': 1}
+
+
+def test_scheduler_respects_resources():
+
+    graph = nx.DiGraph()
+    graph.add_edge('a', 'c')
+    graph.add_node('b')
+    graph.add_node('d')
+
+    scheduler = Scheduler(graph, ['a', 'b', 'c', 'd'], capacities={'db': 1, 'cpu': 4},
+                          requirements={'a': {'db': 1}, 'b': {'db': 1}, 'd': {'cpu': 8}})
+
+    assert scheduler.next_tasks(4) == ['a', 'd']
+    assert scheduler.available == {'db': 0, 'cpu': 0}
+    scheduler.complete('a')
+    assert scheduler.next_tasks(4) == ['b', 'c']
+    assert scheduler.next_tasks(4) == []
+    for task_name in ['b', 'c', 'd']:
+        scheduler.complete(task_name)
+    assert not scheduler.has_pending()
+
+
+def test_concurrent_pipeline_with_resources(store_path):
+
+    lock = threading.Lock()
+    active = {'db': 0, 'max_db': 0, 'all': 0, 'max_all': 0}
+
+    def track(uses_db):
+        with lock:
+            active['all'] += 1
+            active['max_all'] = max(active['max_all'], active['all'])
+            if uses_db:
+                active['db'] += 1
+                active['max_db'] = max(active['max_db'], active['db'])
+        time.sleep(0.05)
+        with lock:
+            active['all'] -= 1
+            if uses_db:
+                active['db'] -= 1
+
+    @task(resources={'db': 1})
+    def foo():
+        track(True)
+        return TaskResult({'x': 1})
+
+    @task(resources={'db': 1})
+    def bar():
+        track(True)
+        return TaskResult({'y': 2})
+
+    @task
+    def qux():
+        track(False)
+        return TaskResult({'z': 3})
+
+    @task(depends_on=['foo.x', 'bar.y', 'qux.z'])
+    def baz(x, y, z):
+        return TaskResult({'sum': x + y + z})
+
+    pipeline = Pipeline(foo, bar, qux, baz, max_workers=3, resources={'db': 1})
+    result = pipeline.run_pipeline()
+
+    assert result.values('baz', 'sum') == 6
+    assert active['max_db'] == 1
+    assert active['max_all'] == 2
+    assert pipeline._tasks_executed == {'foo', 'bar', 'qux', 'baz'}
+
+
+def test_upward_ranks():
+
+    graph = nx.DiGraph()
+    graph.add_edges_from([('a', 'b'), ('b', 'd'), ('c', 'd')])
+
+    ranks = upward_ranks(graph, ['a', 'b', 'c', 'd'], {'a': 1, 'b': 5, 'c': 2, 'd': 1})
+    assert ranks == {'a': 7, 'b': 6, 'c': 3, 'd': 1}
+
+    ranks = upward_ranks(graph, ['a', 'b', 'c', 'd'], {'b': 5, 'c': 2, 'd': 1})
+    assert ranks['a'] == 8
+
+
+def test_pipeline_records_durations(store_path):
+
+    @task
+    def foo():
+        time.sleep(0.01)
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        return TaskResult({'y': x})
+
+    pipeline = Pipeline(foo, bar, max_workers=2)
+    pipeline.run_pipeline()
+
+    durations = pipeline.load_durations()
+    assert set(durations.keys()) == {'foo', 'bar'}
+    assert durations['foo'] >= 0.01
+
+    pipeline.run_pipeline()
+    assert pipeline.load_durations() == durations
+
+
+WATCHED_ENTRY_POINT = """
+from pathlib import Path
+from yenta.tasks import task
+
+
+@task(input_files=[{source!r}])
+def read():
+    return {{'values': {{'text': Path({source!r}).read_text()}}}}
+
+
+@task(depends_on=['read.text'])
+def shout(text):
+    return {{'values': {{'text': text.upper()}}}}
+
+
+@task
+def other():
+    return {{'values': {{'x': {constant}}}}}
+"""
+
+
+def test_watcher_reruns_affected_tasks(store_path, tmp_path):
+
+    entry_point = tmp_path / 'tasks.py'
+    source = tmp_path / 'source.txt'
+    source.write_text('hello')
+    entry_point.write_text(WATCHED_ENTRY_POINT.format(source=str(source), constant=1))
+
+    def load_tasks():
+        spec = importlib.util.spec_from_file_location('watched', entry_point)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return [module.read, module.shout, module.other]
+
+    watcher = Watcher(load_tasks, entry_point, lambda tasks: Pipeline(*tasks))
+    result = watcher.start()
+    assert result.values('shout', 'text') == 'HELLO'
+    assert watcher.pipeline._tasks_executed == {'read', 'shout', 'other'}
+    assert watcher.poll() is None
+
+    source.write_text('hello again')
+    result = watcher.poll()
+    assert result.values('shout', 'text') == 'HELLO AGAIN'
+    assert watcher.pipeline._tasks_executed == {'read', 'shout'}
+
+    entry_point.write_text(WATCHED_ENTRY_POINT.format(source=str(source), constant=22))
+    result = watcher.poll()
+    assert result.values('other', 'x') == 22
+    assert result.values('shout', 'text') == 'HELLO AGAIN'
+    assert watcher.pipeline._tasks_executed == {'other'}
+
+
+def test_concurrent_runs_share_claimed_tasks(store_path):
+
+    calls = []
+
+    @task
+    def slow():
+        calls.append(threading.get_ident())
+        time.sleep(0.2)
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['slow.x'])
+    def double(x):
+        return TaskResult({'y': 2 * x})
+
+    results = {}
+
+    def run(index):
+        results[index] = Pipeline(slow, double).run_pipeline()
+
+    runners = [threading.Thread(target=run, args=(index,)) for index in range(2)]
+    for runner in runners:
+        runner.start()
+    for runner in runners:
+        runner.join()
+
+    assert len(calls) == 1
+    assert results[0].values('double', 'y') == results[1].values('double', 'y') == 2
+    assert not (store_path / 'default' / 'slow' / '.lock').exists()
+
+
+def test_abandoned_lock_is_broken(tmp_path):
+
+    lock_path = tmp_path / 'task.lock'
+    lock_path.write_text('{"owner": "someone-else"}')
+    os.utime(lock_path, (time.time() - 60, time.time() - 60))
+
+    lock = LeaseLock(lock_path, lease=1.0)
+    assert lock.acquire(timeout=1.0)
+    assert lock.held
+
+    other = LeaseLock(lock_path, lease=1.0)
+    assert not other.acquire(blocking=False)
+
+    lock.release()
+    assert not lock_path.exists()
+    assert other.acquire(blocking=False)
+    other.release()
+
+
+def test_late_breaker_leaves_new_lock_alone(tmp_path, monkeypatch):
+
+    lock_path = tmp_path / 'task.lock'
+    lock_path.write_text('{"owner": "someone-else"}')
+    os.utime(lock_path, (time.time() - 60, time.time() - 60))
+
+    late, fresh = LeaseLock(lock_path, lease=1.0), LeaseLock(lock_path, lease=1.0)
+    open_file = os.open
+
+    def interleave(path, *args):
+        # after `late` found the lock expired, another process breaks it and `fresh` acquires it
+        if str(path).endswith('.breaking') and not fresh.held:
+            lock_path.unlink()
+            assert fresh.acquire(blocking=False)
+        return open_file(path, *args)
+
+    monkeypatch.setattr(os, 'open', interleave)
+    assert not late.acquire(blocking=False)
+    monkeypatch.undo()
+
+    assert json.loads(lock_path.read_text())['owner'] == fresh.owner
+    assert not list(tmp_path.glob('.*'))
+    fresh.release()
+
+
+def test_reused_tasks_stay_off_the_slow_paths(store_path, monkeypatch):
+
+    def make(i):
+        def t(x=0):
+            return TaskResult({'x': x + i})
+        t.__name__ = t.__qualname__ = f't{i}'
+        return task(depends_on=[f't{i - 1}.x'] if i else [])(t)
+
+    pipeline = Pipeline(*(make(i) for i in range(50)))
+    pipeline.run_pipeline()
+
+    module = sys.modules['yenta.pipeline.Pipeline']
+    calls = {'acquire': 0, 'span': 0, 'submit': 0}
+
+    def counted(name, function):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return function(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(LeaseLock, 'acquire', counted('acquire', LeaseLock.acquire))
+    monkeypatch.setattr(module, 'span', counted('span', module.span))
+    monkeypatch.setattr(ThreadPoolExecutor, 'submit', counted('submit', ThreadPoolExecutor.submit))
+    result = pipeline.run_pipeline()
+
+    assert_reused(pipeline, *(f't{i}' for i in range(50)))
+    assert result.values('t49', 'x') == sum(range(50))
+    # only the run itself takes a lock and looks up spans, none of its reused tasks does
+    assert calls['acquire'] <= 1
+    assert calls['span'] <= 3
+    assert calls['submit'] <= settings.YENTA_IO_WORKERS
+
+
+def test_results_are_released_after_their_consumers(store_path, monkeypatch):
+
+    events = []
+    release = StoredResults.release
+
+    def spy(self, task_name):
+        if self.file_name == 'result.pk' and task_name in self.held:
+            events.append(('release', task_name))
+        release(self, task_name)
+
+    monkeypatch.setattr(StoredResults, 'release', spy)
+
+    @task
+    def a():
+        events.append(('run', 'a'))
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['a.x'])
+    def b(x):
+        events.append(('run', 'b'))
+        return TaskResult({'x': x + 1})
+
+    @task(depends_on=['b.x'])
+    def c(x):
+        events.append(('run', 'c'))
+        return TaskResult({'x': x + 1})
+
+    @task(depends_on=['a.x'])
+    def d(x):
+        events.append(('run', 'd'))
+        return TaskResult({'x': x * 10})
+
+    result = Pipeline(a, b, c, d).run_pipeline()
+
+    assert events.index(('release', 'a')) > events.index(('run', 'd'))
+    assert events.index(('release', 'a')) > events.index(('run', 'b'))
+    assert events.index(('release', 'b')) > events.index(('run', 'c'))
+    assert {name for kind, name in events if kind == 'release'} == {'a', 'b', 'c', 'd'}
+
+    assert isinstance(result.task_results, StoredResults)
+    assert result.task_results.held == set()
+    assert result.values('c', 'x') == 3
+    assert result.values('d', 'x') == 10
+
+
+def test_prefetch(store_path, tmp_path, monkeypatch):
+
+    calls = []
+
+    @task
+    def a():
+        calls.append('a')
+        return TaskResult({'x': list(range(100))})
+
+    @task(depends_on=['a.x'])
+    def b(x):
+        calls.append('b')
+        return TaskResult({'x': sum(x)})
+
+    @task(depends_on=['b.x'])
+    def c(x):
+        calls.append('c')
+        return TaskResult({'x': x + 1})
+
+    @task(depends_on=['a.x', 'c.x'])
+    def d(x, c_x):
+        calls.append('d')
+        return TaskResult({'x': len(x) + c_x})
+
+    assert Pipeline(a, b, c, d).run_pipeline().values('d', 'x') == 5051
+
+    taken = []
+    take = Prefetcher.take
+
+    def spy(self, path):
+        value = take(self, path)
+        taken.append((Path(path).parent.name, Path(path).name, value is not MISSING))
+        return value
+
+    monkeypatch.setattr(Prefetcher, 'take', spy)
+    calls.clear()
+    result = Pipeline(a, b, c, d, prefetch=2).run_pipeline()
+    assert calls == []
+    assert result.values('d', 'x') == 5051
+    assert ('d', 'inputs.pk', True) in taken
+    assert ('b', 'result.pk', True) in taken
+
+    # nothing fits into an empty budget, so every file is read when it is needed
+    taken.clear()
+    assert Pipeline(a, b, c, d, prefetch=3, prefetch_budget=0).run_pipeline().values('d', 'x') == 5051
+    assert taken and not any(hit for _, _, hit in taken)
+
+    # the task directories of a large store are checked in parallel
+    for index in range(40):
+        (tmp_path / f'task_{index}').mkdir()
+        if index % 2:
+            (tmp_path / f'task_{index}' / 'result.pk').touch()
+    expected = {f'task_{index}' for index in range(1, 40, 2)}
+    assert StoredResults.stored_tasks(tmp_path, jobs=4) == expected
+    assert StoredResults.stored_tasks(tmp_path, jobs=1) == expected
+
+
+def test_file_handles(store_path, tmp_path):
+
+    source = tmp_path / 'big.bin'
+    source.write_bytes(b'abc' * 1000)
+
+    @task
+    def produce():
+        output = tmp_path / 'output.bin'
+        output.write_bytes(source.read_bytes())
+        return TaskResult({'data': FileHandle(output)})
+
+    @task(depends_on=['produce.data'])
+    def consume(data):
+        assert isinstance(data, FileHandle)
+        return TaskResult({'size': sum(len(chunk) for chunk in data.chunks(chunk_size=256)),
+                           'head': data.memmap()[:3]})
+
+    pipeline = Pipeline(produce, consume)
+    result = pipeline.run_pipeline()
+
+    handle = result.values('produce', 'data', handle=True)
+    assert handle.path == pipeline.store_path / 'produce' / 'values' / 'data.bin'
+    assert handle.digest is not None
+    assert result.values('produce', 'data') == b'abc' * 1000
+    assert result.values('consume', 'size') == 3000
+    assert result.values('consume', 'head') == b'abc'
+
+    pipeline.run_pipeline(force_rerun=['produce'])
+    assert pipeline._tasks_executed == {'produce'}
+    assert pipeline._tasks_reused == {'consume'}
+
+    source.write_bytes(b'xyz' * 10)
+    result = pipeline.run_pipeline(force_rerun=['produce'])
+    assert pipeline._tasks_executed == {'produce', 'consume'}
+    assert result.values('consume', 'head') == b'xyz'
+
+    # the store keeps a copy, which rewriting the file the task wrote does not change
+    (tmp_path / 'output.bin').write_bytes(b'overwritten')
+    result = pipeline.run_pipeline()
+    assert pipeline._tasks_reused == {'produce', 'consume'}
+    assert result.values('produce', 'data') == b'xyz' * 10
+
+
+def test_verbose_output(store_path, capsys):
+
+    @task
+    def foo():
+        return {'values': {'x': 1}}
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        return {'values': {'y': x + 1}}
+
+    result = Pipeline(foo, bar).run_pipeline()
+    assert result.values('bar', 'y') == 2
+    assert capsys.readouterr().out == ''
+
+    Pipeline(foo, bar, verbose=True).run_pipeline()
+    output = capsys.readouterr().out
+    assert 'foo' in output and 'bar' in output
+
+
+def test_progress_without_terminal(store_path, capsys):
+
+    @task
+    def foo():
+        return {'values': {'x': 1}}
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        raise ValueError('oh noes')
+
+    @task
+    def qux():
+        return {'values': {'y': 2}}
+
+    events = EventBus()
+    events.subscribe(ProgressDisplay(Console(file=io.StringIO()), summary_interval=3600))
+    Pipeline(foo, bar, qux, events=events).run_pipeline()
+    output = capsys.readouterr().out.splitlines()
+
+    # only the failure and the final counts are printed, nothing for every task that succeeds
+    assert len(output) == 2
+    assert output[0].endswith('bar')
+    assert output[1].endswith('default: 3/3 tasks, 2 executed, 0 reused, 1 failed')
+
+    events = EventBus()
+    events.subscribe(ProgressDisplay(Console(file=io.StringIO()), summary_interval=0, per_task=True))
+    Pipeline(foo, bar, qux, events=events).run_pipeline()
+    output = capsys.readouterr().out
+    assert 'foo' in output and 'qux' in output
+    assert output.count('default: ') == 4
+    assert output.splitlines()[-1].endswith('default: 3/3 tasks, 0 executed, 2 reused, 1 failed')
+
+
+def test_events(store_path, tmp_path):
+
+    @task
+    def foo():
+        return {'values': {'x': 1}}
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        raise ValueError('oh noes')
+
+    @task(depends_on=['bar.y'])
+    def baz(y):
+        return {'values': {'z': y}}
+
+    received = []
+    events = EventBus()
+    events.subscribe(received.append)
+    output = io.StringIO()
+    events.subscribe(ProgressDisplay(Console(file=output, force_terminal=True)))
+    with JsonlSink(tmp_path / 'events.jsonl') as sink:
+        events.subscribe(sink)
+        Pipeline(foo, bar, baz, events=events).run_pipeline()
+        Pipeline(foo, bar, baz, events=events).run_pipeline(up_to='foo')
+
+    assert [(event.type, event.task) for event in received] == [
+        (EventType.RUN_STARTED, None),
+        (EventType.QUEUED, 'foo'), (EventType.STARTED, 'foo'), (EventType.FINISHED, 'foo'),
+        (EventType.QUEUED, 'bar'), (EventType.STARTED, 'bar'), (EventType.FAILED, 'bar'),
+        (EventType.SKIPPED, 'baz'),
+        (EventType.RUN_FINISHED, None),
+        (EventType.RUN_STARTED, None), (EventType.QUEUED, 'foo'), (EventType.REUSED, 'foo'),
+        (EventType.RUN_FINISHED, None),
+    ]
+    assert received[0].total == 3
+    assert received[3].size > 0
+    assert received[6].error == 'oh noes'
+    assert 'ValueError' in received[6].traceback
+
+    lines = [json.loads(line) for line in (tmp_path / 'events.jsonl').read_text().splitlines()]
+    assert lines == [event.to_dict() for event in received]
+    assert 'oh noes' in output.getvalue()
+
+
+def test_trace(store_path, tmp_path):
+
+    @task
+    def foo():
+        path = tmp_path / 'foo.txt'
+        path.write_text('foo')
+        return {'values': {'x': FileHandle(path)}}
+
+    @task
+    def bar():
+        return {'values': {'y': 1}}
+
+    @task(depends_on=['foo.x', 'bar.y'])
+    def baz(x, y):
+        return {'values': {'z': y}}
+
+    tracer = Tracer()
+    Pipeline(foo, bar, baz, max_workers=2, tracer=tracer).run_pipeline()
+    tracer.write(tmp_path / 'trace.json')
+
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    spans = [event for event in events if event['ph'] == 'X']
+    tasks = {event['name']: event for event in spans if event['cat'] == 'task'}
+    assert set(tasks) == {'foo', 'bar', 'baz'}
+    assert {'run default', 'load_pipeline', 'build_args', 'load', 'invoke', 'cache_result', 'hash',
+            'save_durations'} <= {event['name'] for event in spans}
+
+    # the steps of a task are nested within its span, on the track of the thread that executed it
+    foo_span = tasks['foo']
+    steps = [event for event in spans if event['tid'] == foo_span['tid'] and event['cat'] != 'task'
+             and foo_span['ts'] <= event['ts'] <= foo_span['ts'] + foo_span['dur']]
+    assert {'build_args', 'invoke', 'cache_result', 'hash'} <= {event['name'] for event in steps}
+
+    run_span = [event for event in spans if event['name'] == 'run default'][0]
+    thread_names = {event['tid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    assert thread_names[foo_span['tid']] != thread_names[run_span['tid']]
+
+
+def test_run_history(store_path):
+
+    delay = {'foo': 0.0}
+
+    @task
+    def foo():
+        time.sleep(delay['foo'])
+        return {'values': {'x': 'x' * 10000}}
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        raise ValueError('oh noes')
+
+    @task(depends_on=['bar.y'])
+    def baz(y):
+        return {'values': {'z': y}}
+
+    pipeline = Pipeline(foo, bar, baz)
+    pipeline.run_pipeline()
+    pipeline.run_pipeline()
+    delay['foo'] = 0.1
+    pipeline.run_pipeline(force_rerun=['foo'])
+
+    history = pipeline.history
+    first, second, third = history.runs()
+    assert {name: record.state for name, record in first.tasks.items()} == \
+        {'foo': 'executed', 'bar': 'failed', 'baz': 'skipped'}
+    assert first.tasks['foo'].size > 10000
+    assert second.tasks['foo'].state == 'reused'
+    assert second.reuse_rate == 0.5
+    assert history.get('-1').run_id == third.run_id
+    assert history.get(second.run_id).run_id == second.run_id
+    # the shortest prefix that no other run shares, since the runs may all have started in the same second
+    prefix = next(second.run_id[:length] for length in range(1, len(second.run_id))
+                  if not first.run_id.startswith(second.run_id[:length])
+                  and not third.run_id.startswith(second.run_id[:length]))
+    assert history.get(prefix).run_id == second.run_id
+
+    regressions = compare_runs(first, third, min_duration=0.05)
+    assert [(regression.task, regression.metric) for regression in regressions] == [('foo', 'duration')]
+    assert compare_runs(third, first) == []
+
+
+def test_cache_bundle(store_path, tmp_path, monkeypatch):
+
+    @task
+    def foo():
+        path = tmp_path / 'foo.bin'
+        path.write_bytes(b'foo' * 1000)
+        return {'values': {'data': FileHandle(path)}}
+
+    @task(depends_on=['foo.data'])
+    def bar(data):
+        return {'values': {'size': len(data.read())}}
+
+    @task
+    def baz():
+        return {'values': {'z': 1}}
+
+    pipeline = Pipeline(foo, bar, baz)
+    pipeline.run_pipeline()
+    bundle = tmp_path / 'cache.tar'
+    assert export_bundle(pipeline, bundle, ['foo', 'bar'], compression='xz', jobs=2) == ['bar', 'foo']
+
+    # a fresh workspace, in which baz has been edited since the bundle was made
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', tmp_path / 'fresh')
+
+    @task(depends_on=['foo.data'])
+    def bar(data):
+        return {'values': {'size': -1}}
+
+    fresh = Pipeline(foo, bar, baz)
+    assert import_bundle(fresh, bundle) == {'foo': 'imported', 'bar': 'fingerprint mismatch'}
+    assert import_bundle(fresh, bundle)['foo'] == 'already stored'
+
+    result = fresh.run_pipeline()
+    assert fresh._tasks_reused == {'foo'}
+    assert fresh._tasks_executed == {'bar', 'baz'}
+    handle = result.values('foo', 'data', handle=True)
+    assert handle.path == fresh.store_path / 'foo' / 'values' / 'data.bin'
+    assert handle.read() == b'foo' * 1000
+
+
+@pytest.mark.parametrize('mode', ['copy', 'link'])
+def test_capture_artifacts(store_path, tmp_path, mode):
+
+    report = tmp_path / 'out' / 'report.txt'
+    calls = []
+
+    @task
+    def foo():
+        calls.append('foo')
+        report.parent.mkdir(exist_ok=True)
+        report.write_text('report')
+        return TaskResult({'report': FileArtifact(report)})
+
+    @task(depends_on=['foo.report'])
+    def bar(report_artifact):
+        calls.append('bar')
+        return TaskResult({'length': len(Path(report_artifact.location).read_text())})
+
+    pipeline = Pipeline(foo, bar, capture_artifacts=mode)
+    pipeline.run_pipeline()
+    artifact = pipeline.load_task('foo').task_results['foo'].values['report']
+    assert pipeline.artifact_store.path(artifact.hash).read_text() == 'report'
+
+    shutil.rmtree(report.parent)
+    result = pipeline.run_pipeline()
+    assert report.read_text() == 'report'
+    assert pipeline._tasks_reused == {'foo', 'bar'}
+    assert result.values('bar', 'length') == 6
+    assert calls == ['foo', 'bar']
+
+    # without its captured copy, a missing file can only be produced by executing the task again
+    report.unlink()
+    shutil.rmtree(pipeline.artifact_store.root)
+    pipeline.run_pipeline()
+    assert 'foo' in pipeline._tasks_executed
+    assert calls[:3] == ['foo', 'bar', 'foo']
+    assert report.read_text() == 'report'
+
+
+def test_stale_artifacts(store_path, tmp_path, monkeypatch):
+
+    report = tmp_path / 'report.txt'
+
+    @task
+    def foo():
+        report.write_text('report')
+        return TaskResult({'report': FileArtifact(report)})
+
+    @task(depends_on=['foo.report'])
+    def bar(report_artifact):
+        return TaskResult({'length': len(Path(report_artifact.location).read_text())})
+
+    @task
+    def baz():
+        return TaskResult({'z': 1})
+
+    pipeline = Pipeline(foo, bar, baz)
+    pipeline.run_pipeline()
+    pipeline.run_pipeline()
+    assert pipeline._tasks_reused == {'foo', 'bar', 'baz'}
+
+    # an edit made outside of the pipeline is undone by executing the task that wrote the file
+    # again; as it writes the same contents, the tasks that depend on the file are still reused
+    report.write_text('edited')
+    pipeline.run_pipeline()
+    assert pipeline._tasks_executed == {'foo'}
+    assert pipeline._tasks_reused == {'bar', 'baz'}
+    assert report.read_text() == 'report'
+
+    report.unlink()
+    pipeline.run_pipeline()
+    assert pipeline._tasks_executed == {'foo'}
+    assert report.exists()
+
+    # a file that is touched but unchanged is hashed once, after which its new signature is stored
+    hashed = []
+    artifact_hash = FileArtifact.artifact_hash
+    monkeypatch.setattr(FileArtifact, 'artifact_hash', lambda self: hashed.append(self.location) or artifact_hash(self))
+    os.utime(report, ns=(report.stat().st_atime_ns, report.stat().st_mtime_ns + 10 ** 9))
+    for _ in range(3):
+        pipeline.run_pipeline()
+        assert pipeline._tasks_reused == {'foo', 'bar', 'baz'}
+    assert len(hashed) == 1
+
+
+def test_share_results(store_path, tmp_path):
+
+    calls = []
+
+    @task
+    def foo():
+        calls.append('foo')
+        path = tmp_path / 'foo.bin'
+        path.write_bytes(b'foo')
+        return TaskResult({'data': FileHandle(path), 'x': 1})
+
+    @task(depends_on=['foo.data', 'foo.x'])
+    def bar(data, x):
+        calls.append('bar')
+        return TaskResult({'y': len(data.read()) + x})
+
+    @task(depends_on=['bar.y'])
+    def baz(y):
+        calls.append('baz')
+        return TaskResult({'z': y * 2})
+
+    Pipeline(foo, bar, baz, name='east', share_results=True).run_pipeline()
+    assert calls == ['foo', 'bar', 'baz']
+
+    west = Pipeline(foo, bar, baz, name='west', share_results=True)
+    result = west.run_pipeline()
+    assert calls == ['foo', 'bar', 'baz']
+    assert west._tasks_reused == {'foo', 'bar', 'baz'}
+    handle = result.values('foo', 'data', handle=True)
+    assert handle.path == west.store_path / 'foo' / 'values' / 'data.bin'
+    assert handle.read() == b'foo'
+    assert result.values('baz', 'z') == 8
+    assert StoredResults.stored_tasks(west.store_path) == {'foo', 'bar', 'baz'}
+
+    # a task whose code differs is not shared, while its unchanged dependencies still are
+    @task(depends_on=['bar.y'])
+    def baz(y):
+        calls.append('baz')
+        return TaskResult({'z': y * 3})
+
+    north = Pipeline(foo, bar, baz, name='north', share_results=True)
+    assert north.run_pipeline().values('baz', 'z') == 12
+    assert north._tasks_reused == {'foo', 'bar'}
+    assert calls == ['foo', 'bar', 'baz', 'baz']
+
+    Pipeline(foo, bar, baz, name='south').run_pipeline()
+    assert calls == ['foo', 'bar', 'baz', 'baz', 'foo', 'bar', 'baz']
+
+    # removing the shared results of a task makes the next pipeline execute it, and only it
+    index = ResultIndex(settings.YENTA_STORE_PATH)
+    assert index.remove('foo') == 1
+    assert index.remove('foo') == 0
+    calls.clear()
+    Pipeline(foo, bar, baz, name='up', share_results=True).run_pipeline()
+    assert calls == ['foo']
+
+    # entries that were neither published nor adopted lately are pruned
+    stale = time.time() - 7200
+    for entry in index.path.glob('*/*/*'):
+        os.utime(entry, (stale, stale))
+    Pipeline(foo, bar, baz, name='down', share_results=True).run_pipeline()
+    assert calls == ['foo']
+    assert index.prune(3600) == 1
+    assert sorted(path.name for path in index.path.iterdir()) == ['bar', 'baz', 'foo']
+    assert index.prune(0) == 3
+    assert list(index.path.iterdir()) == []
+
+
+def test_pipeline_params(store_path):
+
+    calls = []
+
+    @task
+    def foo():
+        calls.append('foo')
+        return TaskResult({'x': 2})
+
+    @task(depends_on=['foo.x'], params=['power', 'offset'])
+    def bar(x, power, offset=0):
+        calls.append('bar')
+        return TaskResult({'y': x ** power + offset})
+
+    with pytest.raises(InvalidParameterError):
+        Pipeline(foo, bar).run_pipeline()
+
+    assert Pipeline(foo, bar, params={'power': 3}).run_pipeline().values('bar', 'y') == 8
+    assert Pipeline(foo, bar, params={'power': 3}).run_pipeline().values('bar', 'y') == 8
+    assert Pipeline(foo, bar, params={'power': 3, 'offset': 1}).run_pipeline().values('bar', 'y') == 9
+    assert calls == ['foo', 'bar', 'bar']
+
+    with pytest.raises(InvalidTaskDefinitionError):
+        @task(params=['power'])
+        def baz(x):
+            pass
+
+
+def test_sweep(store_path, tmp_path):
+
+    calls = []
+    lock = threading.Lock()
+
+    @task
+    def load():
+        with lock:
+            calls.append('load')
+        return TaskResult({'data': [1, 2, 3]})
+
+    @task(depends_on=['load.data'], params=['scale'])
+    def scaled(data, scale):
+        with lock:
+            calls.append(f'scaled {scale}')
+        return TaskResult({'data': [value * scale for value in data]})
+
+    @task(depends_on=['scaled.data'], params=['label'])
+    def total(data, label):
+        with lock:
+            calls.append(f'total {label}')
+        return TaskResult({'total': f'{label}: {sum(data)}'})
+
+    spec = tmp_path / 'sweep.json'
+    spec.write_text(json.dumps({'scale': [1, 2, 3], 'label': 'sum'}))
+    configurations = load_sweep(spec)
+    assert configurations == [{'scale': 1, 'label': 'sum'}, {'scale': 2, 'label': 'sum'},
+                              {'scale': 3, 'label': 'sum'}]
+
+    sweep = Sweep([load, scaled, total], configurations, name='grid', max_parallel=3)
+    assert sweep.swept_params == {'scale'}
+    assert sweep.divergent_tasks() == {'scaled', 'total'}
+
+    results = sweep.run()
+    assert sorted(results[key].values('total', 'total') for key in results) == ['sum: 12', 'sum: 18', 'sum: 6']
+    assert calls.count('load') == 1
+    assert sorted(calls[1:]) == ['scaled 1', 'scaled 2', 'scaled 3', 'total sum', 'total sum', 'total sum']
+    for key, pipeline in sweep.pipelines.items():
+        assert pipeline.name == f'grid@{key}'
+        assert StoredResults.stored_tasks(pipeline.store_path) == {'load', 'scaled', 'total'}
+
+    calls.clear()
+    sweep.run()
+    assert calls == []
+
+
+def test_sweep_impure_shared_task(store_path):
+
+    calls = []
+    lock = threading.Lock()
+
+    @task(pure=False)
+    def fetch():
+        with lock:
+            calls.append('fetch')
+        return TaskResult({'data': [1, 2, 3]})
+
+    @task(depends_on=['fetch.data'], params=['scale'])
+    def scaled(data, scale):
+        with lock:
+            calls.append(f'scaled {scale}')
+        return TaskResult({'total': sum(data) * scale})
+
+    sweep = Sweep([fetch, scaled], [{'scale': 1}, {'scale': 2}], name='impure', max_parallel=2)
+    results = sweep.run()
+    assert sorted(result.values('scaled', 'total') for result in results.values()) == [6, 12]
+    assert sorted(calls) == ['fetch', 'scaled 1', 'scaled 2']
+    for pipeline in sweep.pipelines.values():
+        assert StoredResults.stored_tasks(pipeline.store_path) == {'fetch', 'scaled'}
+
+    # an impure task is executed again by every run of the sweep, but still only once
+    calls.clear()
+    sweep.run()
+    assert calls == ['fetch']
+
+
+def test_pipeline_group(store_path):
+
+    threads = []
+    lock = threading.Lock()
+
+    @task
+    def foo():
+        with lock:
+            threads.append(threading.current_thread().name)
+        return TaskResult({'x': 1})
+
+    @task(depends_on=['foo.x'])
+    def bar(x):
+        with lock:
+            threads.append(threading.current_thread().name)
+        return TaskResult({'y': x + 1})
+
+    group = PipelineGroup([Pipeline(foo, bar, name=name) for name in ('east', 'west', 'north')], max_workers=2)
+    results = group.run()
+    assert sorted(results) == ['east', 'north', 'west']
+    assert all(result.values('bar', 'y') == 2 for result in results.values())
+    assert len(threads) == 6
+    assert all(name.startswith('yenta-worker') for name in threads)
+    assert all(pipeline.executor is None for pipeline in group.pipelines.values())
+
+    (store_path / 'grid@0123456789ab').mkdir()
+    assert stored_pipelines(store_path) == ['east', 'north', 'west']
+
+    threads.clear()
+    group.run()
+    assert threads == []
+    assert all(pipeline._tasks_reused == {'foo', 'bar'} for pipeline in group.pipelines.values())
+
+    with pytest.raises(PipelineConfigError):
+        PipelineGroup([Pipeline(foo, bar, name='east'), Pipeline(foo, bar, name='east')])
+
+
+def test_memory_store(make_pipeline, yenta_store):
+
+    calls = []
+
+    @task
+    def foo():
+        calls.append('foo')
+        return TaskResult({'x': [1, 2, 3]})
+
+    @task(depends_on=['foo.x'], map=True)
+    def bar(x):
+        calls.append('bar')
+        return TaskResult({'y': x * 2})
+
+    @task(depends_on=['bar.y'], params=['offset'])
+    def baz(y, offset):
+        calls.append('baz')
+        return TaskResult({'z': sum(y) + offset})
+
+    pipeline = make_pipeline(foo, bar, baz, params={'offset': 1})
+    assert pipeline.run_pipeline().values('baz', 'z') == 13
+    assert_executed(pipeline, 'foo', 'bar', 'baz')
+    assert_reused(pipeline)
+    assert sorted(calls) == ['bar', 'bar', 'bar', 'baz', 'foo']
+
+    calls.clear()
+    pipeline = make_pipeline(foo, bar, baz, params={'offset': 2})
+    assert pipeline.run_pipeline().values('baz', 'z') == 14
+    assert_executed(pipeline, 'baz')
+    assert_reused(pipeline, 'foo', 'bar')
+    assert calls == ['baz']
+    assert len(pipeline.history.runs()) == 2
+    assert set(pipeline.load_durations()) == {'foo', 'bar', 'baz'}
+
+    with pytest.raises(AssertionError, match="missing \\['baz'\\]"):
+        assert_reused(pipeline, 'foo', 'bar', 'baz')
+
+    # the profiles of tasks are kept in the memory store as well
+    pipeline = make_pipeline(foo, bar, baz, params={'offset': 3}, profile=['baz'])
+    assert pipeline.run_pipeline().values('baz', 'z') == 15
+    assert pipeline.memory_store.profiles['baz'].calls == 1
+
+    # nothing is written to disk, and the pipelines of other tests never see these results
+    assert not yenta_store.exists()
+    assert make_pipeline(foo, bar, baz, name='other', params={'offset': 2}).run_pipeline().values('baz', 'z') == 14
+    assert Pipeline.load_pipeline(settings.YENTA_STORE_PATH / 'default').task_results == {}
+
+    with pytest.raises(PipelineConfigError):
+        Pipeline(foo, memory_store=MemoryStore(), share_results=True)
+
+
+def test_export_task_graph(store_path, tmp_path):
+
+    source = {'value': 1}
+
+    @task
+    def a():
+        return TaskResult({'x': source['value']})
+
+    @task(depends_on=['a.x'])
+    def b(x):
+        return TaskResult({'x': x + 1})
+
+    @task(depends_on=['b.x'])
+    def c(x):
+        return TaskResult({'x': x + 1})
+
+    @task(depends_on=['a.x'])
+    def d(x):
+        return TaskResult({'x': x * 2})
+
+    pipeline = Pipeline(a, b, c, d)
+    pipeline.run_pipeline()
+    source['value'] = 2
+    pipeline.run_pipeline(force_rerun=['a'], only=['a'])
+
+    assert export_task_graph(pipeline, tmp_path / 'graph.json') == 4
+    graph = json.loads((tmp_path / 'graph.json').read_text())
+    nodes = {node['id']: node for node in graph['nodes']}
+    assert {name: node['cache'] for name, node in nodes.items()} == \
+        {'a': 'cached', 'b': 'stale', 'c': 'stale', 'd': 'stale'}
+    assert nodes['a']['status'] == 'executed' and nodes['a']['size'] > 0 and nodes['a']['duration'] is not None
+    assert sorted((edge['source'], edge['target']) for edge in graph['edges']) == \
+        [('a', 'b'), ('a', 'd'), ('b', 'c')]
+
+    assert export_task_graph(pipeline, tmp_path / 'graph.dot', around='c', depth=1) == 2
+    dot = (tmp_path / 'graph.dot').read_text()
+    assert '"b" -> "c";' in dot and 'fillcolor=khaki' in dot and '"a"' not in dot
+
+    assert export_task_graph(pipeline, tmp_path / 'graph.graphml', only_stale=True) == 3
+    root = ElementTree.parse(tmp_path / 'graph.graphml').getroot()
+    namespace = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+    assert {node.get('id') for node in root.iterfind('.//g:node', namespace)} == {'b', 'c', 'd'}
+    assert len(root.findall('.//g:edge', namespace)) == 1
+
+    pipeline.save_durations({'a': 1.0, 'b': 1.0, 'c': 1.0, 'd': 5.0})
+    assert critical_path(pipeline) == ['a', 'd']
+    assert export_task_graph(pipeline, tmp_path / 'path.txt', on_critical_path=True, annotate=False) == 2
+    assert (tmp_path / 'path.txt').read_text().startswith('digraph "default"')
+
+    with pytest.raises(GraphExportError):
+        export_task_graph(pipeline, tmp_path / 'graph.dot', around='nonexistent')
@@ -55,3 +55,47 @@ def test_task_definition():
 
     assert(foo.task_def == expected_def)
 
+
+def test_invalid_mapped_task():
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(depends_on=['bar'], map=True)
+        def foo(bar_result):
+            pass
+
+    assert('must depend on an explicit or selected value' in str(ex.value))
+
+
+def test_invalid_incremental_task():
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+
+        @task(depends_on=['bar.x'], incremental=True)
+        def foo(x):
+            pass
+
+    assert('must accept a `previous` parameter' in str(ex.value))
+
+
+def test_param_spec_with_selectors():
+
+    def selector(result):
+        return result
+
+    @task
+    def foo(x, y):
+        pass
+
+    spec = build_parameter_spec(foo, ['bar'], selectors={'x': selector, 'y': selector})
+    expected_spec = [
+        ParameterSpec('x', ParameterType.PIPELINE_RESULTS, ResultSpec('bar'), selector),
+        ParameterSpec('y', ParameterType.PIPELINE_RESULTS, selector=selector)
+    ]
+
+    assert(spec == expected_spec)
+
+    with pytest.raises(InvalidTaskDefinitionError) as ex:
+        _ = build_parameter_spec(foo, ['bar'], selectors={'z': selector})
+
+    assert('not a parameter of foo' in str(ex.value))
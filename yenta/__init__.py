@@ -3,3 +3,8 @@
 __author__ = """Jerry Vinokurov"""
 __email__ = 'grapesmoker@gmail.com'
 __version__ = '0.4.0'
+
+import logging
+
+# the logs are only written when the application configures a handler, e.g. `yenta --log-file`
+logging.getLogger(__name__).addHandler(logging.NullHandler())
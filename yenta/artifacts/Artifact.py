@@ -1,9 +1,9 @@
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Union
+from typing import List, Optional, Union
 
-from yenta.utils.files import file_hash
+from yenta.utils.files import file_hash, stat_signature
 
 
 @dataclass
@@ -27,14 +27,55 @@ class Artifact:
         return self.location == other.location and self.hash == other.hash
 
 
-@dataclass
+@dataclass(eq=False)
 class FileArtifact(Artifact):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._path: Path = Path(self.location)
+        self._stat = None
         if self._path.exists() and not self._path.is_dir():
+            self._stat = stat_signature(self._path)
             self.hash = self.artifact_hash()
 
     def artifact_hash(self):
         return file_hash(self._path).hexdigest()
+
+    def is_fresh(self) -> bool:
+        """ Check whether the file of the artifact still exists and has the contents it had when the
+            artifact was created. The modification time, size and inode of the file are compared
+            first, and the file is only hashed again when they differ; a file found unchanged by
+            its hash is not hashed again by later checks of the same artifact, nor, once a pipeline
+            has stored its reused result again, by later runs. Directories, and
+            files that did not exist when the artifact was created, only need to exist.
+
+        :return: True or False
+        :rtype: bool
+        """
+        signature = stat_signature(self._path)
+        if signature is None:
+            return False
+        if signature == getattr(self, '_stat', None) or self.hash is None or self._path.is_dir():
+            return True
+        if self.artifact_hash() != self.hash:
+            return False
+
+        self._stat = signature
+        return True
+
+
+def file_artifacts(value) -> List[FileArtifact]:
+    """ Find the file artifacts in a value of a task result, which may be an artifact itself or
+        a list, tuple, set or dict of them.
+
+    :param value: The value.
+    :return: The artifacts.
+    :rtype: List[FileArtifact]
+    """
+    if isinstance(value, FileArtifact):
+        return [value]
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple, set)):
+        return [item for item in value if isinstance(item, FileArtifact)]
+    return []
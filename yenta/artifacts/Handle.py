@@ -0,0 +1,138 @@
+import mmap
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Union
+
+from yenta.utils.files import copy_file, file_hash
+
+
+@dataclass
+class FileHandle:
+    """ A value that lives in a file rather than in the pickled result of its task. Tasks may
+        return handles to files they wrote, which are then copied into the store instead of
+        being pickled, and tasks that depend on such a value receive the handle, through which
+        they can read as much or as little of the file as they need.
+
+        The file in the store is a copy, so changing the original file afterwards does not change
+        the stored value; handles to files in the store must not be written through.
+    """
+
+    path: Union[str, Path]
+    digest: Optional[str] = None
+
+    def __post_init__(self):
+
+        self.path = Path(self.path)
+
+    @property
+    def size(self) -> int:
+
+        return self.path.stat().st_size
+
+    def open(self, mode: str = 'rb'):
+        """ Open the file.
+
+        :param str mode: The mode in which to open the file.
+        :return: The file object.
+        """
+        return open(self.path, mode)
+
+    def read(self) -> bytes:
+        """ Read the entire file.
+
+        :return: The contents of the file.
+        :rtype: bytes
+        """
+        return self.path.read_bytes()
+
+    def chunks(self, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+        """ Iterate over the contents of the file in chunks.
+
+        :param int chunk_size: The size of each chunk, in bytes.
+        :return: An iterator over the chunks.
+        :rtype: Iterator[bytes]
+        """
+        with self.open() as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def memmap(self) -> mmap.mmap:
+        """ Map the file into memory, read-only.
+
+        :return: The memory map.
+        :rtype: mmap.mmap
+        """
+        with self.open() as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def store_file_handles(values: Dict[str, Any], directory: Path):
+    """ Copy the files of the handles among `values`, including handles in lists, into
+        `directory` and point the handles at the copies. The copies are clones on file systems
+        that support them, which share the bytes of the original until either one is changed,
+        and never hard links, which would let a later change to the original alter the stored
+        value. Handles are fingerprinted, so that tasks that depend on them are executed again
+        when their contents change.
+
+    :param dict values: The values of a task result; modified in place.
+    :param Path directory: The directory in which to store the files.
+    :return: None
+    """
+    handles = []
+    for name, value in values.items():
+        if isinstance(value, FileHandle):
+            handles.append((name, value))
+        elif isinstance(value, (list, tuple)):
+            handles.extend((f'{name}.{index}', item) for index, item in enumerate(value)
+                           if isinstance(item, FileHandle))
+
+    for name, handle in handles:
+        target = directory / f'{name}{handle.path.suffix}'
+        if handle.path.resolve() != target.resolve():
+            copy_file(handle.path, target)
+            handle.path = target
+        if handle.digest is None:
+            handle.digest = file_hash(handle.path).hexdigest()
+
+
+def relocate_file_handles(obj: Any, source: Path, target: Path) -> int:
+    """ Point the handles found in `obj`, e.g. a task result or the inputs of a task, whose files
+        lie in the directory `source` at the same files in the directory `target`. Handles are
+        found in dicts, lists, tuples and sets and in the attributes of other objects.
+
+    :param obj: The object containing the handles; modified in place.
+    :param Path source: The directory in which the files were.
+    :param Path target: The directory in which the files are now.
+    :return: The number of handles that were relocated.
+    :rtype: int
+    """
+    sources = {Path(source), Path(source).resolve()}
+    relocated = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (str, bytes, int, float, bool, type(None), Path)):
+            continue
+        seen.add(id(item))
+
+        if isinstance(item, FileHandle):
+            for directory in sources:
+                try:
+                    item.path = Path(target) / item.path.relative_to(directory)
+                except ValueError:
+                    continue
+                relocated += 1
+                break
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.extend(vars(item).values())
+
+    return relocated
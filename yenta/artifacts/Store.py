@@ -0,0 +1,93 @@
+import logging
+
+from pathlib import Path
+from typing import Any, Dict
+
+from yenta.artifacts.Artifact import FileArtifact, file_artifacts
+from yenta.utils.files import copy_file, file_hash, stat_signature
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactStore:
+    """ A content-addressed area of the store of a pipeline, in which the files of the
+        `FileArtifact`s produced by tasks are kept under their hash. When the result of a task
+        is reused but the file of one of its artifacts is missing, e.g. in a fresh workspace,
+        the file is restored from here instead of the task being executed again.
+
+        Files are either copied, which clones them on file systems that support it, or hard
+        linked, which takes no space but means that a file changed in place after the task
+        that wrote it has finished also changes its captured copy. Directories are not captured.
+    """
+
+    DIRECTORY = '.artifacts'
+    MODES = ('copy', 'link')
+
+    def __init__(self, store_path: Path, mode: str = 'copy'):
+        """
+        :param Path store_path: The directory in which the pipeline is stored.
+        :param str mode: How files are captured and restored; either `copy` or `link`.
+        """
+
+        self.root = Path(store_path) / self.DIRECTORY
+        self.mode = mode
+
+    def path(self, digest: str) -> Path:
+        """ Return the path at which the file with a given hash is kept.
+
+        :param str digest: The hash of the file, as computed by `FileArtifact.artifact_hash`.
+        :return: The path.
+        :rtype: Path
+        """
+        return self.root / digest[:2] / digest
+
+    def capture(self, artifact: FileArtifact) -> bool:
+        """ Keep the file of an artifact, unless a file with the same contents is kept already.
+
+        :param FileArtifact artifact: The artifact; its hash is computed if it is not set.
+        :return: Whether the file is kept.
+        :rtype: bool
+        """
+        location = Path(artifact.location)
+        if not location.is_file():
+            return False
+        if artifact.hash is None:
+            artifact._stat = stat_signature(location)
+            artifact.hash = file_hash(location).hexdigest()
+
+        target = self.path(artifact.hash)
+        if not target.exists():
+            copy_file(location, target, self.mode == 'link')
+        return True
+
+    def restore(self, artifact: FileArtifact) -> bool:
+        """ Put the kept file of an artifact back at its location if the file is missing.
+
+        :param FileArtifact artifact: The artifact.
+        :return: Whether the file of the artifact exists.
+        :rtype: bool
+        """
+        location = Path(artifact.location)
+        if location.exists():
+            return True
+
+        source = self.path(artifact.hash) if artifact.hash else None
+        if source is None or not source.exists():
+            return False
+        logger.debug('Restoring %s from the store', location)
+        copy_file(source, location, self.mode == 'link')
+        return True
+
+    def capture_values(self, values: Dict[str, Any]):
+        """ Keep the files of all the artifacts among the values of a task result. A file that
+            cannot be kept is logged and does not fail the task.
+
+        :param dict values: The values of the task result.
+        :return: None
+        """
+        for value in values.values():
+            for artifact in file_artifacts(value):
+                try:
+                    self.capture(artifact)
+                except OSError as ex:
+                    logger.warning('Unable to capture %s: %s', artifact.location, ex)
@@ -1 +1,3 @@
-from .Artifact import Artifact, FileArtifact
+from .Artifact import Artifact, FileArtifact, file_artifacts
+from .Handle import FileHandle, store_file_handles, relocate_file_handles
+from .Store import ArtifactStore
@@ -1,23 +1,43 @@
 #!/usr/bin/env python3
 """Console script for yenta."""
+import io
+import json
 import sys
 import click
 import configparser
+import contextlib
 import importlib.util
 import more_itertools
 import shutil
 import os
+import subprocess
+import tarfile
+import time
+import traceback
 
+from rich.table import Table
 from rich.tree import Tree
 from rich.text import Text
 from rich import print
 
 from typing import Iterable
-from networkx.drawing.nx_pydot import to_pydot
 from colorama import init, Fore, Style
 from pathlib import Path
 from yenta.config import settings
-from yenta.pipeline.Pipeline import Pipeline, TaskStatus
+from yenta.pipeline.Bundle import COMPRESSIONS, BundleError, export_bundle, import_bundle
+from yenta.pipeline.Events import EventBus, JsonlSink, ProgressDisplay
+from yenta.pipeline.Graph import GRAPH_FORMATS, GraphExportError, export_task_graph
+from yenta.pipeline.Group import PipelineGroup, stored_pipelines
+from yenta.pipeline.Pipeline import InvalidParameterError, Pipeline, TaskStatus
+from yenta.pipeline.History import RunHistory, UnknownRunError, compare_runs
+from yenta.pipeline.Index import ResultIndex
+from yenta.pipeline.Profile import NoProfileError, ProfileReport
+from yenta.pipeline.Distributed import Coordinator, DirectoryBroker, Worker
+from yenta.pipeline.Sweep import Sweep, SweepError, load_sweep
+from yenta.pipeline.Watch import Watcher
+from yenta.daemon import Daemon, daemon_is_running, send_request, socket_path_for
+from yenta.utils.cache import LRUCache
+from yenta.utils.trace import Tracer
 
 import logging
 
@@ -28,7 +48,22 @@ CHECK_MARK = u'\u2714'
 X_MARK = u'\u2718'
 
 
+# set while `yenta daemon` serves a request, so that commands run in place instead of being forwarded
+IN_DAEMON = False
+# the pickled results and inputs kept in memory by `yenta daemon`, which are unpickled again on every access
+RESULT_CACHE = None
+
+_loaded_tasks = {}
+_log_handler = None
+
+
 def load_tasks(entry_file):
+    # the module is only executed again once the entry point changes, which keeps a daemon warm
+    entry_path = Path(entry_file).resolve()
+    version = entry_path.stat().st_mtime_ns
+    if _loaded_tasks.get(entry_path, (None, None))[0] == version:
+        return _loaded_tasks[entry_path][1]
+
     spec = importlib.util.spec_from_file_location('main', entry_file)
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
@@ -36,19 +71,177 @@ def load_tasks(entry_file):
     tasks = [func for _, func in module.__dict__.items()
              if callable(func) and hasattr(func, '_yenta_task')]
 
+    _loaded_tasks[entry_path] = (version, tasks)
     return tasks
 
 
+def forward_to_daemon(command, **params):
+    """ Run a command in the daemon serving the current store, if forwarding is enabled and there
+        is one. The daemon runs the command with the working directory and the environment of
+        this process, so that the settings and the tasks see the same environment variables.
+
+    :param str command: The name of the command.
+    :param params: The parameters of the command; must be JSON-serializable.
+    :return: True if the daemon ran the command, False if it must be run in this process.
+    :rtype: bool
+    """
+    if IN_DAEMON or not settings.YENTA_USE_DAEMON:
+        return False
+    socket_path = socket_path_for(settings.YENTA_STORE_PATH)
+    if not socket_path.exists():
+        return False
+
+    request = {'command': command, 'params': params, 'cwd': os.getcwd(), 'env': dict(os.environ),
+               'entry_point': str(Path(settings.YENTA_ENTRY_POINT).resolve()),
+               'store_path': str(Path(settings.YENTA_STORE_PATH).resolve()),
+               'log_file': str(settings.YENTA_LOG_FILE) if settings.YENTA_LOG_FILE else None,
+               'event_log': str(settings.YENTA_EVENT_LOG) if settings.YENTA_EVENT_LOG else None}
+    try:
+        response = send_request(socket_path, request)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+
+    sys.stdout.write(response['output'])
+    if response['exit_code']:
+        sys.exit(response['exit_code'])
+    return True
+
+
+def handle_daemon_request(request):
+    """ Run a command forwarded by `forward_to_daemon`, capturing its output.
+
+    :param dict request: The request.
+    :return: The output of the command and its exit code.
+    :rtype: Tuple[str, int]
+    """
+    global IN_DAEMON
+
+    # the command runs in the environment of the client, from which the settings are read again;
+    # the daemon serves one request at a time, so its own environment is simply restored afterwards
+    daemon_environ = dict(os.environ)
+    daemon_settings = {name: value for name, value in vars(settings).items() if name.isupper()}
+    os.environ.clear()
+    os.environ.update(request['env'])
+    importlib.reload(settings)
+
+    os.chdir(request['cwd'])
+    if request['cwd'] not in sys.path:
+        sys.path.append(request['cwd'])
+    settings.YENTA_ENTRY_POINT = Path(request['entry_point'])
+    settings.YENTA_STORE_PATH = Path(request['store_path'])
+    settings.YENTA_LOG_FILE = request['log_file']
+    settings.YENTA_EVENT_LOG = request['event_log']
+    configure_logging(settings.YENTA_LOG_FILE)
+
+    command = yenta.get_command(None, request['command'])
+    output = io.StringIO()
+    exit_code = 0
+    IN_DAEMON = True
+    try:
+        with contextlib.redirect_stdout(output):
+            command.callback(**request['params'])
+    except SystemExit as ex:
+        exit_code = ex.code or 0
+    except Exception:
+        output.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        IN_DAEMON = False
+        os.environ.clear()
+        os.environ.update(daemon_environ)
+        for name, value in daemon_settings.items():
+            setattr(settings, name, value)
+
+    return output.getvalue(), exit_code
+
+
+def configure_logging(log_file):
+    """ Write the logs of yenta, including the tracebacks of failed tasks, to a file.
+
+    :param Path log_file: The file, or None to stop writing the logs.
+    :return: None
+    """
+    global _log_handler
+
+    yenta_logger = logging.getLogger('yenta')
+    log_path = os.path.abspath(log_file) if log_file else None
+    if _log_handler is not None:
+        if _log_handler.baseFilename == log_path:
+            return
+        yenta_logger.removeHandler(_log_handler)
+        _log_handler.close()
+        _log_handler = None
+
+    if log_path:
+        _log_handler = logging.FileHandler(log_path)
+        _log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        yenta_logger.addHandler(_log_handler)
+        yenta_logger.setLevel(logging.INFO)
+
+
+@contextlib.contextmanager
+def event_bus(verbose: bool = False):
+    """ Create the bus on which pipelines emit their events, which are shown as a progress
+        display and appended to the event log if one is configured.
+
+    :param bool verbose: Whether to print a line for every task when the output is not a terminal.
+    :return: A context manager yielding the bus.
+    """
+    events = EventBus()
+    events.subscribe(ProgressDisplay(per_task=verbose))
+    if not settings.YENTA_EVENT_LOG:
+        yield events
+        return
+
+    with JsonlSink(settings.YENTA_EVENT_LOG) as sink:
+        events.subscribe(sink)
+        yield events
+
+
+def parse_resources(ctx, param, value):
+
+    resources = {}
+    for item in value:
+        name, _, amount = item.partition('=')
+        try:
+            resources[name.strip()] = float(amount)
+        except ValueError:
+            raise click.BadParameter(f'{item} is not of the form NAME=AMOUNT')
+
+    return resources
+
+
+def parse_params(ctx, param, value):
+
+    params = {}
+    for item in value:
+        name, separator, raw_value = item.partition('=')
+        if not separator or not name.strip():
+            raise click.BadParameter(f'{item} is not of the form NAME=VALUE')
+        try:
+            params[name.strip()] = json.loads(raw_value)
+        except ValueError:
+            params[name.strip()] = raw_value
+
+    return params
+
+
 @click.group()
 @click.option('--config-file', default=settings.YENTA_CONFIG_FILE, type=Path,
               help='The config file from which to read settings.')
 @click.option('--pipeline-store', type=Path, help='The directory to which the pipeline will be cached.')
 @click.option('--entry-point', type=Path, help='The file containing the task definitions.')
 @click.option('--log-file', type=Path, help='The file to which the logs should be written.')
-def yenta(config_file, pipeline_store, entry_point, log_file):
+@click.option('--event-log', type=Path, help='The file to which the events of runs should be appended as JSON lines.')
+@click.option('--use-daemon/--no-daemon', default=None,
+              help='Whether to hand commands over to a running `yenta daemon`; off unless YENTA_USE_DAEMON=1.')
+def yenta(config_file, pipeline_store, entry_point, log_file, event_log, use_daemon):
 
     init()
 
+    if use_daemon is not None:
+        settings.YENTA_USE_DAEMON = use_daemon
+
     # append the local path we're running from so that we can allow
     # the project to import normally when running via CLI
     sys.path.append(os.getcwd())
@@ -72,15 +265,24 @@ def yenta(config_file, pipeline_store, entry_point, log_file):
     settings.YENTA_LOG_FILE = log_file or \
                               conf_log_path or \
                               settings.YENTA_LOG_FILE
+    conf_event_log = cf['yenta'].get('event_log', None)
+    settings.YENTA_EVENT_LOG = event_log or \
+                               (Path(conf_event_log).resolve() if conf_event_log else None) or \
+                               settings.YENTA_EVENT_LOG
+
+    configure_logging(settings.YENTA_LOG_FILE)
 
 
 @yenta.command(help='List all available tasks.')
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def list_tasks(pipeline_name='default'):
 
+    if forward_to_daemon('list-tasks', pipeline_name=pipeline_name):
+        return
+
     tasks = load_tasks(settings.YENTA_ENTRY_POINT)
     pipeline = Pipeline(*tasks)
-    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name)
+    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name, RESULT_CACHE)
 
     print('[bold white]The following tasks are available:[/bold white]')
     for task_name in pipeline.execution_order:
@@ -104,6 +306,8 @@ def show_config():
         print('Log output will be written to ' + Fore.GREEN + str(settings.YENTA_LOG_FILE) + Fore.WHITE)
     else:
         print('No log output configured')
+    if settings.YENTA_EVENT_LOG:
+        print('Events will be appended to ' + Fore.GREEN + str(settings.YENTA_EVENT_LOG) + Fore.WHITE)
 
 
 @yenta.command(help='Show information about a specific task.')
@@ -111,8 +315,11 @@ def show_config():
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def task_info(task_name, pipeline_name='default'):
 
+    if forward_to_daemon('task-info', task_name=task_name, pipeline_name=pipeline_name):
+        return
+
     tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name)
+    pipeline_data = Pipeline.load_pipeline(settings.YENTA_STORE_PATH / pipeline_name, RESULT_CACHE)
     try:
         task = more_itertools.one(filter(lambda t: t.task_def.name == task_name, tasks))
         print(f'[bold white]Information for task [green]{task_name}[/green]:[/bold white]')
@@ -146,16 +353,19 @@ def task_info(task_name, pipeline_name='default'):
         print(Fore.WHITE + Style.BRIGHT + 'Unknown task ' + Fore.RED + task_name + Fore.WHITE + ' specified.')
 
 
-@yenta.command(help='Remove a task from the pipeline cache.')
+@yenta.command(help='Remove a task from the pipeline cache, along with the results of the task shared by '
+                    '`--share-results`, so that it is executed again.')
 @click.argument('task-name')
 @click.option('--pipeline-name', default='default', help='The name of the pipeline to display.')
 def rm(task_name, pipeline_name='default'):
 
     task_path = settings.YENTA_STORE_PATH / pipeline_name / task_name
 
+    # a shared result would otherwise be adopted again by the next run
+    shared = ResultIndex(settings.YENTA_STORE_PATH).remove(task_name)
     if task_path.exists():
         shutil.rmtree(task_path)
-    else:
+    elif not shared:
         print(Fore.WHITE + Style.BRIGHT + 'Unknown task ' + Fore.RED + task_name + Fore.WHITE + ' specified.')
 
 
@@ -177,26 +387,365 @@ def ignore(task_name, pipeline_name='default'):
         print(f'[bold white]Setting task {task_name} to be ignored.[/bold white]')
 
 
-@yenta.command(help='Dump the task graph to a DOT file.')
+@yenta.command(help='Dump the task graph, annotated with the state of each task, to a DOT, JSON or GraphML file.')
 @click.argument('filename', type=click.Path())
-def dump_task_graph(filename: Path):
+@click.option('--pipeline-name', default='default', help='The name of the pipeline whose state annotates the graph.')
+@click.option('--format', 'graph_format', type=click.Choice(list(GRAPH_FORMATS)),
+              help='The format of the file; defaults to the one matching its extension, or dot.')
+@click.option('--around', help='Keep only the tasks near this task.')
+@click.option('--depth', default=1, type=click.IntRange(min=0),
+              help='The number of dependencies or dependents away from --around that a task may be.')
+@click.option('--only-stale', is_flag=True, help='Keep only the tasks that the next run may execute.')
+@click.option('--critical-path', is_flag=True, help='Keep only the tasks on the longest chain of recorded durations.')
+@click.option('--annotate/--no-annotate', default=True,
+              help='Whether to annotate the tasks with their status, duration, result size and cache state.')
+def dump_task_graph(filename: Path, pipeline_name='default', graph_format=None, around=None, depth=1,
+                    only_stale=False, critical_path=False, annotate=True):
 
     tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline = Pipeline(*tasks)
-    pydot_graph = to_pydot(pipeline.task_graph)
-    pydot_graph.write(filename)
+    pipeline = Pipeline(*tasks, name=pipeline_name)
+    try:
+        written = export_task_graph(pipeline, Path(filename), graph_format, around=around, depth=depth,
+                                    only_stale=only_stale, on_critical_path=critical_path, annotate=annotate)
+    except GraphExportError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(2)
+    print(f'[bold white]Wrote {written} of {len(pipeline.execution_order)} tasks to {filename}.[/bold white]')
 
 
 @yenta.command(help='Run the pipeline.')
 @click.option('--up-to', help='Optionally run the pipeline up to and including a given task.')
 @click.option('--force-rerun', '-f', multiple=True, default=[], help='Force specified tasks to rerun.')
-@click.option('--pipeline-name', default='default', help='The name of the pipeline to run.')
-def run(up_to=None, force_rerun=None, pipeline_name='default'):
+@click.option('--pipeline-name', 'pipeline_names', multiple=True, default=['default'],
+              help='The name of the pipeline to run; may be repeated to run several pipelines at once.')
+@click.option('--all', 'all_pipelines', is_flag=True, help='Run every pipeline in the store.')
+@click.option('--workers', '-j', default=1, type=click.IntRange(min=1), help='The number of tasks to run at once.')
+@click.option('--resource', '-r', multiple=True, default=[], callback=parse_resources,
+              help='The capacity of a named resource pool, e.g. mem_gb=64; may be repeated.')
+@click.option('--broker', type=Path, help='Send tasks to `yenta worker` processes through this shared directory.')
+@click.option('--worker-timeout', default=30.0, type=float,
+              help='Seconds without a heartbeat after which the tasks of a worker are rescheduled, '
+                   'and after which the tasks fail if no worker is alive.')
+@click.option('--trace', type=Path, help='Write a Chrome trace of the run to this file.')
+@click.option('--profile', multiple=True, default=[],
+              help='Profile the given task when it is executed, or all tasks with `all`; may be repeated.')
+@click.option('--profile-memory', is_flag=True, help='Trace the allocations of profiled tasks as well.')
+@click.option('--capture-artifacts', type=click.Choice(['copy', 'link']),
+              help='Keep the files of artifacts in the store, to restore them when they go missing.')
+@click.option('--share-results', is_flag=True,
+              help='Reuse the results of pure tasks computed by other pipelines in the same store.')
+@click.option('--prefetch', type=click.IntRange(min=0),
+              help='Load the stored results and inputs of this many upcoming tasks ahead, in the background.')
+@click.option('--param', '-p', 'params', multiple=True, default=[], callback=parse_params,
+              help='The value of a pipeline parameter, e.g. lr=0.01, parsed as JSON if possible; may be repeated.')
+@click.option('--sweep', type=click.Path(exists=True, dir_okay=False),
+              help='Run the pipeline for every configuration of the parameters in this JSON file.')
+@click.option('--sweep-jobs', default=4, type=click.IntRange(min=1),
+              help='The number of configurations of a sweep to run at once.')
+@click.option('--verbose', '-v', is_flag=True,
+              help='Print a line for every task when the output is not a terminal, rather than periodic counts.')
+def run(up_to=None, force_rerun=None, pipeline_names=('default',), all_pipelines=False, workers=1, resource=None,
+        broker=None, worker_timeout=30.0, trace=None, profile=None, profile_memory=False, capture_artifacts=None,
+        share_results=False, prefetch=None, params=None, sweep=None, sweep_jobs=4, verbose=False):
+
+    if forward_to_daemon('run', up_to=up_to, force_rerun=list(force_rerun or []),
+                         pipeline_names=list(pipeline_names), all_pipelines=all_pipelines, workers=workers,
+                         resource=resource, broker=str(broker) if broker else None,
+                         worker_timeout=worker_timeout, trace=str(trace) if trace else None,
+                         profile=list(profile or []), profile_memory=profile_memory,
+                         capture_artifacts=capture_artifacts, share_results=share_results, prefetch=prefetch,
+                         params=params, sweep=str(Path(sweep).resolve()) if sweep else None, sweep_jobs=sweep_jobs,
+                         verbose=verbose):
+        return
+
+    if all_pipelines:
+        pipeline_names = stored_pipelines(settings.YENTA_STORE_PATH)
+        if not pipeline_names:
+            print('[bold white]There are no pipelines in the store.[/bold white]')
+            return
+    pipeline_names = list(dict.fromkeys(pipeline_names))
+    pipeline_name = pipeline_names[0]
+
+    configurations = None
+    if sweep and len(pipeline_names) > 1:
+        raise click.BadParameter('A sweep runs a single pipeline', param_hint='--sweep')
+    if sweep:
+        try:
+            configurations = [{**(params or {}), **configuration} for configuration in load_sweep(sweep)]
+        except (SweepError, ValueError) as ex:
+            raise click.BadParameter(str(ex), param_hint='--sweep')
 
     logger.info('Running the pipeline')
     tasks = load_tasks(settings.YENTA_ENTRY_POINT)
-    pipeline = Pipeline(*tasks, name=pipeline_name)
-    result = pipeline.run_pipeline(up_to, force_rerun)
+    invoker = Coordinator(DirectoryBroker(broker), worker_timeout=worker_timeout) if broker else None
+    tracer = Tracer() if trace else None
+    with event_bus(verbose) as events:
+        options = dict(max_workers=workers, resources=resource, invoker=invoker, result_cache=RESULT_CACHE,
+                       events=events, tracer=tracer, profile=profile, profile_memory=profile_memory,
+                       capture_artifacts=capture_artifacts, prefetch=prefetch)
+        try:
+            if configurations is not None:
+                sweep_runner = Sweep(tasks, configurations, name=pipeline_name, max_parallel=sweep_jobs, **options)
+                sweep_runner.run(up_to, force_rerun)
+                print(f'[bold white]Ran {len(sweep_runner.pipelines)} configurations of {pipeline_name}:[/bold white]')
+                for key, pipeline in sweep_runner.pipelines.items():
+                    values = ', '.join(f'{name}={value}' for name, value in sweep_runner.configurations[key].items())
+                    print(f'  [green]{pipeline.name}[/green] {values}')
+            elif len(pipeline_names) > 1:
+                group = PipelineGroup([Pipeline(*tasks, name=name, params=params, share_results=share_results or None,
+                                                **options) for name in pipeline_names], max_workers=workers)
+                group.run(up_to, force_rerun)
+                print(f'[bold white]Ran {len(group.pipelines)} pipelines:[/bold white]')
+                for pipeline in group.pipelines.values():
+                    print(f'  [green]{pipeline.name}[/green] {len(pipeline._tasks_executed)} executed, '
+                          f'{len(pipeline._tasks_reused)} reused')
+            else:
+                pipeline = Pipeline(*tasks, name=pipeline_name, params=params,
+                                    share_results=share_results or None, **options)
+                pipeline.run_pipeline(up_to, force_rerun)
+        except InvalidParameterError as ex:
+            print(f'[bold red]{ex}[/bold red]')
+            sys.exit(2)
+        finally:
+            if tracer is not None:
+                tracer.write(trace)
+
+
+@yenta.command(help='Summarize the profile of a task recorded by `yenta run --profile`.')
+@click.argument('task-name')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline to which the task belongs.')
+@click.option('--sort', default='cumulative', help='The key by which to sort functions, e.g. cumulative or tottime.')
+@click.option('--limit', default=20, type=click.IntRange(min=1), help='The number of functions and lines to show.')
+def profile_report(task_name, pipeline_name='default', sort='cumulative', limit=20):
+
+    try:
+        report = ProfileReport(settings.YENTA_STORE_PATH / pipeline_name / task_name)
+    except NoProfileError:
+        print(f'[bold white]No profile recorded for task [red]{task_name}[/red]; '
+              f'run it with --profile {task_name}.[/bold white]')
+        sys.exit(1)
+
+    summary = report.summary
+    print(f'[bold white]Profile of task [green]{task_name}[/green]: {summary["calls"]} call(s), '
+          f'{summary["duration"]:.3f} s[/bold white]')
+    click.echo(report.cpu(sort, limit))
+    memory = report.memory(limit)
+    if memory:
+        print('[bold white]Largest allocations still held when the task returned:[/bold white]')
+        click.echo(memory)
+
+
+@yenta.command(help='List the recorded runs of the pipeline.')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline.')
+@click.option('--limit', default=20, type=click.IntRange(min=1), help='The number of most recent runs to show.')
+def history(pipeline_name='default', limit=20):
+
+    runs = RunHistory(settings.YENTA_STORE_PATH / pipeline_name).runs()
+    if not runs:
+        print(f'[bold white]No runs recorded for pipeline [red]{pipeline_name}[/red].[/bold white]')
+        return
+
+    # run ids start with the date and time at which the run started
+    table = Table('#', 'Run', 'Duration', 'Executed', 'Reused', 'Failed', 'Reuse')
+    for number, run in list(enumerate(runs, start=1))[-limit:]:
+        reuse_rate = f'{run.reuse_rate:.0%}' if run.reuse_rate is not None else '-'
+        table.add_row(str(number), run.run_id, f'{run.duration:.2f} s', str(run.count('executed')),
+                      str(run.count('reused')), str(run.count('failed')), reuse_rate)
+    print(table)
+
+
+@yenta.command(help='Compare two recorded runs, given by number, id, `latest` or `previous`, and flag the tasks '
+                    'that regressed.')
+@click.argument('run-a')
+@click.argument('run-b')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline.')
+@click.option('--threshold', default=0.2, type=float, help='The relative growth that counts as a regression.')
+@click.option('--min-duration', default=0.05, type=float, help='Ignore durations shorter than this, in seconds.')
+def compare(run_a, run_b, pipeline_name='default', threshold=0.2, min_duration=0.05):
+
+    run_history = RunHistory(settings.YENTA_STORE_PATH / pipeline_name)
+    runs = run_history.runs()
+    try:
+        before, after = run_history.get(run_a, runs), run_history.get(run_b, runs)
+    except UnknownRunError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(2)
+
+    print(f'[bold white]Comparing run [green]{before.run_id}[/green] to [green]{after.run_id}[/green] '
+          f'({before.duration:.2f} s to {after.duration:.2f} s)[/bold white]')
+    no_longer_reused = sorted(task_name for task_name, record in after.tasks.items()
+                              if record.state != 'reused' and task_name in before.tasks
+                              and before.tasks[task_name].state == 'reused')
+    if no_longer_reused:
+        print(f'[bold yellow]No longer reused: {", ".join(no_longer_reused)}[/bold yellow]')
+
+    regressions = compare_runs(before, after, threshold=threshold, min_duration=min_duration)
+    if not regressions:
+        print(f'[bold green]No task regressed by more than {threshold:.0%}.[/bold green]')
+        return
+
+    table = Table('Task', 'Measure', 'Before', 'After', 'Change')
+    for regression in regressions:
+        if regression.metric == 'duration':
+            values = f'{regression.before:.3f} s', f'{regression.after:.3f} s'
+        else:
+            values = f'{regression.before / 1024:.1f} KiB', f'{regression.after / 1024:.1f} KiB'
+        table.add_row(regression.task or '(run)', regression.metric, *values, f'+{regression.ratio - 1:.0%}')
+    print(table)
+    sys.exit(1)
+
+
+@yenta.command(help='Run the pipeline, then rerun the affected tasks whenever the tasks or their files change.')
+@click.option('--pipeline-name', default='default', help='The name of the pipeline to run.')
+@click.option('--workers', '-j', default=1, type=click.IntRange(min=1), help='The number of tasks to run at once.')
+@click.option('--resource', '-r', multiple=True, default=[], callback=parse_resources,
+              help='The capacity of a named resource pool, e.g. mem_gb=64; may be repeated.')
+@click.option('--poll-interval', default=0.5, type=float, help='Seconds between checks for changes.')
+@click.option('--verbose', '-v', is_flag=True,
+              help='Print a line for every task when the output is not a terminal, rather than periodic counts.')
+def watch(pipeline_name='default', workers=1, resource=None, poll_interval=0.5, verbose=False):
+
+    entry_point = settings.YENTA_ENTRY_POINT
+    result_cache = RESULT_CACHE or LRUCache()
+    with event_bus(verbose) as events:
+        watcher = Watcher(lambda: load_tasks(entry_point), entry_point,
+                          lambda tasks: Pipeline(*tasks, name=pipeline_name, max_workers=workers, resources=resource,
+                                                 result_cache=result_cache, events=events),
+                          poll_interval=poll_interval)
+        watcher.run()
+
+
+@yenta.command(help='Run tasks sent by `yenta run --broker`.')
+@click.option('--broker', required=True, type=Path, help='The shared directory through which tasks are received.')
+@click.option('--idle-timeout', type=float, help='Exit after receiving no tasks for this many seconds.')
+@click.option('--poll-interval', default=0.1, type=float, help='Seconds between checks for new tasks.')
+@click.option('--heartbeat-interval', default=5.0, type=float, help='Seconds between heartbeats.')
+def worker(broker, idle_timeout=None, poll_interval=0.1, heartbeat_interval=5.0):
+
+    tasks = load_tasks(settings.YENTA_ENTRY_POINT)
+    task_worker = Worker(DirectoryBroker(broker), tasks, lambda name: Pipeline(*tasks, name=name),
+                         poll_interval=poll_interval, heartbeat_interval=heartbeat_interval)
+    logger.info(f'Worker {task_worker.worker_id} waiting for tasks')
+    task_worker.run(idle_timeout=idle_timeout)
+
+
+@yenta.group(help='Move the stored results of a pipeline between workspaces, or prune the shared results.')
+def cache():
+    pass
+
+
+@cache.command(name='export', help='Write the stored results of the pipeline to a bundle.')
+@click.argument('bundle', type=Path)
+@click.option('--pipeline-name', default='default', help='The name of the pipeline to export.')
+@click.option('--tasks', '-t', multiple=True, default=[],
+              help='Export only these tasks, separated by commas; may be repeated. Defaults to all stored tasks.')
+@click.option('--compression', default='gzip', type=click.Choice(list(COMPRESSIONS)), help='How to compress the files.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), help='The number of files to compress at once.')
+def cache_export(bundle, pipeline_name='default', tasks=None, compression='gzip', jobs=None):
+
+    task_names = [name.strip() for names in tasks or [] for name in names.split(',') if name.strip()]
+    pipeline = Pipeline(*load_tasks(settings.YENTA_ENTRY_POINT), name=pipeline_name)
+    try:
+        exported = export_bundle(pipeline, bundle, task_names or None, compression=compression, jobs=jobs)
+    except BundleError as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(1)
+
+    print(f'[bold white]Exported {len(exported)} tasks to [green]{bundle}[/green][/bold white]')
+
+
+@cache.command(name='import', help='Load the results in a bundle that match the current tasks into the store.')
+@click.argument('bundle', type=click.Path(exists=True, dir_okay=False))
+@click.option('--pipeline-name', default='default', help='The name of the pipeline into which to import.')
+@click.option('--force', is_flag=True, help='Replace the results of tasks that are already stored.')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), help='The number of files to decompress at once.')
+def cache_import(bundle, pipeline_name='default', force=False, jobs=None):
+
+    pipeline = Pipeline(*load_tasks(settings.YENTA_ENTRY_POINT), name=pipeline_name)
+    try:
+        outcomes = import_bundle(pipeline, bundle, force=force, jobs=jobs)
+    except (BundleError, tarfile.TarError) as ex:
+        print(f'[bold red]{ex}[/bold red]')
+        sys.exit(1)
+
+    for task_name, outcome in sorted(outcomes.items()):
+        marker = f'[bold green]{CHECK_MARK}[/bold green]' if outcome == 'imported' else '[bold yellow]-[/bold yellow]'
+        print(f'[{marker}] [bold white]{task_name}[/bold white]: {outcome}')
+
+
+@cache.command(name='prune', help='Remove the results shared by `--share-results` that no pipeline has used lately.')
+@click.option('--max-age', default=30.0, type=click.FloatRange(min=0),
+              help='The number of days after which a shared result that has not been used is removed.')
+def cache_prune(max_age=30.0):
+
+    removed = ResultIndex(settings.YENTA_STORE_PATH).prune(max_age * 24 * 3600)
+    print(f'[bold white]Removed {removed} shared results[/bold white]')
+
+
+@yenta.group(help='Manage a resident process that keeps the project loaded in memory.')
+def daemon():
+    pass
+
+
+@daemon.command(help='Start serving run, list-tasks and task-info for the current store.')
+@click.option('--detach', is_flag=True, help='Run the daemon in the background.')
+@click.option('--cache-size', default=4096, type=click.IntRange(min=1),
+              help='The number of stored results and inputs to keep in memory.')
+def start(detach=False, cache_size=4096):
+
+    global RESULT_CACHE
+
+    socket_path = socket_path_for(settings.YENTA_STORE_PATH)
+    if daemon_is_running(socket_path):
+        print(f'[bold white]A daemon is already serving [green]{settings.YENTA_STORE_PATH}[/green][/bold white]')
+        return
+
+    if detach:
+        command = [sys.executable, '-m', 'yenta.cli',
+                   '--entry-point', str(Path(settings.YENTA_ENTRY_POINT).resolve()),
+                   '--pipeline-store', str(Path(settings.YENTA_STORE_PATH).resolve()),
+                   'daemon', 'start', '--cache-size', str(cache_size)]
+        subprocess.Popen(command, start_new_session=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not daemon_is_running(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if not daemon_is_running(socket_path):
+            print('[bold red]The daemon did not start.[/bold red]')
+            sys.exit(1)
+        print(f'[bold white]Daemon listening on [green]{socket_path}[/green][/bold white]')
+        return
+
+    RESULT_CACHE = LRUCache(cache_size)
+    server = Daemon(socket_path, handle_daemon_request)
+    print(f'[bold white]Daemon listening on [green]{socket_path}[/green][/bold white]')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@daemon.command(help='Stop the daemon serving the current store.')
+def stop():
+
+    socket_path = socket_path_for(settings.YENTA_STORE_PATH)
+    if daemon_is_running(socket_path):
+        send_request(socket_path, {'command': 'shutdown'})
+        print('[bold white]Daemon stopped.[/bold white]')
+    else:
+        print('[bold white]No daemon is running.[/bold white]')
+
+
+@daemon.command(help='Show whether a daemon is serving the current store.')
+def status():
+
+    socket_path = socket_path_for(settings.YENTA_STORE_PATH)
+    if daemon_is_running(socket_path):
+        print(f'[bold white]Daemon listening on [green]{socket_path}[/green][/bold white]')
+    else:
+        print('[bold white]No daemon is running.[/bold white]')
 
 
 if __name__ == "__main__":
@@ -7,6 +7,14 @@ YENTA_STORE_PATH = Path('./.yenta_cache').resolve()
 YENTA_ENTRY_POINT = os.environ.get('YENTA_ENTRY_POINT', Path('./main.py'))
 YENTA_CONFIG_FILE = os.environ.get('YENTA_CONFIG_FILE', Path('./yenta.config'))
 YENTA_LOG_FILE = os.environ.get('YENTA_LOG_FILE', None)
+YENTA_EVENT_LOG = os.environ.get('YENTA_EVENT_LOG', None)
+YENTA_USE_DAEMON = os.environ.get('YENTA_USE_DAEMON', '0') != '0'
+YENTA_CAPTURE_ARTIFACTS = os.environ.get('YENTA_CAPTURE_ARTIFACTS', None)
+YENTA_SHARE_RESULTS = os.environ.get('YENTA_SHARE_RESULTS', '0') != '0'
+YENTA_LOCK_LEASE = float(os.environ.get('YENTA_LOCK_LEASE', 30))
+YENTA_IO_WORKERS = int(os.environ.get('YENTA_IO_WORKERS', 8))
+YENTA_PREFETCH = int(os.environ.get('YENTA_PREFETCH', 0))
+YENTA_PREFETCH_BUDGET = int(os.environ.get('YENTA_PREFETCH_BUDGET', 256 * 1024 * 1024))
 
 VERBOSE = False
 
@@ -0,0 +1,116 @@
+"""A resident server that keeps a project's tasks, task graph and results in memory."""
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(Exception):
+    pass
+
+
+def socket_path_for(store_path: Path) -> Path:
+    """ Return the path of the Unix socket of the daemon serving the given store. The socket
+        lives in the temporary directory because socket paths are limited to about a hundred
+        characters, which deeply nested stores easily exceed.
+
+    :param Path store_path: The store of the project.
+    :return: The path of the socket.
+    :rtype: Path
+    """
+    digest = sha1(str(Path(store_path).resolve()).encode()).hexdigest()[:16]
+    return Path(tempfile.gettempdir()) / f'yenta-{os.getuid()}-{digest}.sock'
+
+
+def send_request(socket_path: Path, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    """ Send a request to a daemon and wait for its response.
+
+    :param Path socket_path: The socket of the daemon.
+    :param dict request: The request; must be JSON-serializable.
+    :param float timeout: Optionally, how long to wait for the connection, in seconds.
+    :return: The response of the daemon.
+    :rtype: dict
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(socket_path))
+        client.settimeout(None)
+        client.sendall(json.dumps(request).encode() + b'\n')
+        client.shutdown(socket.SHUT_WR)
+        with client.makefile('rb') as f:
+            return json.loads(f.read().decode())
+
+
+def daemon_is_running(socket_path: Path) -> bool:
+    """ Check whether a daemon is listening on a socket, removing the socket if it is stale.
+
+    :param Path socket_path: The socket of the daemon.
+    :return: True or False
+    :rtype: bool
+    """
+    if not socket_path.exists():
+        return False
+    try:
+        return send_request(socket_path, {'command': 'ping'}, timeout=1.0).get('ok', False)
+    except (ConnectionRefusedError, FileNotFoundError, socket.timeout, ValueError):
+        logger.debug(f'Removing stale daemon socket {socket_path}')
+        if socket_path.exists():
+            socket_path.unlink()
+        return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+
+        try:
+            request = json.loads(self.rfile.readline().decode())
+            if request.get('command') == 'ping':
+                response = {'ok': True, 'pid': os.getpid()}
+            elif request.get('command') == 'shutdown':
+                response = {'ok': True}
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                output, exit_code = self.server.handler(request)
+                response = {'ok': True, 'output': output, 'exit_code': exit_code}
+        except Exception as ex:
+            logger.exception('Caught exception serving request')
+            response = {'ok': False, 'output': f'{ex}\n', 'exit_code': 1}
+
+        self.wfile.write(json.dumps(response).encode())
+
+
+class Daemon(socketserver.UnixStreamServer):
+    """ Serves requests from the command line over a Unix socket, one at a time. The requests
+        themselves are carried out by `handler`, which receives the decoded request and returns
+        the output to show to the user along with an exit code; everything the handler keeps in
+        memory between requests stays warm for as long as the daemon runs.
+    """
+
+    def __init__(self, socket_path: Path, handler: Callable[[Dict[str, Any]], Tuple[str, int]]):
+        """
+        :param Path socket_path: The socket on which to listen.
+        :param Callable handler: Carries out the requests.
+        """
+
+        self.socket_path = Path(socket_path)
+        self.handler = handler
+        if daemon_is_running(self.socket_path):
+            raise DaemonError(f'A daemon is already listening on {self.socket_path}')
+        super().__init__(str(self.socket_path), _RequestHandler)
+        os.chmod(self.socket_path, 0o600)
+
+    def server_close(self):
+
+        super().server_close()
+        if self.socket_path.exists():
+            self.socket_path.unlink()
@@ -0,0 +1,298 @@
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import logging
+import lzma
+import os
+import pickle
+import shutil
+import tarfile
+import tempfile
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List
+
+from yenta.artifacts.Handle import relocate_file_handles
+from yenta.pipeline.Index import task_fingerprint
+from yenta.pipeline.Pipeline import Pipeline
+from yenta.pipeline.Store import StoredResults
+from yenta.utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['BundleError', 'export_bundle', 'import_bundle', 'COMPRESSIONS']
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+CHUNK_SIZE = 1 << 20
+
+# the suffix of the members of a bundle and the function that opens them, by compression
+COMPRESSIONS = {
+    'none': ('', open),
+    'gzip': ('.gz', gzip.open),
+    'bz2': ('.bz2', bz2.open),
+    'xz': ('.xz', lzma.open),
+}
+
+
+class BundleError(Exception):
+    pass
+
+
+def _task_files(task_path: Path) -> List[str]:
+
+    # the files that make up the stored state of a task; locks, profiles and temporary files are left out
+    files = [name for name in ('result.pk', 'inputs.pk') if (task_path / name).exists()]
+    for directory in ('values', 'elements'):
+        for root, _, names in os.walk(task_path / directory):
+            files.extend(Path(root, name).relative_to(task_path).as_posix()
+                         for name in sorted(names) if not name.startswith('.'))
+
+    return files
+
+
+def _copy(source, target, digest=None):
+
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        if digest is not None:
+            digest.update(chunk)
+        target.write(chunk)
+
+
+def _pack(source: Path, target: Path, compression: str) -> str:
+
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f_in, COMPRESSIONS[compression][1](target, 'wb') as f_out:
+        _copy(f_in, f_out, digest)
+
+    return digest.hexdigest()
+
+
+def _unpack(source: Path, target: Path, compression: str) -> str:
+
+    digest = hashlib.sha256()
+    with COMPRESSIONS[compression][1](source, 'rb') as f_in, open(target, 'wb') as f_out:
+        _copy(f_in, f_out, digest)
+
+    return digest.hexdigest()
+
+
+def _snapshot_task(pipeline: Pipeline, task_name: str, directory: Path) -> List[str]:
+
+    # link the files of the task into `directory` while holding its claim, so that a run that
+    # executes the task at the same time cannot leave the bundle with mismatched files
+    task_path = pipeline.store_path / task_name
+    with pipeline.task_lock(task_name):
+        files = _task_files(task_path)
+        for name in files:
+            target = directory / name
+            target.parent.mkdir(exist_ok=True, parents=True)
+            try:
+                os.link(task_path / name, target)
+            except OSError:
+                shutil.copyfile(task_path / name, target)
+
+    return files
+
+
+def export_bundle(pipeline: Pipeline, bundle_path: Path, task_names: Iterable[str] = None,
+                  compression: str = 'gzip', jobs: int = None) -> List[str]:
+    """ Write the stored results of tasks of a pipeline to a bundle, a tar file holding the files
+        of each task along with a manifest of their SHA-256 digests and of the fingerprints of
+        the code of the tasks. The files are compressed in parallel.
+
+    :param Pipeline pipeline: The pipeline, whose tasks are those of the current entry point.
+    :param Path bundle_path: The file to which to write the bundle.
+    :param task_names: Optionally, the tasks to export; defaults to all the tasks in the store.
+    :param str compression: How to compress the files; one of `none`, `gzip`, `bz2` or `xz`.
+    :param int jobs: The number of files to compress at once; defaults to the number of CPUs.
+    :return: The names of the exported tasks.
+    :rtype: List[str]
+    """
+    if compression not in COMPRESSIONS:
+        raise BundleError(f'Unknown compression {compression}, expected one of {", ".join(COMPRESSIONS)}')
+
+    stored = StoredResults.stored_tasks(pipeline.store_path)
+    fingerprints = {task.task_def.name: task_fingerprint(task) for task in pipeline._tasks}
+    task_names = sorted(stored & set(fingerprints) if task_names is None else set(task_names))
+    for task_name in task_names:
+        if task_name not in fingerprints:
+            raise BundleError(f'Task {task_name} is not part of the pipeline')
+        if task_name not in stored:
+            raise BundleError(f'Task {task_name} has no stored result')
+
+    durations = pipeline.load_durations()
+    suffix = COMPRESSIONS[compression][0]
+    bundle_path = Path(bundle_path)
+    with tempfile.TemporaryDirectory(prefix='.export-', dir=pipeline.store_path) as tmp_dir, \
+            ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+        snapshot, packed = Path(tmp_dir, 'snapshot'), Path(tmp_dir, 'packed')
+        files = {task_name: _snapshot_task(pipeline, task_name, snapshot / task_name) for task_name in task_names}
+
+        digests = {}
+        for task_name, names in files.items():
+            for name in names:
+                (packed / task_name / name).parent.mkdir(exist_ok=True, parents=True)
+                digests[task_name, name] = executor.submit(_pack, snapshot / task_name / name,
+                                                           packed / task_name / f'{name}{suffix}', compression)
+
+        manifest = {
+            'version': BUNDLE_VERSION,
+            'pipeline': pipeline.name,
+            'store_path': str(pipeline.store_path),
+            'created': time.time(),
+            'compression': compression,
+            'tasks': {task_name: {'fingerprint': fingerprints[task_name],
+                                  'duration': durations.get(task_name, None),
+                                  'files': {name: digests[task_name, name].result() for name in names}}
+                      for task_name, names in files.items()}
+        }
+
+        tmp_bundle = bundle_path.with_name(f'.{bundle_path.name}.tmp')
+        with tarfile.open(tmp_bundle, 'w') as tar:
+            data = json.dumps(manifest, indent=2).encode()
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size, info.mtime = len(data), int(manifest['created'])
+            tar.addfile(info, io.BytesIO(data))
+            for task_name, names in files.items():
+                for name in names:
+                    tar.add(packed / task_name / f'{name}{suffix}', arcname=f'tasks/{task_name}/{name}{suffix}')
+        os.replace(tmp_bundle, bundle_path)
+
+    logger.info('Exported %d tasks of %s to %s', len(task_names), pipeline.name, bundle_path)
+    return task_names
+
+
+def _safe_name(name: str) -> bool:
+
+    path = PurePosixPath(name)
+    return bool(name) and not path.is_absolute() and '..' not in path.parts
+
+
+def _install_task(pipeline: Pipeline, task_name: str, source: Path, names: List[str]):
+
+    task_path = pipeline.store_path / task_name
+    with pipeline.task_lock(task_name):
+        for entry in os.listdir(task_path):
+            entry_path = task_path / entry
+            if entry == '.lock':
+                continue
+            elif entry_path.is_dir():
+                shutil.rmtree(entry_path)
+            else:
+                entry_path.unlink()
+        # the result is moved into place after the files it refers to, and before its inputs
+        order = {'result.pk': 1, 'inputs.pk': 2}
+        for name in sorted(names, key=lambda name: order.get(name, 0)):
+            (task_path / name).parent.mkdir(exist_ok=True, parents=True)
+            os.replace(source / name, task_path / name)
+
+
+def import_bundle(pipeline: Pipeline, bundle_path: Path, force: bool = False, jobs: int = None) -> Dict[str, str]:
+    """ Load the tasks stored in a bundle written by `export_bundle` into the store of a pipeline.
+        A task is only loaded if it is part of the pipeline, the fingerprint of its code matches
+        that of the current entry point, and all of its files match their digests; unless `force`
+        is set, tasks that already have a result in the store are left alone. The handles to files
+        among the results are pointed at the store into which they are loaded.
+
+    :param Pipeline pipeline: The pipeline, whose tasks are those of the current entry point.
+    :param Path bundle_path: The bundle.
+    :param bool force: Whether to replace the results of tasks that are already stored.
+    :param int jobs: The number of files to decompress at once; defaults to the number of CPUs.
+    :return: What happened to each task of the bundle: `imported`, `unknown task`, `fingerprint mismatch`,
+             `already stored` or `corrupt`.
+    :rtype: Dict[str, str]
+    """
+    with tarfile.open(bundle_path, 'r') as tar:
+        try:
+            manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        except KeyError:
+            raise BundleError(f'{bundle_path} is not a yenta bundle')
+        if manifest.get('version', None) != BUNDLE_VERSION:
+            raise BundleError(f'Unsupported bundle version {manifest.get("version", None)}')
+        compression = manifest['compression']
+        if compression not in COMPRESSIONS:
+            raise BundleError(f'Unknown compression {compression}')
+        suffix = COMPRESSIONS[compression][0]
+
+        stored = StoredResults.stored_tasks(pipeline.store_path)
+        fingerprints = {task.task_def.name: task_fingerprint(task) for task in pipeline._tasks}
+        outcomes = {}
+        accepted = {}
+        for task_name, entry in manifest['tasks'].items():
+            if task_name not in fingerprints:
+                outcomes[task_name] = 'unknown task'
+            elif entry['fingerprint'] != fingerprints[task_name]:
+                outcomes[task_name] = 'fingerprint mismatch'
+            elif task_name in stored and not force:
+                outcomes[task_name] = 'already stored'
+            elif not all(_safe_name(name) for name in entry['files']) or 'result.pk' not in entry['files']:
+                outcomes[task_name] = 'corrupt'
+            else:
+                accepted[task_name] = entry
+
+        with tempfile.TemporaryDirectory(prefix='.import-', dir=pipeline.store_path) as tmp_dir, \
+                ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+            packed, unpacked = Path(tmp_dir, 'packed'), Path(tmp_dir, 'unpacked')
+            digests = {}
+            for task_name, entry in accepted.items():
+                for name in entry['files']:
+                    packed_path = packed / task_name / f'{name}{suffix}'
+                    packed_path.parent.mkdir(exist_ok=True, parents=True)
+                    (unpacked / task_name / name).parent.mkdir(exist_ok=True, parents=True)
+                    try:
+                        member = tar.extractfile(f'tasks/{task_name}/{name}{suffix}')
+                    except KeyError:
+                        member = None
+                    if member is None:
+                        digests[task_name, name] = None
+                        continue
+                    with member, open(packed_path, 'wb') as f:
+                        _copy(member, f)
+                    digests[task_name, name] = executor.submit(_unpack, packed_path, unpacked / task_name / name,
+                                                               compression)
+
+            source_store = Path(manifest['store_path'])
+            for task_name, entry in accepted.items():
+                valid = True
+                for name, expected in entry['files'].items():
+                    digest = digests[task_name, name]
+                    try:
+                        valid = valid and digest is not None and digest.result() == expected
+                    except (OSError, EOFError, ValueError, lzma.LZMAError, zlib.error):
+                        valid = False
+                if not valid:
+                    logger.warning('Not importing %s, whose files do not match the manifest', task_name)
+                    outcomes[task_name] = 'corrupt'
+                    continue
+
+                if source_store != pipeline.store_path:
+                    for name in entry['files']:
+                        if name.endswith('.pk'):
+                            _relocate(unpacked / task_name / name, source_store, pipeline.store_path)
+                _install_task(pipeline, task_name, unpacked / task_name, list(entry['files']))
+                outcomes[task_name] = 'imported'
+
+    imported = [task_name for task_name, outcome in outcomes.items() if outcome == 'imported']
+    pipeline.save_durations({task_name: manifest['tasks'][task_name]['duration'] for task_name in imported
+                             if manifest['tasks'][task_name]['duration'] is not None})
+    logger.info('Imported %d of %d tasks from %s', len(imported), len(outcomes), bundle_path)
+
+    return outcomes
+
+
+def _relocate(path: Path, source_store: Path, target_store: Path):
+
+    # point the handles in a stored result or inputs at the store into which they are imported
+    with open(path, 'rb') as f:
+        value = pickle.load(f)
+    if relocate_file_handles(value, source_store, target_store):
+        atomic_write(path, pickle.dumps(value))
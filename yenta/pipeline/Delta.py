@@ -0,0 +1,114 @@
+import pickle
+
+from collections import Counter
+from collections.abc import Mapping, Set
+from dataclasses import dataclass
+from typing import Any
+
+__all__ = ['Delta', 'compute_delta', 'is_collection']
+
+
+@dataclass
+class Delta:
+    """ Holds the difference between the previous and the current value of a collection
+        that an incremental task depends on. Each field has the same type as the value itself."""
+
+    added: Any
+    """ The elements (or, for dicts, the items) that are new since the previous run."""
+
+    removed: Any
+    """ The elements (or, for dicts, the items) that were present in the previous run but are now gone."""
+
+    changed: Any
+    """ For dicts, the items whose keys were present before but whose values changed; empty otherwise."""
+
+    @property
+    def is_empty(self) -> bool:
+        """ Whether the value is unchanged since the previous run."""
+        return not (self.added or self.removed or self.changed)
+
+
+def is_collection(value) -> bool:
+    """ Return whether a value is a collection for which a `Delta` can be computed.
+
+    :param value: The value to check.
+    :return: True if the value is a dict, set, list or tuple.
+    :rtype: bool
+    """
+    return isinstance(value, (Mapping, Set, list, tuple))
+
+
+def _element_key(element):
+    """ Return a hashable key for an element of a sequence, falling back to its pickled
+        form for unhashable elements.
+    """
+    try:
+        hash(element)
+        return element
+    except TypeError:
+        return pickle.dumps(element)
+
+
+def _empty_like(value):
+    """ Return an empty collection of the same kind as the given one."""
+    try:
+        return type(value)()
+    except TypeError:
+        if isinstance(value, Mapping):
+            return {}
+        elif isinstance(value, Set):
+            return set()
+        return []
+
+
+def _diff_sequences(old, new):
+
+    if len(old) <= len(new) and new[:len(old)] == old:
+        return new[len(old):], _empty_like(new)
+
+    old_counts = Counter(_element_key(element) for element in old)
+    new_counts = Counter(_element_key(element) for element in new)
+    added_counts = new_counts - old_counts
+    removed_counts = old_counts - new_counts
+
+    added = []
+    for element in new:
+        key = _element_key(element)
+        if added_counts[key] > 0:
+            added_counts[key] -= 1
+            added.append(element)
+
+    removed = []
+    for element in old:
+        key = _element_key(element)
+        if removed_counts[key] > 0:
+            removed_counts[key] -= 1
+            removed.append(element)
+
+    if isinstance(new, tuple):
+        return tuple(added), tuple(removed)
+    return added, removed
+
+
+def compute_delta(old, new) -> Delta:
+    """ Compute the difference between two versions of a collection. If there is no
+        previous version, every element of the new one is considered to be added.
+
+    :param old: The previous value, or None if there is no previous value.
+    :param new: The current value.
+    :return: The delta between the two values.
+    :rtype: Delta
+    """
+    if old is None or type(old) is not type(new):
+        return Delta(added=new, removed=_empty_like(new), changed=_empty_like(new))
+
+    if isinstance(new, Mapping):
+        added = {key: value for key, value in new.items() if key not in old}
+        removed = {key: value for key, value in old.items() if key not in new}
+        changed = {key: value for key, value in new.items() if key in old and old[key] != value}
+        return Delta(added=added, removed=removed, changed=changed)
+    elif isinstance(new, Set):
+        return Delta(added=new - old, removed=old - new, changed=_empty_like(new))
+    else:
+        added, removed = _diff_sequences(old, new)
+        return Delta(added=added, removed=removed, changed=_empty_like(new))
@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from yenta.utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['DirectoryBroker', 'Coordinator', 'Worker', 'RemoteTaskError']
+
+
+class RemoteTaskError(Exception):
+    pass
+
+
+class DirectoryBroker:
+    """ A job queue kept in a directory that the coordinator and all workers can access, e.g.
+        on a shared filesystem. Jobs are pickled files that move from `queue` to `claimed` when a
+        worker takes them (an atomic rename, so that each job is claimed by exactly one worker),
+        and their results are written to `results`. Job ids sort in the order in which the jobs
+        were submitted, and workers take the oldest job first. Workers prove that they are alive by
+        periodically touching a heartbeat file in `workers`.
+    """
+
+    def __init__(self, path: Path):
+
+        self.path = Path(path)
+        self.queue_path = self.path / 'queue'
+        self.claimed_path = self.path / 'claimed'
+        self.results_path = self.path / 'results'
+        self.workers_path = self.path / 'workers'
+
+        for path in (self.queue_path, self.claimed_path, self.results_path, self.workers_path):
+            path.mkdir(exist_ok=True, parents=True)
+
+    def put(self, job_id: str, job: Dict[str, Any]):
+        """ Add a job to the queue.
+
+        :param str job_id: The unique id of the job.
+        :param dict job: The job description.
+        :return: None
+        """
+        atomic_write(self.queue_path / f'{job_id}.pk', pickle.dumps(job))
+
+    def claim(self, worker_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """ Take the oldest job off the queue on behalf of a worker.
+
+        :param str worker_id: The id of the claiming worker.
+        :return: The id and the description of the job, or None if the queue is empty.
+        :rtype: Tuple[str, dict]
+        """
+        for job_file in sorted(self.queue_path.glob('*.pk')):
+            claimed_file = self.claimed_path / f'{worker_id}__{job_file.name}'
+            try:
+                os.rename(job_file, claimed_file)
+            except FileNotFoundError:
+                continue
+            os.utime(claimed_file)
+            with open(claimed_file, 'rb') as f:
+                return job_file.stem, pickle.load(f)
+
+        return None
+
+    def complete(self, worker_id: str, job_id: str, outcome: Tuple[str, Any]):
+        """ Publish the outcome of a job and release the worker's claim on it. A result that
+            cannot be pickled is published as an error, so that the job fails rather than the
+            worker, which would leave the job to be claimed, and fail, by every other worker.
+
+        :param str worker_id: The id of the worker that ran the job.
+        :param str job_id: The id of the job.
+        :param tuple outcome: Either ('ok', TaskResult) or ('error', message).
+        :return: None
+        """
+        try:
+            data = pickle.dumps(outcome)
+        except (pickle.PicklingError, TypeError, AttributeError) as ex:
+            logger.error(f'Unable to send the result of job {job_id}: {ex}')
+            data = pickle.dumps(('error', f'The result of the task cannot be pickled: {ex}'))
+        atomic_write(self.results_path / f'{job_id}.pk', data)
+        claimed_file = self.claimed_path / f'{worker_id}__{job_id}.pk'
+        if claimed_file.exists():
+            claimed_file.unlink()
+
+    def collect(self) -> Dict[str, Tuple[str, Any]]:
+        """ Remove and return all published outcomes.
+
+        :return: A dictionary whose keys are job ids and whose values are outcomes.
+        :rtype: Dict[str, tuple]
+        """
+        outcomes = {}
+        for result_file in self.results_path.glob('*.pk'):
+            with open(result_file, 'rb') as f:
+                outcomes[result_file.stem] = pickle.load(f)
+            result_file.unlink()
+
+        return outcomes
+
+    def heartbeat(self, worker_id: str):
+        """ Record that a worker is alive.
+
+        :param str worker_id: The id of the worker.
+        :return: None
+        """
+        info = {'pid': os.getpid(), 'host': socket.gethostname(), 'time': time.time()}
+        atomic_write(self.workers_path / worker_id, json.dumps(info).encode())
+
+    def retire(self, worker_id: str):
+        """ Remove the heartbeat of a worker that shuts down cleanly.
+
+        :param str worker_id: The id of the worker.
+        :return: None
+        """
+        heartbeat_file = self.workers_path / worker_id
+        if heartbeat_file.exists():
+            heartbeat_file.unlink()
+
+    def withdraw(self, job_id: str):
+        """ Remove a job from the queue if no worker has claimed it yet.
+
+        :param str job_id: The id of the job.
+        :return: None
+        """
+        job_file = self.queue_path / f'{job_id}.pk'
+        if job_file.exists():
+            job_file.unlink()
+
+    def live_workers(self, timeout: float) -> Set[str]:
+        """ Find the workers that sent a heartbeat in the last `timeout` seconds, and forget the others.
+
+        :param float timeout: The time after which a silent worker is presumed dead.
+        :return: The ids of the live workers.
+        :rtype: Set[str]
+        """
+        now = time.time()
+        alive = set()
+        for heartbeat_file in self.workers_path.iterdir():
+            try:
+                if now - heartbeat_file.stat().st_mtime <= timeout:
+                    alive.add(heartbeat_file.name)
+                else:
+                    logger.warning(f'Worker {heartbeat_file.name} stopped sending heartbeats')
+                    heartbeat_file.unlink()
+            except FileNotFoundError:
+                continue
+
+        return alive
+
+    def requeue_dead(self, timeout: float) -> int:
+        """ Put the jobs claimed by workers whose heartbeat is older than `timeout` seconds back
+            on the queue, so that another worker can run them. Jobs claimed less than `timeout`
+            seconds ago are left alone, so that workers that started after the heartbeats were
+            checked are not mistaken for dead ones.
+
+        :param float timeout: The time after which a silent worker is presumed dead.
+        :return: The number of requeued jobs.
+        :rtype: int
+        """
+        now = time.time()
+        alive = self.live_workers(timeout)
+
+        requeued = 0
+        for claimed_file in self.claimed_path.glob('*.pk'):
+            worker_id, _, job_name = claimed_file.name.partition('__')
+            if worker_id not in alive and now - claimed_file.stat().st_mtime > timeout:
+                logger.warning(f'Rescheduling job {job_name} claimed by dead worker {worker_id}')
+                try:
+                    os.rename(claimed_file, self.queue_path / job_name)
+                    requeued += 1
+                except FileNotFoundError:
+                    continue
+
+        return requeued
+
+
+class Coordinator:
+    """ Runs the tasks of a pipeline on remote workers. The pipeline still owns the task graph
+        and decides which tasks can be reused; only the tasks that must actually be executed are
+        sent to the workers through the broker. Pass a coordinator as the `invoker` of a
+        `Pipeline`, together with a `max_workers` equal to the number of jobs that may be
+        outstanding at once. Only one coordinator may use a broker directory at a time.
+
+        If no worker has sent a heartbeat for `worker_timeout` seconds while jobs are outstanding,
+        or the broker directory cannot be reached for that long, the outstanding jobs fail with a
+        `RemoteTaskError` instead of waiting for a worker that may never come.
+    """
+
+    def __init__(self, broker: DirectoryBroker, poll_interval: float = 0.1, worker_timeout: float = 30.0):
+        """
+        :param DirectoryBroker broker: The broker through which jobs are sent to the workers.
+        :param float poll_interval: How often to check for results, in seconds.
+        :param float worker_timeout: How long a worker may go without a heartbeat before its
+                                     jobs are rescheduled, and how long to wait for any worker
+                                     before the outstanding jobs fail, in seconds.
+        """
+
+        self.broker = broker
+        self.poll_interval = poll_interval
+        self.worker_timeout = worker_timeout
+
+        self._lock = threading.Lock()
+        self._waiting: Dict[str, list] = {}
+        self._collector: Optional[threading.Thread] = None
+
+    def _fail_waiting(self, message: str):
+
+        with self._lock:
+            waiting, self._waiting = self._waiting, {}
+        logger.error(message)
+        for job_id, waiter in waiting.items():
+            try:
+                self.broker.withdraw(job_id)
+            except OSError:
+                pass
+            waiter[1] = ('error', message)
+            waiter[0].set()
+
+    def _collect(self):
+
+        # the last time a worker was known to be alive; the collector starts whenever jobs are
+        # sent after a lull, which gives workers `worker_timeout` seconds to show up
+        last_alive = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._waiting:
+                    self._collector = None
+                    return
+            try:
+                for job_id, outcome in self.broker.collect().items():
+                    with self._lock:
+                        waiter = self._waiting.pop(job_id, None)
+                    if waiter:
+                        waiter[1] = outcome
+                        waiter[0].set()
+                self.broker.requeue_dead(self.worker_timeout)
+                if self.broker.live_workers(self.worker_timeout):
+                    last_alive = time.monotonic()
+            except Exception as ex:
+                logger.error(f'Caught exception collecting results from the workers: {ex}')
+            if time.monotonic() - last_alive > self.worker_timeout:
+                self._fail_waiting(f'No worker has sent a heartbeat to {self.broker.path} '
+                                   f'in the last {self.worker_timeout} seconds')
+            time.sleep(self.poll_interval)
+
+    def invoke(self, pipeline, task, args_dict: Dict[str, Any]):
+        """ Send a task to the workers and wait for its result.
+
+        :param Pipeline pipeline: The pipeline to which the task belongs.
+        :param Callable task: The task function.
+        :param dict args_dict: The arguments of the task.
+        :return: The task result
+        :rtype: TaskResult
+        """
+
+        job_id = f'{time.time_ns():020d}-{uuid.uuid4().hex}'
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._waiting[job_id] = waiter
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, daemon=True)
+                self._collector.start()
+
+        logger.debug(f'Sending {task.task_def.name} to the workers as job {job_id}')
+        self.broker.put(job_id, {'pipeline': pipeline.name, 'task': task.task_def.name, 'args': args_dict})
+        waiter[0].wait()
+
+        status, payload = waiter[1]
+        if status != 'ok':
+            raise RemoteTaskError(payload)
+        return payload
+
+
+class Worker:
+    """ Pulls jobs from a broker and runs them with the tasks loaded from the entry point. """
+
+    def __init__(self, broker: DirectoryBroker, tasks, pipeline_factory: Callable,
+                 poll_interval: float = 0.1, heartbeat_interval: float = 5.0):
+        """
+        :param DirectoryBroker broker: The broker from which jobs are taken.
+        :param tasks: The tasks loaded from the entry point.
+        :param Callable pipeline_factory: Builds the pipeline with a given name from the tasks.
+        :param float poll_interval: How often to check for new jobs, in seconds.
+        :param float heartbeat_interval: How often to signal that the worker is alive, in seconds.
+        """
+
+        self.broker = broker
+        self.tasks = {task.task_def.name: task for task in tasks}
+        self.pipeline_factory = pipeline_factory
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+        self._pipelines = {}
+        self._stopped = threading.Event()
+
+    def _send_heartbeats(self):
+
+        while not self._stopped.wait(self.heartbeat_interval):
+            self.broker.heartbeat(self.worker_id)
+
+    def run_job(self, job: Dict[str, Any]) -> Tuple[str, Any]:
+        """ Run a single job.
+
+        :param dict job: The job description.
+        :return: Either ('ok', TaskResult) or ('error', message).
+        :rtype: tuple
+        """
+
+        try:
+            task = self.tasks[job['task']]
+            if job['pipeline'] not in self._pipelines:
+                self._pipelines[job['pipeline']] = self.pipeline_factory(job['pipeline'])
+            return 'ok', self._pipelines[job['pipeline']].call_task(task, job['args'])
+        except Exception as ex:
+            logger.error(f'Caught exception executing {job["task"]}: {ex}')
+            return 'error', f'{ex}\n{traceback.format_exc()}'
+
+    def run(self, idle_timeout: Optional[float] = None):
+        """ Run jobs until stopped, or until no job has arrived for `idle_timeout` seconds.
+
+        :param float idle_timeout: Optionally exit after being idle for this long, in seconds.
+        :return: None
+        """
+
+        self.broker.heartbeat(self.worker_id)
+        heartbeats = threading.Thread(target=self._send_heartbeats, daemon=True)
+        heartbeats.start()
+        idle_since = time.monotonic()
+        try:
+            while not self._stopped.is_set():
+                claimed = self.broker.claim(self.worker_id)
+                if claimed is None:
+                    if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                job_id, job = claimed
+                logger.info(f'Worker {self.worker_id} running {job["task"]}')
+                self.broker.complete(self.worker_id, job_id, self.run_job(job))
+                idle_since = time.monotonic()
+        finally:
+            self._stopped.set()
+            self.broker.retire(self.worker_id)
+
+    def stop(self):
+        """ Ask the worker to exit after its current job.
+
+        :return: None
+        """
+        self._stopped.set()
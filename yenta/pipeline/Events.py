@@ -0,0 +1,272 @@
+import json
+import logging
+import threading
+import time
+
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from colorama import Fore, Style
+from rich.console import Console
+from rich.progress import BarColumn, Progress, TextColumn, TimeElapsedColumn
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['EventType', 'Event', 'EventBus', 'JsonlSink', 'ProgressDisplay']
+
+
+class EventType(str, Enum):
+
+    RUN_STARTED = 'run_started'
+    QUEUED = 'queued'
+    STARTED = 'started'
+    FINISHED = 'finished'
+    REUSED = 'reused'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+    RUN_FINISHED = 'run_finished'
+
+
+@dataclass
+class Event:
+    """ Something that happened during a run of a pipeline. Task events carry the name of the
+        task; events that conclude the execution of a task also carry its duration in seconds
+        and the size of its stored result in bytes, and failures carry the error and traceback.
+    """
+
+    type: EventType
+    pipeline: str
+    task: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+    duration: Optional[float] = None
+    size: Optional[int] = None
+    total: Optional[int] = None
+    error: Optional[str] = None
+    traceback: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """ Convert the event to a dictionary, leaving out the fields that are not set.
+
+        :return: The dictionary.
+        :rtype: Dict[str, Any]
+        """
+        event = {'type': self.type.value, 'pipeline': self.pipeline, 'timestamp': self.timestamp}
+        for name in ('task', 'duration', 'size', 'total', 'error', 'traceback'):
+            value = getattr(self, name)
+            if value is not None:
+                event[name] = value
+
+        return event
+
+
+class EventBus:
+    """ Delivers the events of pipeline runs to the handlers subscribed to it. Events may be
+        emitted from several threads at once, but are delivered to the handlers one at a time.
+        A bus without handlers is falsy, so that emitters can skip building events nobody reads.
+    """
+
+    def __init__(self):
+
+        self._handlers: List[Callable[[Event], Any]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler: Callable[[Event], Any]):
+        """ Deliver events to a handler.
+
+        :param Callable handler: A callable that takes an `Event`.
+        :return: None
+        """
+        with self._lock:
+            self._handlers.append(handler)
+
+    def unsubscribe(self, handler: Callable[[Event], Any]):
+        """ Stop delivering events to a handler.
+
+        :param Callable handler: A handler previously passed to `subscribe`.
+        :return: None
+        """
+        with self._lock:
+            self._handlers.remove(handler)
+
+    def emit(self, event: Event):
+        """ Deliver an event to every handler. A handler that fails is logged and does not
+            affect the run.
+
+        :param Event event: The event.
+        :return: None
+        """
+        with self._lock:
+            for handler in self._handlers:
+                try:
+                    handler(event)
+                except Exception:
+                    logger.exception('Event handler %r failed', handler)
+
+    def __bool__(self) -> bool:
+
+        return bool(self._handlers)
+
+
+class JsonlSink:
+    """ Appends events to a file as JSON, one event per line. Lines are flushed at most every
+        `flush_interval` seconds, and at the end of every run and on every failure, so that
+        the file can be tailed without the sink writing to it for every single event.
+    """
+
+    def __init__(self, path: Path, flush_interval: float = 0.5):
+        """
+        :param Path path: The file to which to append the events.
+        :param float flush_interval: The longest time for which events are buffered, in seconds.
+        """
+
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._file = open(self.path, 'a')
+        self._flushed = time.monotonic()
+
+    def __call__(self, event: Event):
+
+        self._file.write(json.dumps(event.to_dict()) + '\n')
+        now = time.monotonic()
+        if event.type in (EventType.FAILED, EventType.RUN_FINISHED) or now - self._flushed >= self.flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def close(self):
+        """ Flush and close the file.
+
+        :return: None
+        """
+        self._file.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.close()
+
+
+class ProgressDisplay:
+    """ Shows the progress of pipeline runs. In a terminal, this is a progress bar per run that
+        is redrawn at most `refresh_per_second` times per second however quickly tasks complete,
+        above which failures are printed as they happen; runs of different pipelines that overlap,
+        e.g. the configurations of a sweep, share the display. Otherwise, e.g. when the output is
+        redirected, failures are printed as they happen and the counts of each run at most every
+        `summary_interval` seconds and when it finishes; a line per reused or executed task is only
+        printed if `per_task` is set.
+    """
+
+    def __init__(self, console: Console = None, refresh_per_second: float = 4, summary_interval: float = 10,
+                 per_task: bool = False):
+        """
+        :param Console console: Optionally, the console to which to write; defaults to standard output.
+        :param float refresh_per_second: How often to redraw the progress bar.
+        :param float summary_interval: Without a terminal, the shortest time between two summaries, in seconds.
+        :param bool per_task: Without a terminal, whether to print a line for every task.
+        """
+
+        self.console = console
+        self.refresh_per_second = refresh_per_second
+        self.summary_interval = summary_interval
+        self.per_task = per_task
+
+        self._progress: Optional[Progress] = None
+        self._bars: Dict[str, Any] = {}
+        self._counts: Dict[str, Dict[EventType, int]] = {}
+        self._totals: Dict[str, Optional[int]] = {}
+        self._summarized = time.monotonic()
+
+    def __call__(self, event: Event):
+
+        if event.type == EventType.RUN_STARTED:
+            self._start(event)
+        elif event.type == EventType.RUN_FINISHED:
+            self._stop(event)
+        elif event.type in (EventType.REUSED, EventType.FINISHED, EventType.FAILED, EventType.SKIPPED):
+            if event.pipeline in self._bars:
+                self._advance(event)
+            else:
+                self._count(event)
+
+    def _start(self, event: Event):
+
+        if self._progress is None:
+            console = self.console or Console()
+            if not console.is_terminal:
+                self._counts[event.pipeline] = {EventType.FINISHED: 0, EventType.REUSED: 0, EventType.FAILED: 0}
+                self._totals[event.pipeline] = event.total
+                return
+            self._progress = Progress(TextColumn('[bold white]{task.description}'), BarColumn(),
+                                      TextColumn('{task.completed}/{task.total}'),
+                                      TextColumn('{task.fields[summary]}'), TimeElapsedColumn(),
+                                      console=console, refresh_per_second=self.refresh_per_second)
+            self._progress.start()
+        self._counts[event.pipeline] = {EventType.FINISHED: 0, EventType.REUSED: 0, EventType.FAILED: 0}
+        self._bars[event.pipeline] = self._progress.add_task(event.pipeline, total=event.total, summary='')
+
+    def _advance(self, event: Event):
+
+        counts = self._counts[event.pipeline]
+        if event.type in counts:
+            counts[event.type] += 1
+        if event.type == EventType.FAILED:
+            self._progress.console.print(f'[[bold red]\u2718[/bold red]] [bold white]{event.task}[/bold white]: '
+                                         f'{event.error}', markup=True, highlight=False)
+        summary = f'[green]{counts[EventType.FINISHED]} executed[/green], ' \
+                  f'[yellow]{counts[EventType.REUSED]} reused[/yellow], ' \
+                  f'[red]{counts[EventType.FAILED]} failed[/red]'
+        self._progress.update(self._bars[event.pipeline], advance=1, summary=summary)
+
+    def _stop(self, event: Event):
+
+        # the display is kept until every run that shares it has finished
+        if self._bars.pop(event.pipeline, None) is not None:
+            if not self._bars:
+                self._progress.stop()
+                self._progress = None
+                self._counts.clear()
+        elif event.pipeline in self._counts:
+            self._print_summary(event.pipeline)
+            del self._counts[event.pipeline]
+            self._totals.pop(event.pipeline, None)
+
+    def _count(self, event: Event):
+
+        counts = self._counts.setdefault(event.pipeline,
+                                         {EventType.FINISHED: 0, EventType.REUSED: 0, EventType.FAILED: 0})
+        if event.type in counts:
+            counts[event.type] += 1
+        if event.type == EventType.FAILED or self.per_task:
+            self._print_outcome(event)
+        if time.monotonic() - self._summarized >= self.summary_interval:
+            self._print_summary(event.pipeline)
+
+    def _print_summary(self, pipeline: str):
+
+        counts = self._counts[pipeline]
+        done = sum(counts.values())
+        total = self._totals.get(pipeline)
+        print(Fore.WHITE + Style.BRIGHT + f'{pipeline}: {done}/{total if total is not None else "?"} tasks, '
+              f'{counts[EventType.FINISHED]} executed, {counts[EventType.REUSED]} reused, '
+              f'{counts[EventType.FAILED]} failed')
+        self._summarized = time.monotonic()
+
+    @staticmethod
+    def _print_outcome(event: Event):
+
+        if event.type == EventType.REUSED:
+            marker = Fore.YELLOW + u'\u2014' + Fore.WHITE
+        elif event.type == EventType.FINISHED:
+            marker = Fore.GREEN + u'\u2714' + Fore.WHITE
+        elif event.type == EventType.FAILED:
+            marker = Fore.RED + u'\u2718' + Fore.WHITE
+        else:
+            return
+
+        print(Fore.WHITE + Style.BRIGHT + f'[{marker}] {event.task}')
@@ -0,0 +1,319 @@
+import json
+import logging
+import os
+
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, TextIO, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from yenta.artifacts.Artifact import file_artifacts
+from yenta.pipeline.Pipeline import Pipeline, PipelineResult, TaskStatus
+from yenta.pipeline.Scheduler import upward_ranks
+from yenta.tasks.Task import ParameterType
+from yenta.utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TaskAnnotation', 'GraphExportError', 'annotate_tasks', 'cache_states', 'critical_path',
+           'neighbourhood', 'export_task_graph', 'GRAPH_FORMATS']
+
+# the fill color of the tasks in each cache state in DOT output
+CACHE_COLORS = {'cached': 'palegreen', 'stale': 'khaki', 'missing': 'lightgrey', 'failed': 'salmon'}
+
+
+class GraphExportError(Exception):
+    pass
+
+
+@dataclass
+class TaskAnnotation:
+    """ What the store of a pipeline says about a task. `status` is the state of the task in the
+        latest run that included it, as recorded in the history; `duration` is the duration of its
+        latest execution, in seconds, and `size` that of its stored result, in bytes. `cache` is
+        `cached` if the next run would reuse its result, `stale` if it may be executed again,
+        `missing` if it has no stored result and `failed` if its stored result is a failure.
+    """
+
+    status: Optional[str] = None
+    duration: Optional[float] = None
+    size: Optional[int] = None
+    cache: Optional[str] = None
+
+    def summary(self) -> List[str]:
+        """ Describe the known parts of the annotation briefly, e.g. for the label of a node. """
+
+        parts = [self.status] if self.status else []
+        if self.duration is not None:
+            parts.append(f'{self.duration:.2f} s')
+        if self.size is not None:
+            parts.append(_format_size(self.size))
+        if self.cache:
+            parts.append(self.cache)
+        return parts
+
+
+def _format_size(size: int) -> str:
+
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def _stored_inputs_match(pipeline: Pipeline, task_name: str, stored: PipelineResult) -> bool:
+
+    # project the stored results of the dependencies as a run would, assuming that the pipeline parameters are unchanged
+    task = pipeline._tasks_by_name[task_name]
+    previous_inputs = stored.task_inputs.get(task_name, None)
+    if previous_inputs is None:
+        return False
+    own = previous_inputs.task_results.get(task_name, None)
+    params = {spec.param_name: own.values[spec.param_name] for spec in task.task_def.param_specs
+              if spec.param_type == ParameterType.PARAMETER and own is not None and spec.param_name in own.values}
+
+    args = PipelineResult()
+    for dependency in pipeline._dependencies[task_name]:
+        args.task_results[dependency] = stored.task_results[dependency]
+    try:
+        inputs = Pipeline.project_inputs(task, args, Pipeline.build_args_dict(task, args, params))
+    except Exception as ex:
+        logger.debug('Unable to project the stored inputs of %s: %s', task_name, ex)
+        return False
+
+    return Pipeline.reusable_result(task_name, stored, inputs) is not None
+
+
+def cache_states(pipeline: Pipeline, task_names: Iterable[str]) -> Dict[str, str]:
+    """ Work out whether the next run of a pipeline would reuse the stored results of tasks. A task is
+        stale when it is not pure, when the files of its artifacts are missing or changed, when its
+        stored inputs differ from what the stored results of its dependencies would give it, or when
+        any of its dependencies is not cached itself. Only the tasks and their ancestors are read.
+
+    :param Pipeline pipeline: The pipeline.
+    :param task_names: The names of the tasks.
+    :return: The cache state of each task and each of its ancestors.
+    :rtype: Dict[str, str]
+    """
+    graph = pipeline.task_graph
+    needed, frontier = set(task_names), list(task_names)
+    while frontier:
+        for dependency in graph.predecessors(frontier.pop()):
+            if dependency not in needed:
+                needed.add(dependency)
+                frontier.append(dependency)
+
+    stored = pipeline.load_pipeline(pipeline.store_path, LRUCache(), pipeline.memory_store)
+    states = {}
+    for task_name in pipeline.execution_order:
+        if task_name not in needed:
+            continue
+        output = stored.task_results.get(task_name, None)
+        if output is None:
+            states[task_name] = 'missing'
+        elif output.status != TaskStatus.SUCCESS:
+            states[task_name] = 'failed'
+        elif not pipeline._tasks_by_name[task_name].task_def.pure \
+                or any(states.get(dependency, None) != 'cached' for dependency in pipeline._dependencies[task_name]) \
+                or not all(artifact.is_fresh() for value in output.values.values()
+                           for artifact in file_artifacts(value)) \
+                or not _stored_inputs_match(pipeline, task_name, stored):
+            states[task_name] = 'stale'
+        else:
+            states[task_name] = 'cached'
+
+    return states
+
+
+def annotate_tasks(pipeline: Pipeline, task_names: Iterable[str]) -> Dict[str, TaskAnnotation]:
+    """ Gather what the store of a pipeline says about tasks.
+
+    :param Pipeline pipeline: The pipeline.
+    :param task_names: The names of the tasks.
+    :return: The annotation of each task.
+    :rtype: Dict[str, TaskAnnotation]
+    """
+    task_names = list(task_names)
+    wanted = set(task_names)
+    durations = pipeline.load_durations()
+    statuses = {}
+    for run in reversed(pipeline.history.runs()):
+        for task_name, record in run.tasks.items():
+            statuses.setdefault(task_name, record.state)
+        if statuses.keys() >= wanted:
+            break
+    states = cache_states(pipeline, task_names)
+
+    annotations = {}
+    for task_name in task_names:
+        size = None
+        if pipeline.memory_store is None:
+            try:
+                size = os.stat(pipeline.store_path / task_name / 'result.pk').st_size
+            except OSError:
+                pass
+        annotations[task_name] = TaskAnnotation(statuses.get(task_name, None), durations.get(task_name, None),
+                                                size, states[task_name])
+
+    return annotations
+
+
+def critical_path(pipeline: Pipeline) -> List[str]:
+    """ Find the chain of dependent tasks that takes the longest, based on the durations recorded for
+        the tasks; tasks without a recorded duration count as the median duration.
+
+    :param Pipeline pipeline: The pipeline.
+    :return: The names of the tasks on the path, in order.
+    :rtype: List[str]
+    """
+    graph = pipeline.task_graph
+    ranks = upward_ranks(graph, pipeline.execution_order, pipeline.load_durations())
+    sources = [task_name for task_name in pipeline.execution_order if not any(graph.predecessors(task_name))]
+    current = max(sources, key=ranks.get, default=None)
+
+    path = []
+    while current is not None:
+        path.append(current)
+        current = max(graph.successors(current), key=ranks.get, default=None)
+    return path
+
+
+def neighbourhood(pipeline: Pipeline, task_name: str, depth: int) -> Set[str]:
+    """ Find the tasks that are at most `depth` dependencies or dependents away from a task.
+
+    :param Pipeline pipeline: The pipeline.
+    :param str task_name: The name of the task.
+    :param int depth: The largest number of edges between the task and the tasks that are found.
+    :return: The names of the tasks, including the task itself.
+    :rtype: Set[str]
+    """
+    graph = pipeline.task_graph
+    if task_name not in pipeline._tasks_by_name:
+        raise GraphExportError(f'Unknown task {task_name}')
+
+    found, frontier = {task_name}, [task_name]
+    for _ in range(depth):
+        frontier = [other for current in frontier
+                    for other in (*graph.predecessors(current), *graph.successors(current)) if other not in found]
+        found.update(frontier)
+    return found
+
+
+def _dot_string(*lines: str) -> str:
+
+    return '"' + '\\n'.join(line.replace('\\', '\\\\').replace('"', '\\"') for line in lines) + '"'
+
+
+def _write_dot(f: TextIO, name: str, nodes: List[str], edges: Iterable[Tuple[str, str]],
+               annotations: Dict[str, TaskAnnotation]):
+
+    f.write(f'digraph {_dot_string(name)} {{\n')
+    f.write('  node [shape=box, style="rounded,filled", fillcolor=white];\n')
+    for task_name in nodes:
+        annotation = annotations.get(task_name, None)
+        if annotation is None:
+            f.write(f'  {_dot_string(task_name)};\n')
+            continue
+        f.write(f'  {_dot_string(task_name)} [label={_dot_string(task_name, " | ".join(annotation.summary()))}, '
+                f'fillcolor={CACHE_COLORS.get(annotation.cache, "white")}];\n')
+    for source, target in edges:
+        f.write(f'  {_dot_string(source)} -> {_dot_string(target)};\n')
+    f.write('}\n')
+
+
+def _write_json(f: TextIO, name: str, nodes: List[str], edges: Iterable[Tuple[str, str]],
+                annotations: Dict[str, TaskAnnotation]):
+
+    # one node or edge per line, so that large graphs can be read back a line at a time as well
+    f.write(f'{{"name": {json.dumps(name)},\n "nodes": [')
+    for index, task_name in enumerate(nodes):
+        annotation = annotations.get(task_name, None)
+        node = {'id': task_name, **(asdict(annotation) if annotation else {})}
+        f.write(f'{"," if index else ""}\n  {json.dumps(node)}')
+    f.write('\n ],\n "edges": [')
+    for index, (source, target) in enumerate(edges):
+        f.write(f'{"," if index else ""}\n  {json.dumps({"source": source, "target": target})}')
+    f.write('\n ]}\n')
+
+
+def _write_graphml(f: TextIO, name: str, nodes: List[str], edges: Iterable[Tuple[str, str]],
+                   annotations: Dict[str, TaskAnnotation]):
+
+    keys = {'status': 'string', 'duration': 'double', 'size': 'long', 'cache': 'string'}
+    f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    for key, key_type in keys.items():
+        f.write(f'  <key id="{key}" for="node" attr.name="{key}" attr.type="{key_type}"/>\n')
+    f.write(f'  <graph id={quoteattr(name)} edgedefault="directed">\n')
+    for task_name in nodes:
+        annotation = annotations.get(task_name, None)
+        data = {key: value for key, value in asdict(annotation).items() if value is not None} if annotation else {}
+        if not data:
+            f.write(f'    <node id={quoteattr(task_name)}/>\n')
+            continue
+        f.write(f'    <node id={quoteattr(task_name)}>\n')
+        for key, value in data.items():
+            f.write(f'      <data key="{key}">{escape(str(value))}</data>\n')
+        f.write('    </node>\n')
+    for source, target in edges:
+        f.write(f'    <edge source={quoteattr(source)} target={quoteattr(target)}/>\n')
+    f.write('  </graph>\n</graphml>\n')
+
+
+# the writer of each format, and the suffixes of the files from which the format is inferred
+GRAPH_FORMATS = {
+    'dot': (_write_dot, ('.dot', '.gv')),
+    'json': (_write_json, ('.json',)),
+    'graphml': (_write_graphml, ('.graphml',)),
+}
+
+
+def export_task_graph(pipeline: Pipeline, path: Path, graph_format: str = None, around: str = None, depth: int = 1,
+                      only_stale: bool = False, on_critical_path: bool = False, annotate: bool = True) -> int:
+    """ Write the task graph of a pipeline to a file, one node or edge at a time, with each task
+        annotated with its latest status, duration, result size and cache state. The graph can be
+        restricted to the neighbourhood of a task, to the critical path of the pipeline and to the
+        tasks that are not cached; only the tasks that are kept, and the edges between them, are
+        written, and only they and their ancestors are read from the store.
+
+    :param Pipeline pipeline: The pipeline.
+    :param Path path: The file to write.
+    :param str graph_format: One of `dot`, `json` or `graphml`; defaults to the format that matches the
+                             suffix of the file, or `dot`.
+    :param str around: Optionally, keep only the tasks at most `depth` edges away from this task.
+    :param int depth: The depth of the neighbourhood of `around`.
+    :param bool only_stale: Whether to keep only the tasks that the next run may execute.
+    :param bool on_critical_path: Whether to keep only the tasks on the critical path.
+    :param bool annotate: Whether to annotate the tasks, which reads the store; `only_stale` implies it.
+    :return: The number of tasks written.
+    :rtype: int
+    """
+    path = Path(path)
+    if graph_format is None:
+        graph_format = next((name for name, (_, suffixes) in GRAPH_FORMATS.items() if path.suffix in suffixes),
+                            'dot')
+    if graph_format not in GRAPH_FORMATS:
+        raise GraphExportError(f'Unknown graph format {graph_format}, expected one of {", ".join(GRAPH_FORMATS)}')
+
+    nodes = list(pipeline.execution_order)
+    if around is not None:
+        kept = neighbourhood(pipeline, around, depth)
+        nodes = [task_name for task_name in nodes if task_name in kept]
+    if on_critical_path:
+        kept = set(critical_path(pipeline))
+        nodes = [task_name for task_name in nodes if task_name in kept]
+    annotations = annotate_tasks(pipeline, nodes) if annotate or only_stale else {}
+    if only_stale:
+        nodes = [task_name for task_name in nodes if annotations[task_name].cache != 'cached']
+
+    kept = set(nodes)
+    graph = pipeline.task_graph
+    edges = ((source, target) for source in nodes for target in graph.successors(source) if target in kept)
+
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        GRAPH_FORMATS[graph_format][0](f, pipeline.name, nodes, edges, annotations)
+    os.replace(tmp_path, path)
+
+    logger.info('Wrote %d of %d tasks of %s to %s', len(nodes), len(pipeline.execution_order), pipeline.name, path)
+    return len(nodes)
@@ -0,0 +1,77 @@
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List
+
+from yenta.pipeline.Pipeline import Pipeline, PipelineConfigError, PipelineResult
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['PipelineGroup', 'stored_pipelines']
+
+
+def stored_pipelines(store_root: Path) -> List[str]:
+    """ List the pipelines that have a store under a root. Hidden directories, such as the result
+        index, are left out, and so are the pipelines of the configurations of sweeps, which are
+        run through their sweep.
+
+    :param Path store_root: The root of the store, i.e. `settings.YENTA_STORE_PATH`.
+    :return: The names of the pipelines, sorted.
+    :rtype: List[str]
+    """
+    if not os.path.isdir(store_root):
+        return []
+    with os.scandir(store_root) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.is_dir() and not entry.name.startswith('.') and '@' not in entry.name)
+
+
+class PipelineGroup:
+    """ Runs several pipelines at once in one process, so that the tasks are imported and the task
+        graph is built only once. The tasks of all the pipelines are interleaved on a single pool of
+        `max_workers` threads, while every pipeline keeps its own store, scheduler and events, and
+        starts at most its own `max_workers` tasks at once.
+    """
+
+    def __init__(self, pipelines: List[Pipeline], max_workers: int = 1):
+        """
+        :param pipelines: The pipelines, which must have distinct names.
+        :param int max_workers: The number of tasks that may be executed at once across all the pipelines.
+        """
+
+        if max_workers < 1:
+            raise PipelineConfigError(f'A pipeline group needs at least one worker, got {max_workers}')
+
+        self.max_workers = max_workers
+        self.pipelines: Dict[str, Pipeline] = {}
+        for pipeline in pipelines:
+            if pipeline.name in self.pipelines:
+                raise PipelineConfigError(f'The pipeline {pipeline.name} is part of the group more than once')
+            self.pipelines[pipeline.name] = pipeline
+
+    def run(self, up_to: str = None, force_rerun: List[str] = None) -> Dict[str, PipelineResult]:
+        """ Run all the pipelines. If one of them fails to run, e.g. because it is misconfigured,
+            the others still run to completion before the error is raised.
+
+        :param str up_to: If supplied, run the pipelines only up to this task.
+        :param List[str] force_rerun: Optionally force the listed tasks to be executed in every pipeline.
+        :return: The final state of each pipeline, by its name.
+        :rtype: Dict[str, PipelineResult]
+        """
+        logger.info('Running %d pipelines on %d workers', len(self.pipelines), self.max_workers)
+        # every pipeline is driven by a thread of its own, which only schedules its tasks and waits for them,
+        # so that a pipeline waiting for its tasks never holds a worker that another pipeline needs
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='yenta-worker') as workers, \
+                ThreadPoolExecutor(max_workers=len(self.pipelines)) as drivers:
+            for pipeline in self.pipelines.values():
+                pipeline.executor = workers
+            try:
+                futures = {name: drivers.submit(pipeline.run_pipeline, up_to, force_rerun)
+                           for name, pipeline in self.pipelines.items()}
+                wait(futures.values())
+                return {name: future.result() for name, future in futures.items()}
+            finally:
+                for pipeline in self.pipelines.values():
+                    pipeline.executor = None
@@ -0,0 +1,245 @@
+import json
+import os
+import sys
+import uuid
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+__all__ = ['TaskRecord', 'RunRecord', 'RunHistory', 'MemoryHistory', 'Regression', 'UnknownRunError', 'compare_runs',
+           'max_rss']
+
+
+class UnknownRunError(Exception):
+    pass
+
+
+@dataclass
+class TaskRecord:
+    """ The outcome of a task in a single run. `state` is one of `executed`, `reused`, `failed`
+        or `skipped`; the duration is in seconds and the size of the stored result in bytes, and
+        both are None when they were not measured, e.g. the size of a reused result.
+    """
+
+    state: str
+    duration: Optional[float] = None
+    size: Optional[int] = None
+
+    def to_list(self) -> list:
+
+        return [self.state, self.duration, self.size]
+
+    @classmethod
+    def from_list(cls, record: list) -> 'TaskRecord':
+
+        return cls(*record)
+
+
+@dataclass
+class RunRecord:
+    """ A single run of a pipeline, as recorded in its history. """
+
+    run_id: str
+    pipeline: str
+    started: float
+    duration: float
+    max_rss: Optional[int] = None
+    tasks: Dict[str, TaskRecord] = field(default_factory=dict)
+
+    @staticmethod
+    def new_id(started: float) -> str:
+        """ Generate an identifier for a run, which sorts by the time at which the run started. Runs
+            that start in the same second are told apart by 32 random bits, so that a prefix that
+            leaves out a few of them is still very unlikely to match several runs.
+
+        :param float started: The time at which the run started, as returned by `time.time`.
+        :return: The identifier.
+        :rtype: str
+        """
+        return f'{datetime.fromtimestamp(started):%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}'
+
+    def count(self, state: str) -> int:
+        """ Count the tasks that ended in a state.
+
+        :param str state: The state.
+        :return: The number of tasks.
+        :rtype: int
+        """
+        return sum(1 for record in self.tasks.values() if record.state == state)
+
+    @property
+    def reuse_rate(self) -> Optional[float]:
+        """ The fraction of the tasks that ran, i.e. were not skipped, whose previous result was reused. """
+
+        ran = len(self.tasks) - self.count('skipped')
+        return self.count('reused') / ran if ran else None
+
+    def to_json(self) -> str:
+
+        return json.dumps({'run_id': self.run_id, 'pipeline': self.pipeline, 'started': self.started,
+                           'duration': self.duration, 'max_rss': self.max_rss,
+                           'tasks': {name: record.to_list() for name, record in self.tasks.items()}})
+
+    @classmethod
+    def from_json(cls, line: str) -> 'RunRecord':
+
+        data = json.loads(line)
+        data['tasks'] = {name: TaskRecord.from_list(record) for name, record in data['tasks'].items()}
+        return cls(**data)
+
+
+def max_rss() -> Optional[int]:
+    """ Return the peak resident memory of this process, in bytes, if the platform reports it.
+
+    :return: The peak memory, or None.
+    :rtype: int
+    """
+    if resource is None:
+        return None  # pragma: no cover
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunHistory:
+    """ The append-only record of the runs of a pipeline, kept in `history.jsonl` in its store
+        with one run per line. Writers must hold the lock of the pipeline.
+    """
+
+    FILE_NAME = 'history.jsonl'
+
+    def __init__(self, store_path: Path):
+        """
+        :param Path store_path: The directory in which the pipeline is stored.
+        """
+
+        self.path = Path(store_path) / self.FILE_NAME
+
+    def append(self, run: RunRecord):
+        """ Record a run.
+
+        :param RunRecord run: The run.
+        :return: None
+        """
+        line = (run.to_json() + '\n').encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def runs(self) -> List[RunRecord]:
+        """ Read all the recorded runs, oldest first. A line that was cut short, e.g. because the
+            process writing it was killed, is ignored.
+
+        :return: The runs.
+        :rtype: List[RunRecord]
+        """
+        if not self.path.exists():
+            return []
+
+        runs = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    runs.append(RunRecord.from_json(line))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return runs
+
+    def get(self, reference: str, runs: List[RunRecord] = None) -> RunRecord:
+        """ Find a run by its number in the history, counting from 1 for the oldest run, or from -1
+            for the latest one, by its identifier or a unique prefix of it, or as `latest` or
+            `previous`.
+
+        :param str reference: The number or identifier of the run.
+        :param List[RunRecord] runs: Optionally, the runs as returned by `runs`.
+        :return: The run.
+        :rtype: RunRecord
+        """
+        runs = self.runs() if runs is None else runs
+        reference = {'latest': '-1', 'previous': '-2'}.get(reference, reference)
+        try:
+            number = int(reference)
+        except ValueError:
+            number = None
+        if number is not None and len(reference) < 8:
+            if 1 <= number <= len(runs):
+                return runs[number - 1]
+            if -len(runs) <= number <= -1:
+                return runs[number]
+            raise UnknownRunError(f'There is no run number {reference}; the history has {len(runs)} runs')
+
+        matches = [run for run in runs if run.run_id.startswith(reference)]
+        if len(matches) != 1:
+            raise UnknownRunError(f'{"No" if not matches else "More than one"} run matches {reference}')
+        return matches[0]
+
+
+class MemoryHistory(RunHistory):
+    """ The record of the runs of a pipeline whose store is a `MemoryStore`, which is kept in memory. """
+
+    def __init__(self):
+
+        self.path = None
+        self._runs: List[RunRecord] = []
+
+    def append(self, run: RunRecord):
+
+        self._runs.append(run)
+
+    def runs(self) -> List[RunRecord]:
+
+        return list(self._runs)
+
+
+@dataclass
+class Regression:
+    """ A measurement of a task, or of the run as a whole if `task` is None, that grew between two runs. """
+
+    task: Optional[str]
+    metric: str
+    before: float
+    after: float
+
+    @property
+    def ratio(self) -> float:
+
+        return self.after / self.before if self.before else float('inf')
+
+
+def compare_runs(before: RunRecord, after: RunRecord, threshold: float = 0.2, min_duration: float = 0.05,
+                 min_size: int = 1024) -> List[Regression]:
+    """ Find the tasks whose duration or result size grew by more than `threshold` between two runs,
+        as well as a growth of the peak memory of the process. Tasks that were not executed in both
+        runs are not compared, and neither are durations and sizes below `min_duration` seconds or
+        `min_size` bytes in the later run, which are dominated by noise.
+
+    :param RunRecord before: The earlier run.
+    :param RunRecord after: The later run.
+    :param float threshold: The relative growth beyond which a measurement has regressed, e.g. 0.2 for 20%.
+    :param float min_duration: The shortest duration that is compared, in seconds.
+    :param int min_size: The smallest result size that is compared, in bytes.
+    :return: The regressions, largest first.
+    :rtype: List[Regression]
+    """
+    regressions = []
+    for task_name, record in after.tasks.items():
+        previous = before.tasks.get(task_name, None)
+        if previous is None or record.state != 'executed' or previous.state != 'executed':
+            continue
+        for metric, minimum in (('duration', min_duration), ('size', min_size)):
+            old, new = getattr(previous, metric), getattr(record, metric)
+            if old is not None and new is not None and new >= minimum and new > old * (1 + threshold):
+                regressions.append(Regression(task_name, metric, old, new))
+
+    if before.max_rss and after.max_rss and after.max_rss > before.max_rss * (1 + threshold):
+        regressions.append(Regression(None, 'max_rss', before.max_rss, after.max_rss))
+
+    return sorted(regressions, key=lambda regression: regression.ratio, reverse=True)
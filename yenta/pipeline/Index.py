@@ -0,0 +1,207 @@
+import inspect
+import io
+import logging
+import marshal
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from hashlib import sha1
+from pathlib import Path
+from typing import Any, Optional
+
+from yenta.artifacts.Artifact import FileArtifact
+from yenta.artifacts.Handle import FileHandle, relocate_file_handles, store_file_handles
+from yenta.utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ResultIndex', 'task_fingerprint']
+
+
+def task_fingerprint(task) -> str:
+    """ Compute a fingerprint of the code of a task, which changes when the body of the task is
+        edited but not when other parts of the file containing it move around.
+
+    :param Callable task: The task function.
+    :return: The fingerprint.
+    :rtype: str
+    """
+    func = inspect.unwrap(task)
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = marshal.dumps(func.__code__)
+    return sha1(code).hexdigest()
+
+
+class _KeyPickler(pickle.Pickler):
+
+    # files are identified by their contents rather than by where they are, which differs between pipelines,
+    # and artifacts by their location and contents rather than by when they were created
+    def persistent_id(self, obj: Any):
+
+        if isinstance(obj, FileHandle):
+            return 'handle', obj.digest
+        if isinstance(obj, FileArtifact):
+            return 'artifact', str(obj.location), obj.hash
+        return None
+
+
+class ResultIndex:
+    """ The results of pure tasks shared by all the pipelines in a store, in `.index` at the root
+        of the store. Results are keyed by the name and the code of their task and by the inputs
+        from which they were computed, so that a pipeline executing a task that another pipeline
+        has already executed with the same code and inputs can adopt its result instead.
+
+        An entry is a directory holding the pickled result and copies of the files of its handles,
+        so that it does not change along with the store of the pipeline that published it. Entries
+        are published by renaming them into place and are never modified afterwards, so they can
+        be read without any lock. They are grouped by task, so that the entries of a task can be
+        removed together, and their modification time is updated whenever they are used, so that
+        entries that no pipeline has used for a while can be pruned.
+    """
+
+    DIRECTORY = '.index'
+
+    def __init__(self, root: Path):
+        """
+        :param Path root: The root of the store, i.e. `settings.YENTA_STORE_PATH`.
+        """
+
+        self.path = Path(root) / self.DIRECTORY
+
+    @staticmethod
+    def key(task_name: str, fingerprint: str, inputs: Any) -> str:
+        """ Compute the key of a task invocation.
+
+        :param str task_name: The name of the task.
+        :param str fingerprint: The fingerprint of the code of the task, from `task_fingerprint`.
+        :param inputs: The projected inputs of the task.
+        :return: The key.
+        :rtype: str
+        """
+        buffer = io.BytesIO()
+        _KeyPickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(inputs)
+        return sha1(f'{task_name}:{fingerprint}:'.encode() + buffer.getvalue()).hexdigest()
+
+    def entry_path(self, task_name: str, key: str) -> Path:
+
+        return self.path / task_name / key[:2] / key
+
+    def get(self, task_name: str, key: str) -> Optional[Any]:
+        """ Load the result stored under a key. The handles among its values point at the files
+            of the entry, which must be copied before they are used elsewhere.
+
+        :param str task_name: The name of the task.
+        :param str key: The key.
+        :return: The result, or None if there is no entry for the key.
+        :rtype: TaskResult
+        """
+        entry_path = self.entry_path(task_name, key)
+        try:
+            with open(entry_path / 'result.pk', 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (EOFError, pickle.UnpicklingError) as ex:
+            logger.warning('Ignoring the unreadable entry %s of the result index: %s', key, ex)
+            return None
+
+        self._touch(entry_path)
+        return result
+
+    def put(self, task_name: str, key: str, result: Any):
+        """ Store a result under a key, unless there is an entry for the key already. The files
+            of the handles among its values are copied into the entry.
+
+        :param str task_name: The name of the task.
+        :param str key: The key.
+        :param TaskResult result: The successful result of the task; it is not modified.
+        :return: None
+        """
+        entry_path = self.entry_path(task_name, key)
+        if entry_path.exists():
+            self._touch(entry_path)
+            return
+
+        entry_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = Path(tempfile.mkdtemp(prefix=f'.{key}.', dir=entry_path.parent))
+        try:
+            result = pickle.loads(pickle.dumps(result))
+            store_file_handles(result.values, tmp_path / 'values')
+            relocate_file_handles(result, tmp_path, entry_path)
+            atomic_write(tmp_path / 'result.pk', pickle.dumps(result))
+            try:
+                os.rename(tmp_path, entry_path)
+            except OSError:
+                # another pipeline published the same result first
+                pass
+        finally:
+            if tmp_path.exists():
+                shutil.rmtree(tmp_path)
+
+    def remove(self, task_name: str) -> int:
+        """ Remove the entries of a task, so that pipelines execute the task again rather than adopt
+            a result from the index.
+
+        :param str task_name: The name of the task.
+        :return: The number of entries removed.
+        :rtype: int
+        """
+        task_path = self.path / task_name
+        if not task_path.is_dir():
+            return 0
+
+        removed = sum(1 for shard in task_path.iterdir() if shard.is_dir()
+                      for entry in shard.iterdir() if not entry.name.startswith('.'))
+        shutil.rmtree(task_path, ignore_errors=True)
+        return removed
+
+    def prune(self, max_age: float) -> int:
+        """ Remove the entries that no pipeline has published or adopted for `max_age` seconds, along
+            with the leftovers of entries whose publication was interrupted. An entry pruned while a
+            pipeline adopts it makes that pipeline execute the task instead.
+
+        :param float max_age: The age, in seconds, above which entries are removed.
+        :return: The number of entries removed.
+        :rtype: int
+        """
+        if not self.path.is_dir():
+            return 0
+
+        cutoff = time.time() - max_age
+        removed = 0
+        for task_path in self.path.iterdir():
+            for shard in task_path.iterdir() if task_path.is_dir() else ():
+                for entry in shard.iterdir() if shard.is_dir() else ():
+                    try:
+                        if entry.stat().st_mtime >= cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    shutil.rmtree(entry, ignore_errors=True)
+                    if not entry.name.startswith('.'):
+                        removed += 1
+                self._remove_if_empty(shard)
+            self._remove_if_empty(task_path)
+
+        return removed
+
+    @staticmethod
+    def _touch(entry_path: Path):
+
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove_if_empty(directory: Path):
+
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
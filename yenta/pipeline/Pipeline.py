@@ -1,23 +1,44 @@
+import inspect
 import io
 import json
 import logging
+import os
 import tempfile
 import pickle
 import shutil
+import time
+import traceback
 
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from dataclasses import dataclass, field, asdict
 from enum import Enum
+from functools import lru_cache
+from hashlib import sha1
 from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Union, Any
+from typing import Dict, Iterable, List, Optional, Set, Union, Any, Tuple
 
 import networkx as nx
-from colorama import Fore, Style
+from colorama import Fore
 from more_itertools import split_after
 
-from yenta.artifacts.Artifact import Artifact
+from yenta.artifacts.Artifact import Artifact, file_artifacts
+from yenta.artifacts.Handle import FileHandle, store_file_handles
+from yenta.artifacts.Store import ArtifactStore
+from yenta.pipeline.Delta import compute_delta, is_collection
+from yenta.pipeline.Events import Event, EventBus, EventType, ProgressDisplay
+from yenta.pipeline.History import RunHistory, RunRecord, TaskRecord, max_rss
+from yenta.pipeline.Index import ResultIndex, task_fingerprint
+from yenta.pipeline.Profile import TaskProfiler
+from yenta.pipeline.Scheduler import Scheduler, upward_ranks
+from yenta.pipeline.Store import MISSING, MemoryStore, Prefetcher, StoredResults
 from yenta.config import settings
 from yenta.tasks.Task import TaskDef, ParameterType, ResultSpec
+from yenta.utils.cache import LRUCache, load_pickle
+from yenta.utils.files import atomic_write
+from yenta.utils.locks import LeaseLock
+from yenta.utils.trace import Tracer, no_span, span
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +55,10 @@ class PipelineConfigError(Exception):
     pass
 
 
+class MappedTaskError(Exception):
+    pass
+
+
 class TaskStatus(str, Enum):
 
     SUCCESS = 'success'
@@ -65,15 +90,20 @@ class PipelineResult:
     task_inputs: Dict[str, 'PipelineResult'] = field(default_factory=dict)
     """ A dictionary whose keys are task names and whose values are the inputs used in executing that task."""
 
-    def values(self, task_name: str, value_name: str):
+    def values(self, task_name: str, value_name: str, handle: bool = False):
         """ Return the value named `value_name` that was produced by task `task_name`.
 
         :param str task_name: The name of the task
         :param str value_name: The name of the value
+        :param bool handle: If the value is stored in a file, return its `FileHandle`
+                            instead of the contents of the file.
         :return: the unwrapped value produced by the task
-        :rtype: Union[list, int, bool, float, str]
+        :rtype: Union[list, int, bool, float, str, bytes, FileHandle]
         """
-        return self.task_results[task_name].values[value_name]
+        value = self.task_results[task_name].values[value_name]
+        if isinstance(value, FileHandle) and not handle:
+            return value.read()
+        return value
 
     def artifacts(self, task_name: str, artifact_name: str):
         """ Return the artifact names `artifact_name` that was produced by the task `task_name`.
@@ -96,45 +126,158 @@ class PipelineResult:
         return func(spec.result_task_name, spec.result_var_name)
 
 
+@lru_cache(maxsize=16)
+def compile_task_graph(tasks: tuple) -> Tuple[nx.DiGraph, List[str], Dict[str, Tuple[str, ...]]]:
+    """ Construct the task graph of a collection of tasks and compute its execution order, along
+        with the dependencies of each task, so that they need not be looked up in the graph.
+
+    :param tuple tasks: The tasks.
+    :return: The frozen task graph, the execution order and the dependencies of each task.
+    :rtype: Tuple[nx.DiGraph, List[str], Dict[str, Tuple[str, ...]]]
+    """
+    logger.debug('Building task graph')
+    task_graph = nx.DiGraph()
+    for task in tasks:
+        task_graph.add_node(task.task_def.name, task=task)
+        for dependency in (task.task_def.depends_on or []):
+            dependency = dependency.split('.')[0]
+            task_graph.add_edge(dependency, task.task_def.name)
+
+    logger.debug('Computing execution order')
+    try:
+        execution_order = list(nx.algorithms.dag.lexicographical_topological_sort(task_graph))
+    except nx.NetworkXUnfeasible as ex:
+        print(Fore.RED + 'Unable to build execution graph because pipeline contains cyclic dependencies.')
+        raise ex
+
+    dependencies = {task_name: tuple(task_graph.predecessors(task_name)) for task_name in execution_order}
+
+    return nx.freeze(task_graph), execution_order, dependencies
+
+
+class TaskExecution:
+    """ The outcome of executing, or reusing, a single task. """
+
+    __slots__ = ('output', 'inputs', 'reused', 'duration', 'size', 'traceback')
+
+    def __init__(self, output: TaskResult, inputs: PipelineResult, reused: bool, duration: float,
+                 size: int = None, traceback: str = None):
+
+        self.output = output
+        self.inputs = inputs
+        self.reused = reused
+        self.duration = duration
+        self.size = size
+        self.traceback = traceback
+
+
 class Pipeline:
 
-    def __init__(self, *tasks, name='default'):
+    def __init__(self, *tasks, name='default', map_workers: int = None, max_workers: int = 1,
+                 resources: Dict[str, float] = None, prioritize: bool = True, invoker=None,
+                 result_cache: LRUCache = None, verbose: bool = None, events: EventBus = None,
+                 tracer: Tracer = None, profile: Iterable[str] = None, profile_memory: bool = False,
+                 record_history: bool = True, capture_artifacts: str = None, share_results: bool = None,
+                 params: Dict[str, Any] = None, prefetch: int = None, prefetch_budget: int = None,
+                 executor: Executor = None, memory_store: MemoryStore = None):
+        """
+        :param tasks: The tasks that make up the pipeline.
+        :param str name: The name of the pipeline, which determines where its results are stored.
+        :param int map_workers: The number of threads used to run the elements of mapped tasks.
+        :param int max_workers: The number of tasks that may be executed at once.
+        :param Dict[str, float] resources: The capacity of each named resource pool.
+        :param bool prioritize: Whether concurrent runs start the tasks on the critical path first.
+        :param invoker: Optionally, an object whose `invoke(pipeline, task, args_dict)` executes
+                        tasks elsewhere, such as a `Coordinator` of remote workers.
+        :param LRUCache result_cache: Optionally, a cache of stored results that is kept across runs.
+        :param bool verbose: Whether to display the progress of runs; defaults to `settings.VERBOSE`.
+        :param EventBus events: Optionally, the bus on which to emit the events of runs.
+        :param Tracer tracer: Optionally, a tracer recording where the time of runs is spent.
+        :param profile: Optionally, the names of the tasks to profile when they are executed, or `all`.
+        :param bool profile_memory: Whether to trace the allocations of profiled tasks as well.
+        :param bool record_history: Whether to record each run in the history of the pipeline.
+        :param str capture_artifacts: Optionally, how to keep the files of the `FileArtifact`s produced by tasks
+                                      in the store, `copy` or `link`, so that missing files can be restored
+                                      when the results are reused; defaults to `settings.YENTA_CAPTURE_ARTIFACTS`.
+        :param bool share_results: Whether to share the results of pure tasks with the other pipelines in the
+                                   store through its `ResultIndex`; defaults to `settings.YENTA_SHARE_RESULTS`.
+        :param Dict[str, Any] params: The values of the pipeline parameters that tasks declare with `params`.
+        :param int prefetch: The number of upcoming tasks whose stored results and inputs are loaded ahead on a
+                             thread pool while the run goes on; defaults to `settings.YENTA_PREFETCH`, and 0
+                             disables prefetching.
+        :param int prefetch_budget: The total size of the files that are loaded ahead and held at once, in bytes;
+                                    defaults to `settings.YENTA_PREFETCH_BUDGET`.
+        :param Executor executor: Optionally, a pool of workers shared with other pipelines, such as the one of a
+                                  `PipelineGroup`, on which the tasks are executed instead of a pool of their own.
+        :param MemoryStore memory_store: Optionally, a store in memory that takes the place of the directory of the
+                                         pipeline, e.g. in tests; it cannot be combined with `capture_artifacts`
+                                         or `share_results`, which need the file system.
+        """
 
         self._tasks = tasks
         self.task_graph = nx.DiGraph()
         self.execution_order = []
         self.name = name
+        self.map_workers = map_workers
+        self.max_workers = max_workers
+        self.resources = resources or {}
+        self.prioritize = prioritize
+        self.invoker = invoker
+        self.executor = executor
+        self.memory_store = memory_store
+        self.result_cache = result_cache
+        self.verbose = settings.VERBOSE if verbose is None else verbose
+        self.events = EventBus() if events is None else events
+        self.tracer = tracer
+        self.profile = set(profile or ())
+        self.profile_memory = profile_memory
+        self.record_history = record_history
+        self.params = dict(params or {})
+        self.prefetch = settings.YENTA_PREFETCH if prefetch is None else prefetch
+        self.prefetch_budget = settings.YENTA_PREFETCH_BUDGET if prefetch_budget is None else prefetch_budget
+        if self.verbose:
+            self.events.subscribe(ProgressDisplay(per_task=True))
+        if self.max_workers < 1:
+            raise PipelineConfigError(f'A pipeline needs at least one worker, got {max_workers}')
+        if self.prefetch < 0:
+            raise PipelineConfigError(f'The number of tasks to prefetch cannot be negative, got {self.prefetch}')
         self.store_path = settings.YENTA_STORE_PATH / self.name
-
-        self.store_path.mkdir(exist_ok=True, parents=True)
+        capture_artifacts = settings.YENTA_CAPTURE_ARTIFACTS if capture_artifacts is None else capture_artifacts
+        if capture_artifacts and capture_artifacts not in ArtifactStore.MODES:
+            raise PipelineConfigError(f'Unknown artifact capture mode {capture_artifacts}, '
+                                      f'expected one of {", ".join(ArtifactStore.MODES)}')
+        self.artifact_store = ArtifactStore(self.store_path, capture_artifacts) if capture_artifacts else None
+        share_results = settings.YENTA_SHARE_RESULTS if share_results is None else share_results
+        self.result_index = ResultIndex(settings.YENTA_STORE_PATH) if share_results else None
+        if self.memory_store is not None and (self.artifact_store is not None or self.result_index is not None):
+            raise PipelineConfigError('Artifacts cannot be captured nor results shared in a store in memory')
+
+        if self.memory_store is None:
+            self.store_path.mkdir(exist_ok=True, parents=True)
 
         self.build_task_graph()
 
         self._tasks_executed = set()
         self._tasks_reused = set()
+        self._profilers: Dict[str, TaskProfiler] = {}
+        self._fingerprints: Dict[str, str] = {}
 
     def _clear_pipeline_cache(self):
         """ Delete the pipeline cache. Only used for testing purposes. """
-        shutil.rmtree(self.store_path)  # pragma: no cover
+        if self.memory_store is not None:
+            self.memory_store.clear()  # pragma: no cover
+        else:
+            shutil.rmtree(self.store_path)  # pragma: no cover
 
     def build_task_graph(self) -> None:
-        """ Construct the task graph for the pipeline
+        """ Construct the task graph for the pipeline. Graphs are cached by their tasks, so that
+            pipelines built repeatedly from the same tasks, e.g. by `yenta daemon`, share a single
+            frozen graph.
 
         :return: None
         """
-        logger.debug('Building task graph')
-        for task in self._tasks:
-            self.task_graph.add_node(task.task_def.name, task=task)
-            for dependency in (task.task_def.depends_on or []):
-                dependency = dependency.split('.')[0]
-                self.task_graph.add_edge(dependency, task.task_def.name)
-
-        logger.debug('Computing execution order')
-        try:
-            self.execution_order = list(nx.algorithms.dag.lexicographical_topological_sort(self.task_graph))
-        except nx.NetworkXUnfeasible as ex:
-            print(Fore.RED + 'Unable to build execution graph because pipeline contains cyclic dependencies.')
-            raise ex
+        self.task_graph, self.execution_order, self._dependencies = compile_task_graph(tuple(self._tasks))
+        self._tasks_by_name = {task.task_def.name: task for task in self._tasks}
 
     @staticmethod
     def _wrap_task_output(raw_output: Union[dict, TaskResult], task_name: str) -> TaskResult:
@@ -157,30 +300,145 @@ class Pipeline:
         return output
 
     @staticmethod
-    def build_args_dict(task, args: PipelineResult) -> Dict[str, Any]:
-        """ Build the args dictionary for executing a task.
+    def build_args_dict(task, args: PipelineResult, params: Dict[str, Any] = None) -> Dict[str, Any]:
+        """ Build the args dictionary for executing a task. Pipeline parameters that are not given
+            are left out, so that the task receives the default value of its parameter.
 
         :param task: The task itself, which has a `task_def` attached to it.
         :param PipelineResult args: The results of the pipeline up to this point
+        :param Dict[str, Any] params: Optionally, the values of the pipeline parameters.
         :return: A dictionary whose keys correspond to the arguments expected by
                  the task to be executed, and whose values are the values to be
-                 passed in.
+                 passed in. Values stored in files are passed as their `FileHandle`.
         :rtype: Dict[str, Any]
         """
 
-        logger.debug('Building args dictionary')
         task_def: TaskDef = task.task_def
         args_dict = {}
 
         for spec in task_def.param_specs:
-            if spec.param_type == ParameterType.PIPELINE_RESULTS:
+            if spec.selector:
+                args_dict[spec.param_name] = spec.selector(args)
+            elif spec.param_type == ParameterType.PIPELINE_RESULTS:
                 args_dict[spec.param_name] = args
             elif spec.param_type == ParameterType.EXPLICIT:
                 args_dict[spec.param_name] = args.values(spec.result_spec.result_task_name,
-                                                         spec.result_spec.result_var_name)
+                                                         spec.result_spec.result_var_name, handle=True)
+            elif spec.param_type == ParameterType.PARAMETER and params and spec.param_name in params:
+                args_dict[spec.param_name] = params[spec.param_name]
 
         return args_dict
 
+    @staticmethod
+    def project_inputs(task, args: PipelineResult, args_dict: Dict[str, Any]) -> PipelineResult:
+        """ Restrict the inputs of a task to the data it actually uses. These projected
+            inputs are what gets stored and compared when deciding whether to reuse the
+            previous result of the task. Explicit values are kept under the task that
+            produced them, and the output of selectors and the values of pipeline parameters
+            are kept under the name of the task itself; only parameters that receive the whole
+            pipeline state keep the full results of the dependencies.
+
+        :param task: The task itself, which has a `task_def` attached to it.
+        :param PipelineResult args: The results of the dependencies of the task.
+        :param dict args_dict: The arguments obtained from `build_args_dict`.
+        :return: The projected inputs.
+        :rtype: PipelineResult
+        """
+
+        task_def: TaskDef = task.task_def
+        inputs = PipelineResult()
+
+        for spec in task_def.param_specs:
+            if spec.selector or (spec.param_type == ParameterType.PARAMETER and spec.param_name in args_dict):
+                selected = inputs.task_results.setdefault(task_def.name, TaskResult(status=TaskStatus.SUCCESS))
+                selected.values[spec.param_name] = args_dict[spec.param_name]
+            elif spec.param_type == ParameterType.PIPELINE_RESULTS:
+                inputs.task_results.update(args.task_results)
+            elif spec.param_type == ParameterType.EXPLICIT:
+                dependency = spec.result_spec.result_task_name
+                upstream = args.task_results[dependency]
+                projected = inputs.task_results.get(dependency, None)
+                if projected is None or projected is upstream:
+                    projected = inputs.task_results[dependency] = TaskResult(
+                        values=dict(projected.values) if projected else {}, status=upstream.status)
+                projected.values[spec.result_spec.result_var_name] = args_dict[spec.param_name]
+
+        return inputs
+
+    @staticmethod
+    def build_incremental_args(task, args_dict: Dict[str, Any], previous_result: PipelineResult,
+                               from_scratch: bool = False) -> Dict[str, Any]:
+        """ Build the args dictionary for executing an incremental task. Collection-valued
+            arguments are replaced with their `Delta` relative to the inputs stored for the
+            previous run, and the previous output is passed as `previous`. If there is no
+            usable previous run, or if any non-collection argument changed or any collection
+            changed its type, the task is executed from scratch: `previous` is None and every
+            element counts as added. A pipeline parameter that is not given in either run is
+            left at its default and does not count as changed.
+
+        :param task: The task itself, which has a `task_def` attached to it.
+        :param dict args_dict: The full arguments obtained from `build_args_dict`.
+        :param PipelineResult previous_result: The previous pipeline result.
+        :param bool from_scratch: If True, ignore the previous run.
+        :return: The arguments to pass to the incremental task.
+        :rtype: Dict[str, Any]
+        """
+
+        task_name = task.task_def.name
+        previous_inputs = previous_result.task_inputs.get(task_name, None)
+        previous_output = previous_result.task_results.get(task_name, None)
+        old_values = None
+
+        def previous_value(result_task_name: str, value_name: str) -> Any:
+            try:
+                return previous_inputs.values(result_task_name, value_name)
+            except KeyError:
+                return MISSING
+
+        if previous_inputs and previous_output and previous_output.status == TaskStatus.SUCCESS \
+                and not from_scratch:
+            old_values = {}
+            for spec in task.task_def.param_specs:
+                if spec.selector or spec.param_type == ParameterType.PARAMETER:
+                    old_value = previous_value(task_name, spec.param_name)
+                else:
+                    old_value = previous_value(spec.result_spec.result_task_name, spec.result_spec.result_var_name)
+                if spec.param_name not in args_dict:
+                    if old_value is MISSING:
+                        # a parameter left at its default in both runs
+                        continue
+                    # a parameter that was given in the previous run and is left at its default now
+                    old_values = None
+                    break
+                if old_value is not MISSING:
+                    old_values[spec.param_name] = old_value
+
+        # a delta of a collection whose type changed counts every element as added, which cannot be
+        # applied on top of the previous output, so the task is then executed from scratch as well
+        if old_values is not None and any(name not in old_values or (type(old_values[name]) is not type(value)
+                                                                     if is_collection(value)
+                                                                     else old_values[name] != value)
+                                          for name, value in args_dict.items()):
+            old_values = None
+
+        incremental_args = {name: compute_delta((old_values or {}).get(name, None), value) if is_collection(value)
+                            else value for name, value in args_dict.items()}
+        incremental_args['previous'] = previous_output if old_values is not None else None
+
+        return incremental_args
+
+    def check_params(self, task):
+        """ Make sure that the pipeline defines every parameter of a task that has no default value.
+
+        :param task: The task itself, which has a `task_def` attached to it.
+        :return: None
+        """
+        parameters = inspect.signature(inspect.unwrap(task)).parameters
+        for param_name in task.task_def.params:
+            if param_name not in self.params and parameters[param_name].default is inspect.Parameter.empty:
+                raise InvalidParameterError(f'Task {task.task_def.name} requires the pipeline parameter '
+                                            f'{param_name}, which is not defined')
+
     def invoke_task(self, task, **kwargs) -> TaskResult:
         """ Call the function that represents the task with the supplied kwargs.
 
@@ -190,9 +448,105 @@ class Pipeline:
         :rtype: TaskResult
         """
 
-        output = task(**kwargs)
+        profiler = self._profilers.get(task.task_def.name, None)
+        if profiler is None:
+            output = task(**kwargs)
+        else:
+            output = profiler.call(task, **kwargs)
         return self._wrap_task_output(output, task.task_def.name)
 
+    def profiled(self, task_name: str) -> bool:
+        """ Determine whether a task is profiled when it is executed.
+
+        :param str task_name: The name of the task.
+        :return: True or False
+        :rtype: bool
+        """
+        return bool(self.profile) and ('all' in self.profile or task_name in self.profile)
+
+    def call_task(self, task, args_dict: Dict[str, Any]) -> TaskResult:
+        """ Call a task in this process, mapping it over its first argument if it is a mapped task.
+            If the task is profiled, its profile is saved beside its result in the store, or kept in
+            the memory store of the pipeline if it has one.
+
+        :param Callable task: The task function.
+        :param dict args_dict: The arguments of the task.
+        :return: The task result
+        :rtype: TaskResult
+        """
+
+        task_name = task.task_def.name
+        if self.profiled(task_name):
+            self._profilers[task_name] = TaskProfiler(memory=self.profile_memory)
+        try:
+            if task.task_def.map:
+                return self.invoke_mapped_task(task, **args_dict)
+            return self.invoke_task(task, **args_dict)
+        finally:
+            profiler = self._profilers.pop(task_name, None)
+            if profiler is not None and self.memory_store is not None:
+                self.memory_store.profiles[task_name] = profiler
+            elif profiler is not None:
+                profiler.save(self.store_path / task_name)
+
+    def invoke_mapped_task(self, task, **kwargs) -> TaskResult:
+        """ Call a mapped task once per element of its first argument and gather the
+            results. Each element is cached separately, so only the elements that are
+            new or whose shared arguments changed are actually computed.
+
+        :param Callable task: The task function.
+        :param dict kwargs: The arguments obtained from `build_args`; the first one is mapped over.
+        :return: A task result whose values are lists with one entry per element
+        :rtype: TaskResult
+        """
+
+        task_name = task.task_def.name
+        mapped_param = task.task_def.param_specs[0].param_name
+        shared_kwargs = {key: value for key, value in kwargs.items() if key != mapped_param}
+        elements = list(kwargs[mapped_param])
+
+        shared_key = sha1(pickle.dumps(shared_kwargs)).digest()
+        keys = [sha1(shared_key + pickle.dumps(element)).hexdigest() for element in elements]
+
+        outputs: List[TaskResult] = [None] * len(elements)
+        pending = []
+        for index, key in enumerate(keys):
+            cached = self.load_element(task_name, key) if task.task_def.pure else None
+            if cached and cached.status == TaskStatus.SUCCESS:
+                outputs[index] = cached
+            else:
+                pending.append(index)
+
+        logger.debug('Mapping %s over %d of %d elements', task_name, len(pending), len(elements))
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.map_workers) as executor:
+            futures = {executor.submit(self.invoke_task, task, **{mapped_param: elements[index]}, **shared_kwargs):
+                       index for index in pending}
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    outputs[index] = future.result()
+                    outputs[index].status = TaskStatus.SUCCESS
+                    self.cache_element(task_name, keys[index], outputs[index])
+                except Exception as ex:
+                    errors.append((index, ex))
+
+        if errors:
+            index, ex = min(errors, key=lambda error: error[0])
+            raise MappedTaskError(f'Mapped task {task_name} failed for {len(errors)} element(s); '
+                                  f'first failure was element {index}: {ex}')
+
+        self.prune_elements(task_name, set(keys))
+
+        values = {}
+        for output in outputs:
+            for value_name in output.values:
+                values.setdefault(value_name, [])
+        for value_name, gathered in values.items():
+            gathered.extend(output.values.get(value_name) for output in outputs)
+
+        return TaskResult(values=values)
+
     @staticmethod
     def merge_pipeline_results(res1: PipelineResult, res2: PipelineResult) -> PipelineResult:
         """ Combine two different pipeline results. If they share keys,
@@ -205,48 +559,334 @@ class Pipeline:
         :rtype: PipelineResult
         """
 
-        return PipelineResult(task_results={**res1.task_results, **res2.task_results},
-                              task_inputs={**res1.task_inputs, **res2.task_inputs})
+        def merge(first, second):
+            if isinstance(first, StoredResults):
+                return first.merged(second)
+            return {**first, **second}
+
+        return PipelineResult(task_results=merge(res1.task_results, res2.task_results),
+                              task_inputs=merge(res1.task_inputs, res2.task_inputs))
 
-    def cache_result(self, task_name: str, result: PipelineResult):
-        """ Write the pipeline results to a file.
+    def cache_result(self, task_name: str, result: PipelineResult) -> int:
+        """ Write the pipeline results to a file. Each file is replaced atomically, so a reader
+            never sees a partially written file, but the result and the inputs are not replaced
+            together: only a reader that holds the claim of the task (see `task_lock`) is sure to
+            see the result and the inputs of the same run. The files of any `FileHandle` values
+            are copied into the `values` directory of the task rather than pickled.
 
         :param str task_name: The name of the task to cache.
         :param PipelineResult result: The results.
-        :return: None
+        :return: The size of the stored result, in bytes.
+        :rtype: int
         """
+        if self.memory_store is not None:
+            data = pickle.dumps(result.task_results[task_name])
+            self.memory_store.write(task_name, 'result.pk', data)
+            self.memory_store.write(task_name, 'inputs.pk', pickle.dumps(result.task_inputs[task_name]))
+            return len(data)
+
         task_path = self.store_path / task_name
         task_path.mkdir(exist_ok=True, parents=True)
 
-        task_cache = task_path / 'result.pk'
-        with open(task_cache, 'wb') as f:
-            pickle.dump(result.task_results[task_name], f)
+        store_file_handles(result.task_results[task_name].values, task_path / 'values')
+        data = pickle.dumps(result.task_results[task_name])
+        atomic_write(task_path / 'result.pk', data)
+        atomic_write(task_path / 'inputs.pk', pickle.dumps(result.task_inputs[task_name]))
+
+        return len(data)
+
+    def cache_element(self, task_name: str, key: str, result: TaskResult):
+        """ Write the result of a single element of a mapped task to a file.
+
+        :param str task_name: The name of the mapped task.
+        :param str key: The key identifying the element and the shared arguments.
+        :param TaskResult result: The result of calling the task on that element.
+        :return: None
+        """
+        if self.memory_store is not None:
+            self.memory_store.write(task_name, f'elements/{key}.pk', pickle.dumps(result))
+            return
+
+        element_path = self.store_path / task_name / 'elements'
+        element_path.mkdir(exist_ok=True, parents=True)
 
-        task_cache = task_path / 'inputs.pk'
-        with open(task_cache, 'wb') as f:
-            pickle.dump(result.task_inputs[task_name], f)
+        store_file_handles(result.values, element_path / key)
+        atomic_write(element_path / f'{key}.pk', pickle.dumps(result))
+
+    def load_element(self, task_name: str, key: str) -> Union[TaskResult, None]:
+        """ Load the cached result of a single element of a mapped task.
+
+        :param str task_name: The name of the mapped task.
+        :param str key: The key identifying the element and the shared arguments.
+        :return: The cached result, or None if the element has not been computed.
+        :rtype: TaskResult
+        """
+        if self.memory_store is not None:
+            name = f'elements/{key}.pk'
+            return self.memory_store.load(task_name, name) if self.memory_store.exists(task_name, name) else None
+
+        element_cache = self.store_path / task_name / 'elements' / f'{key}.pk'
+        if not element_cache.exists():
+            return None
+        with open(element_cache, 'rb') as f:
+            return pickle.load(f)
+
+    def prune_elements(self, task_name: str, keys: set):
+        """ Remove cached elements of a mapped task that are no longer part of its input.
+
+        :param str task_name: The name of the mapped task.
+        :param set keys: The keys of the elements that should be kept.
+        :return: None
+        """
+        if self.memory_store is not None:
+            for name in self.memory_store.names(task_name):
+                if name.startswith('elements/') and name[len('elements/'):-len('.pk')] not in keys:
+                    self.memory_store.remove(task_name, name)
+            return
+
+        element_path = self.store_path / task_name / 'elements'
+        if element_path.exists():
+            for element_cache in element_path.iterdir():
+                if element_cache.stem not in keys and element_cache.is_dir():
+                    shutil.rmtree(element_cache)
+                elif element_cache.stem not in keys:
+                    element_cache.unlink()
+
+    def load_durations(self) -> Dict[str, float]:
+        """ Load the durations, in seconds, of the most recent execution of each task.
+
+        :return: A dictionary whose keys are task names and whose values are durations.
+        :rtype: Dict[str, float]
+        """
+        if self.memory_store is not None:
+            return dict(self.memory_store.durations)
+
+        durations_file = self.store_path / 'durations.json'
+        if not durations_file.exists():
+            return {}
+        with open(durations_file, 'r') as f:
+            return json.load(f)
+
+    def save_durations(self, durations: Dict[str, float]):
+        """ Record the durations of the tasks executed in the latest run, keeping the durations
+            recorded earlier for the tasks that were not executed.
+
+        :param Dict[str, float] durations: The durations of the executed tasks.
+        :return: None
+        """
+        if durations and self.memory_store is not None:
+            with self.pipeline_lock():
+                self.memory_store.durations.update(durations)
+        elif durations:
+            with self.pipeline_lock():
+                durations = {**self.load_durations(), **durations}
+                atomic_write(self.store_path / 'durations.json',
+                             json.dumps(durations, indent=2, sort_keys=True).encode())
+
+    @property
+    def history(self) -> RunHistory:
+        """ The history of the runs of the pipeline. """
+
+        if self.memory_store is not None:
+            return self.memory_store.history
+        return RunHistory(self.store_path)
+
+    def save_history(self, run: RunRecord):
+        """ Append a run to the history of the pipeline. A history that cannot be written does not
+            fail the run.
+
+        :param RunRecord run: The run.
+        :return: None
+        """
+        try:
+            with self.pipeline_lock():
+                self.history.append(run)
+        except OSError as ex:
+            logger.warning('Unable to record the run in the history of %s: %s', self.name, ex)
+
+    def pipeline_lock(self) -> LeaseLock:
+        """ Return the lock that guards the files shared by all the tasks of the pipeline.
+
+        :return: The lock, which is not acquired yet.
+        :rtype: LeaseLock
+        """
+        if self.memory_store is not None:
+            return self.memory_store.lock('.lock')
+        return LeaseLock(self.store_path / '.lock', lease=settings.YENTA_LOCK_LEASE)
+
+    def task_lock(self, task_name: str) -> LeaseLock:
+        """ Return the claim of a task, which is held while the task is executed.
+
+        :param str task_name: The name of the task.
+        :return: The lock, which is not acquired yet.
+        :rtype: LeaseLock
+        """
+        if self.memory_store is not None:
+            return self.memory_store.lock(task_name)
+        return LeaseLock(self.store_path / task_name / '.lock', lease=settings.YENTA_LOCK_LEASE)
+
+    def load_task(self, task_name: str) -> PipelineResult:
+        """ Load the stored result and inputs of a single task.
+
+        :param str task_name: The name of the task.
+        :return: A pipeline result that contains only the task, or nothing if it is not stored.
+        :rtype: PipelineResult
+        """
+        task_path = self.store_path / task_name
+        stored = PipelineResult()
+        if self.memory_store is not None and self.memory_store.exists(task_name, 'result.pk'):
+            stored.task_inputs[task_name] = self.memory_store.load(task_name, 'inputs.pk')
+            stored.task_results[task_name] = self.memory_store.load(task_name, 'result.pk')
+        elif self.memory_store is None and (task_path / 'result.pk').exists():
+            stored.task_inputs[task_name] = load_pickle(task_path / 'inputs.pk', self.result_cache)
+            stored.task_results[task_name] = load_pickle(task_path / 'result.pk', self.result_cache)
+
+        return stored
 
     @staticmethod
-    def load_pipeline(store_path: Path) -> PipelineResult:
-        """ Load a pipeline from file.
+    def load_pipeline(store_path: Path, cache: LRUCache = None, memory_store: MemoryStore = None) -> PipelineResult:
+        """ Load a pipeline from file. The results and inputs of the tasks are not read until
+            they are accessed, and are read again on every access.
 
+        :param Path store_path: The directory in which the pipeline is stored.
+        :param LRUCache cache: Optionally, a cache of previously read results and inputs.
+        :param MemoryStore memory_store: Optionally, the store in memory of the pipeline, which is read instead.
         :return: The pipeline.
         :rtype: PipelineResult
         """
-        logger.debug(f'Loading pipeline from {store_path}')
-        pipeline = PipelineResult()
-        if store_path.exists():
-            for task_path in store_path.iterdir():
-                if task_path.is_dir():
-                    task_name = task_path.stem
-                    with open(task_path / 'inputs.pk', 'rb') as f:
-                        inputs = pickle.load(f)
-                    with open(task_path / 'result.pk', 'rb') as f:
-                        result = pickle.load(f)
-                    pipeline.task_inputs[task_name] = inputs
-                    pipeline.task_results[task_name] = result
-
-        return pipeline
+        logger.debug('Loading pipeline from %s', store_path)
+        if memory_store is not None:
+            task_names = memory_store.stored_tasks()
+        else:
+            task_names = StoredResults.stored_tasks(store_path, settings.YENTA_IO_WORKERS)
+        return PipelineResult(task_results=StoredResults.from_store(store_path, 'result.pk', cache, task_names,
+                                                                    memory_store),
+                              task_inputs=StoredResults.from_store(store_path, 'inputs.pk', cache, task_names,
+                                                                   memory_store))
+
+    def prefetch_paths(self, task_name: str, previous_result: PipelineResult, scheduled: Set[str],
+                       forced: Set[str]) -> List[str]:
+        """ List the stored files that a run reads before it executes a task: the previous results of the
+            dependencies of the task that are not part of the run and, if its previous result may be
+            reused, the previous inputs and result of the task itself.
+
+        :param str task_name: The name of the task.
+        :param PipelineResult previous_result: The previous pipeline result, as returned by `load_pipeline`.
+        :param Set[str] scheduled: The tasks that are part of the run.
+        :param Set[str] forced: The tasks that are forced to be executed.
+        :return: The paths of the files.
+        :rtype: List[str]
+        """
+        results, inputs = previous_result.task_results, previous_result.task_inputs
+        paths = [results.entry_path(dependency) for dependency in self._dependencies[task_name]
+                 if dependency not in scheduled and dependency in results]
+        if self._tasks_by_name[task_name].task_def.pure and task_name not in forced and task_name in inputs:
+            paths.extend([inputs.entry_path(task_name), results.entry_path(task_name)])
+
+        return paths
+
+    @staticmethod
+    def reusable_result(task_name: str, previous_result: PipelineResult, args: PipelineResult) -> Optional[TaskResult]:
+        """ Return the previous result of a task if it succeeded and was computed from the same inputs.
+
+        :param str task_name: The name of the task.
+        :param PipelineResult previous_result: The previous pipeline result.
+        :param PipelineResult args: The projected inputs with which this task is being called.
+        :return: The previous result of the task, or None if the task should be executed again.
+        :rtype: TaskResult
+        """
+        previous_inputs = previous_result.task_inputs.get(task_name, None)
+        if previous_inputs and previous_inputs == args:
+            previous_output = previous_result.task_results.get(task_name)
+            if previous_output.status == TaskStatus.SUCCESS:
+                return previous_output
+
+        return None
+
+    def validate_artifacts(self, task_name: str, output: TaskResult, inputs: PipelineResult = None) -> bool:
+        """ Check that the files of the artifacts of a result that is about to be reused still exist
+            and are unchanged, restoring missing files from the store if artifacts are captured.
+            Files are compared by their modification time, size and inode, and only hashed when
+            these differ. A result whose artifacts are missing or were changed cannot be reused, so
+            the task is executed again, and so are the tasks that depend on what it produces. If
+            files had to be hashed, or were restored, and the inputs of the result are given, the
+            result is stored again with their new signatures (see `store_signatures`).
+
+        :param str task_name: The name of the task.
+        :param TaskResult output: The previous result of the task.
+        :param PipelineResult inputs: Optionally, the inputs with which the result is stored.
+        :return: Whether the result can be reused.
+        :rtype: bool
+        """
+        artifacts = [artifact for value in output.values.values() for artifact in file_artifacts(value)]
+        if not artifacts:
+            return True
+
+        stale = []
+        signatures = [getattr(artifact, '_stat', None) for artifact in artifacts]
+        with span('validate_artifacts'):
+            for artifact in artifacts:
+                if self.artifact_store is not None and not os.path.exists(artifact.location):
+                    try:
+                        self.artifact_store.restore(artifact)
+                    except OSError as ex:
+                        logger.warning('Unable to restore %s: %s', artifact.location, ex)
+                if not artifact.is_fresh():
+                    stale.append(artifact)
+        if stale:
+            logger.info('Executing %s again because the files of its artifacts are missing or changed: %s',
+                        task_name, ', '.join(str(artifact.location) for artifact in stale))
+        elif inputs is not None and any(getattr(artifact, '_stat', None) != signature
+                                        for artifact, signature in zip(artifacts, signatures)):
+            self.store_signatures(task_name, output, inputs)
+        return not stale
+
+    def store_signatures(self, task_name: str, output: TaskResult, inputs: PipelineResult):
+        """ Store a reused result again once the files of its artifacts were found unchanged under
+            new signatures, so that later runs compare the new modification times rather than hash
+            the files every time. This is skipped if another run holds the claim of the task, since
+            that run is about to store a result of its own.
+
+        :param str task_name: The name of the task.
+        :param TaskResult output: The reused result.
+        :param PipelineResult inputs: The inputs of the result.
+        :return: None
+        """
+        claim = self.task_lock(task_name)
+        if not claim.acquire(blocking=False):
+            return
+        try:
+            self.cache_result(task_name, PipelineResult({task_name: output}, {task_name: inputs}))
+        finally:
+            claim.release()
+
+    def index_key(self, task, inputs: PipelineResult) -> str:
+        """ Compute the key under which the result of a task is shared with other pipelines.
+
+        :param task: The task itself, which has a `task_def` attached to it.
+        :param PipelineResult inputs: The projected inputs of the task.
+        :return: The key.
+        :rtype: str
+        """
+        task_name = task.task_def.name
+        fingerprint = self._fingerprints.get(task_name, None)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[task_name] = task_fingerprint(task)
+        return ResultIndex.key(task_name, fingerprint, inputs)
+
+    def share_result(self, task_name: str, key: str, output: TaskResult):
+        """ Publish the result of a task to the other pipelines in the store. A result that cannot be
+            published is logged and does not fail the task.
+
+        :param str task_name: The name of the task.
+        :param str key: The key from `index_key`.
+        :param TaskResult output: The stored result of the task.
+        :return: None
+        """
+        try:
+            self.result_index.put(task_name, key, output)
+        except OSError as ex:
+            logger.warning('Unable to share the result of %s with other pipelines: %s', key, ex)
 
     @staticmethod
     def reuse_inputs(task_name: str, previous_result: PipelineResult, args: PipelineResult) -> bool:
@@ -255,75 +895,326 @@ class Pipeline:
 
         :param str task_name: The name of the task.
         :param PipelineResult previous_result: The previous pipeline result.
-        :param PipelineResult args: The arguments with which this task is being called.
+        :param PipelineResult args: The projected inputs with which this task is being called.
         :return: True or False
         :rtype: bool
         """
-        previous_inputs = previous_result.task_inputs.get(task_name, None)
-        if previous_inputs and previous_result.task_results.get(task_name).status == TaskStatus.SUCCESS:
-            return previous_inputs == args
+        return Pipeline.reusable_result(task_name, previous_result, args) is not None
+
+    def execute_task(self, task, args: PipelineResult, previous_result: PipelineResult,
+                     force_rerun: bool = False) -> TaskExecution:
+        """ Execute a single task whose dependencies have succeeded, or reuse its previous
+            result if its inputs have not changed, and store the result. This may be called
+            from a worker thread, so it must not modify the state of the pipeline.
 
-        return False
+            A task is executed while holding its claim, a lock in the store, so that runs of
+            the same pipeline in other processes do not execute it at the same time. A run
+            that finds the task claimed waits for the claim to be released and reuses the
+            result of the other run if it was computed from the same inputs.
 
-    def run_pipeline(self, up_to: str = None, force_rerun: List[str] = None) -> PipelineResult:
-        """ Execute the tasks in the pipeline.
+        :param task: The task itself, which has a `task_def` attached to it.
+        :param PipelineResult args: The results of the dependencies of the task.
+        :param PipelineResult previous_result: The previous pipeline result.
+        :param bool force_rerun: If True, execute the task even if its inputs have not changed.
+        :return: The result of the task, its projected inputs, whether the previous result was reused,
+                 the time it took to execute the task in seconds and the size of its stored result.
+        :rtype: TaskExecution
+        """
+
+        if self.tracer is None:
+            return self._execute_task(task, args, previous_result, force_rerun)
+        with self.tracer.activate(), self.tracer.span(task.task_def.name, 'task'):
+            return self._execute_task(task, args, previous_result, force_rerun)
+
+    def _execute_task(self, task, args: PipelineResult, previous_result: PipelineResult,
+                      force_rerun: bool) -> TaskExecution:
+
+        task_def = task.task_def
+        task_name = task_def.name
+        # most tasks of a large run are reused, which takes only a few microseconds when nothing is traced
+        trace = span if self.tracer is not None else no_span
+        inputs = args
+        claim = None
+        details = None
+        key = None
+        start = time.perf_counter()
+        try:
+            try:
+                with trace('build_args'):
+                    args_dict = self.build_args_dict(task, args, self.params)
+                    inputs = self.project_inputs(task, args, args_dict)
+                reusable = task_def.pure and not force_rerun
+                with trace('load'):
+                    previous_output = self.reusable_result(task_name, previous_result, inputs) if reusable else None
+                if previous_output is not None and self.validate_artifacts(task_name, previous_output, inputs):
+                    logger.debug('Reusing previous results of %s', task_name)
+                    return TaskExecution(previous_output, inputs, True, time.perf_counter() - start)
+
+                claim = self.task_lock(task_name)
+                if not claim.acquire(blocking=False):
+                    logger.info('Waiting for another run to finish executing %s', task_name)
+                    with trace('wait_for_claim'):
+                        claim.acquire()
+                    stored_output = self.reusable_result(task_name, self.load_task(task_name), inputs) \
+                        if reusable else None
+                    if stored_output is not None and self.validate_artifacts(task_name, stored_output):
+                        logger.debug('Reusing the result of %s computed by another run', task_name)
+                        return TaskExecution(stored_output, inputs, True, time.perf_counter() - start)
+
+                if reusable and self.result_index is not None:
+                    key = self.index_key(task, inputs)
+                    with trace('index'):
+                        shared_output = self.result_index.get(task_name, key)
+                    if shared_output is not None and self.validate_artifacts(task_name, shared_output):
+                        logger.debug('Reusing the result of %s computed by another pipeline', task_name)
+                        size = self.cache_result(task_name, PipelineResult({task_name: shared_output},
+                                                                           {task_name: inputs}))
+                        return TaskExecution(shared_output, inputs, True, time.perf_counter() - start, size)
+
+                if self.events:
+                    self.events.emit(Event(EventType.STARTED, self.name, task_name))
+                if task_def.incremental:
+                    args_dict = self.build_incremental_args(task, args_dict, previous_result,
+                                                            from_scratch=force_rerun)
+                logger.debug('Calling function to execute %s', task_name)
+                with trace('invoke'):
+                    if self.invoker:
+                        output = self.invoker.invoke(self, task, args_dict)
+                    else:
+                        output = self.call_task(task, args_dict)
+                output.status = TaskStatus.SUCCESS
+                if self.artifact_store is not None:
+                    with trace('capture_artifacts'):
+                        self.artifact_store.capture_values(output.values)
+            except Exception as ex:
+                logger.exception('Caught exception executing %s', task_name)
+                details = traceback.format_exc()
+                output = TaskResult(status=TaskStatus.FAILURE, error=str(ex))
+
+            duration = time.perf_counter() - start
+            with trace('cache_result'):
+                size = self.cache_result(task_name, PipelineResult({task_name: output}, {task_name: inputs}))
+            if key is not None and output.status == TaskStatus.SUCCESS:
+                with trace('index'):
+                    self.share_result(task_name, key, output)
+        finally:
+            if claim is not None:
+                claim.release()
+
+        return TaskExecution(output, inputs, False, duration, size, details)
+
+    def run_pipeline(self, up_to: str = None, force_rerun: List[str] = None,
+                     only: List[str] = None) -> PipelineResult:
+        """ Execute the tasks in the pipeline. Tasks become ready once all of their dependencies
+            have completed, and up to `max_workers` ready tasks are executed at once, subject to
+            the resource capacities of the pipeline. When several tasks run at once and `prioritize`
+            is set, ready tasks on the longest remaining path, based on the durations recorded in
+            previous runs, are started first. A task whose dependencies did not all succeed
+            is skipped.
+
+            Unless `record_history` is unset, the outcome, duration and result size of every task
+            are appended to the history of the pipeline once the run is over.
+
+            The run emits an event on `events` whenever a task is queued, started, reused,
+            finished, failed or skipped, as well as when it starts and finishes.
+
+            The result of a task is only held in memory until all of its successors in the run
+            have completed; from then on it is read from the store when it is needed, so that
+            the memory used by a run is bounded by the results that are still to be consumed.
+
+            If `prefetch` is set, the stored files that the next `prefetch` tasks in the execution order
+            read before they are executed are unpickled on a thread pool while the current tasks run,
+            keeping at most `prefetch_budget` bytes of them in memory.
 
         :param str up_to: If supplied, execute the pipeline only up to this task.
         :param List[str] force_rerun: Optionally force the listed tasks to be executed.
-        :return: The final pipeline state.
+        :param List[str] only: If supplied, execute only the listed tasks; the other tasks they
+                               depend on contribute their stored results.
+        :return: The final pipeline state, backed by the store.
         :rtype: PipelineResult
         """
 
-        previous_result: PipelineResult = self.load_pipeline(self.store_path)
-        result = PipelineResult()
+        if self.tracer is None:
+            return self._run_pipeline(up_to, force_rerun, only)
+        with self.tracer.activate(), self.tracer.span(f'run {self.name}', 'pipeline'):
+            return self._run_pipeline(up_to, force_rerun, only)
+
+    def _run_pipeline(self, up_to: Optional[str], force_rerun: Optional[List[str]],
+                      only: Optional[List[str]]) -> PipelineResult:
+
+        started = time.time()
+        with span('load_pipeline'):
+            previous_result: PipelineResult = self.load_pipeline(self.store_path, self.result_cache,
+                                                                 self.memory_store)
+        result = PipelineResult(task_results=StoredResults(self.store_path, 'result.pk', self.result_cache,
+                                                           self.memory_store),
+                                task_inputs=StoredResults(self.store_path, 'inputs.pk', self.result_cache,
+                                                          self.memory_store))
         self._tasks_reused.clear()
         self._tasks_executed.clear()
 
-        for task_name in list(split_after(self.execution_order, lambda x: x == up_to))[0]:
-            logger.debug(f'Starting executions of {task_name}')
-            task_node = self.task_graph.nodes.get(task_name, None)
-            if not task_node:
+        task_names = list(split_after(self.execution_order, lambda x: x == up_to))[0]
+        for task_name in task_names:
+            if 'task' not in self.task_graph.nodes[task_name]:
                 raise PipelineConfigError(f'Dependency on nonexistent task: {task_name}')
-            task = task_node['task']
-            args = PipelineResult()
-            dependencies_succeeded = True
-            for dependency in (task.task_def.depends_on or []):
-                dependency = dependency.split('.')[0]
-                args.task_results[dependency] = result.task_results[dependency]
-                if result.task_results[dependency].status == TaskStatus.FAILURE:
-                    dependencies_succeeded = False
+            if self._tasks_by_name[task_name].task_def.params:
+                self.check_params(self._tasks_by_name[task_name])
+        if only is not None:
+            task_names = [task_name for task_name in task_names if task_name in only]
+        scheduled = set(task_names)
+        forced = set(force_rerun or [])
+        dependencies = self._dependencies
+        consumers = {task_name: sum(1 for successor in self.task_graph.successors(task_name) if successor in scheduled)
+                     for task_name in task_names}
+
+        def finish(task_name: str):
+            # a result is released once its task and all the consumers of the task in this run have completed
+            scheduler.complete(task_name)
+            result.task_inputs.release(task_name)
+            for dependency in dependencies[task_name]:
+                if dependency in scheduled:
+                    consumers[dependency] -= 1
+                    if consumers[dependency] == 0:
+                        result.task_results.release(dependency)
+            if consumers[task_name] == 0:
+                result.task_results.release(task_name)
+            if prefetcher is not None:
+                prefetcher.discard(prefetched.pop(task_name, ()))
+
+        priorities = None
+        if self.max_workers > 1 and self.prioritize:
+            priorities = upward_ranks(self.task_graph, task_names, self.load_durations())
+        scheduler = Scheduler(self.task_graph, task_names, capacities=self.resources,
+                              requirements={task_name: self._tasks_by_name[task_name].task_def.resources
+                                            for task_name in task_names},
+                              priorities=priorities)
+        durations = {}
+        records = {}
+        events = self.events
+
+        def complete(task_name: str, execution: TaskExecution):
+            if execution.reused:
+                self._tasks_reused.add(task_name)
+                records[task_name] = TaskRecord('reused', execution.duration)
+            else:
+                durations[task_name] = execution.duration
+                if execution.output.status == TaskStatus.SUCCESS:
+                    self._tasks_executed.add(task_name)
+                    records[task_name] = TaskRecord('executed', execution.duration, execution.size)
+                else:
+                    records[task_name] = TaskRecord('failed', execution.duration, execution.size)
+            if events:
+                events.emit(self.outcome_event(task_name, execution))
+
+            result.task_results[task_name] = execution.output
+            result.task_inputs[task_name] = execution.inputs
+            finish(task_name)
+
+        prefetcher = None
+        if self.prefetch and self.memory_store is None and previous_result.task_results:
+            prefetcher = Prefetcher(self.prefetch_budget)
+            previous_result.task_results.prefetcher = previous_result.task_inputs.prefetcher = prefetcher
+        upcoming = deque(task_names)
+        prefetched: Dict[str, List[str]] = {}
+        started_tasks = set()
+
+        def prefetch_upcoming():
+            # load the files of the next tasks in the execution order that have not been started yet
+            while upcoming and upcoming[0] in started_tasks:
+                upcoming.popleft()
+            window = 0
+            for task_name in upcoming:
+                if window == self.prefetch:
                     break
+                if task_name in started_tasks:
+                    continue
+                window += 1
+                if task_name not in prefetched:
+                    prefetched[task_name] = self.prefetch_paths(task_name, previous_result, scheduled, forced)
+                    prefetcher.prefetch(prefetched[task_name])
+
+        if events:
+            events.emit(Event(EventType.RUN_STARTED, self.name, total=len(task_names)))
+        executor = self.executor
+        if executor is None and self.max_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        running = {}
+        try:
+            while scheduler.has_pending():
+                dispatched = scheduler.next_tasks(self.max_workers - len(running))
+                if prefetcher is not None:
+                    started_tasks.update(dispatched)
+                    with span('prefetch'):
+                        prefetch_upcoming()
+                for task_name in dispatched:
+                    logger.debug('Starting execution of %s', task_name)
+                    args = PipelineResult()
+                    dependencies_succeeded = True
+                    for dependency in dependencies[task_name]:
+                        if dependency in scheduled:
+                            dependency_result = result.task_results.get(dependency, None)
+                        else:
+                            dependency_result = previous_result.task_results.get(dependency, None)
+                        if not dependency_result or dependency_result.status == TaskStatus.FAILURE:
+                            dependencies_succeeded = False
+                            break
+                        args.task_results[dependency] = dependency_result
+                    if dependencies_succeeded and events:
+                        events.emit(Event(EventType.QUEUED, self.name, task_name))
+
+                    if dependencies_succeeded and executor is None:
+                        # run the task in place rather than through an executor, which costs more than
+                        # checking whether a small task can be reused
+                        complete(task_name, self.execute_task(self._tasks_by_name[task_name], args,
+                                                              previous_result, task_name in forced))
+                    elif dependencies_succeeded:
+                        future = executor.submit(self.execute_task, self._tasks_by_name[task_name], args,
+                                                 previous_result, task_name in forced)
+                        running[future] = task_name
+                    else:
+                        logger.debug('Skipping %s because its dependencies did not succeed', task_name)
+                        records[task_name] = TaskRecord('skipped')
+                        if events:
+                            events.emit(Event(EventType.SKIPPED, self.name, task_name))
+                        finish(task_name)
+
+                if not running:
+                    if not dispatched:
+                        raise PipelineConfigError('Unable to schedule the remaining tasks of the pipeline')
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    complete(running.pop(future), future.result())
+        finally:
+            if executor is not None and executor is not self.executor:
+                executor.shutdown()
+            if prefetcher is not None:
+                previous_result.task_results.prefetcher = previous_result.task_inputs.prefetcher = None
+                prefetcher.close()
+            if events:
+                events.emit(Event(EventType.RUN_FINISHED, self.name, total=len(task_names)))
+
+        with span('save_durations'):
+            self.save_durations(durations)
+        if self.record_history:
+            self.save_history(RunRecord(RunRecord.new_id(started), self.name, started, time.time() - started,
+                                        max_rss(), records))
+
+        return self.merge_pipeline_results(previous_result, result)
+
+    def outcome_event(self, task_name: str, execution: TaskExecution) -> Event:
+        """ Describe whether a task was reused, executed successfully, or failed as an event.
 
-            if dependencies_succeeded:
-                if task.task_def.pure and task_name not in (force_rerun or []) and \
-                        self.reuse_inputs(task_name, previous_result, args):
-                    logger.debug(f'Reusing previous results of {task_name}')
-                    self._tasks_reused.add(task_name)
-                    output = previous_result.task_results[task_name]
-                    marker = Fore.YELLOW + u'\u2014' + Fore.WHITE
-                else:
-                    args_dict = self.build_args_dict(task, args)
-                    try:
-                        logger.debug(f'Calling function to execute {task_name}')
-                        output = self.invoke_task(task, **args_dict)
-                        output.status = TaskStatus.SUCCESS
-                        marker = Fore.GREEN + u'\u2714' + Fore.WHITE
-                        self._tasks_executed.add(task_name)
-                    except Exception as ex:
-                        import traceback
-                        print(Fore.RED)
-                        traceback.print_exc()
-                        print(Fore.WHITE)
-                        logger.error(f'Caught exception executing {task_name}: {ex}')
-                        output = TaskResult(status=TaskStatus.FAILURE, error=str(ex))
-                        marker = Fore.RED + u'\u2718' + Fore.WHITE
-
-                print(Fore.WHITE + Style.BRIGHT + f'[{marker}] {task_name}')
-
-                result.task_results[task_name] = output
-                result.task_inputs[task_name] = args
-
-                result = self.merge_pipeline_results(previous_result, result)
-                self.cache_result(task_name, result)
-
-        return result
+        :param str task_name: The name of the task.
+        :param TaskExecution execution: The outcome of the task.
+        :return: The event.
+        :rtype: Event
+        """
+        if execution.reused:
+            return Event(EventType.REUSED, self.name, task_name, duration=execution.duration)
+        elif execution.output.status == TaskStatus.SUCCESS:
+            return Event(EventType.FINISHED, self.name, task_name, duration=execution.duration, size=execution.size)
+        else:
+            return Event(EventType.FAILED, self.name, task_name, duration=execution.duration, size=execution.size,
+                         error=execution.output.error, traceback=execution.traceback)
@@ -0,0 +1,147 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from yenta.utils.files import atomic_write
+
+__all__ = ['TaskProfiler', 'ProfileReport', 'NoProfileError']
+
+# only one profiler can be active in a process at a time, and tracemalloc is process-wide, so
+# profiled calls are made one at a time even when tasks are executed concurrently
+_profile_lock = threading.Lock()
+
+
+class NoProfileError(Exception):
+    pass
+
+
+class TaskProfiler:
+    """ Profiles the calls made to execute a single task with cProfile and, optionally, records
+        the allocations they make with tracemalloc. The calls of a mapped task are profiled
+        together, and the allocations of the call with the highest peak are kept.
+    """
+
+    STATS_FILE = 'profile.pstats'
+    SNAPSHOT_FILE = 'memory.snapshot'
+    SUMMARY_FILE = 'profile.json'
+
+    def __init__(self, memory: bool = False):
+        """
+        :param bool memory: Whether to trace the allocations of the task as well as its CPU time.
+        """
+
+        self.memory = memory
+        self.profiler = cProfile.Profile()
+        self.calls = 0
+        self.duration = 0.0
+        self.peak: Optional[int] = None
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def call(self, func: Callable, **kwargs) -> Any:
+        """ Call a function while profiling it.
+
+        :param Callable func: The function.
+        :param kwargs: The arguments of the function.
+        :return: The return value of the function.
+        """
+        with _profile_lock:
+            tracing = self.memory and not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            if self.memory and hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                return self.profiler.runcall(func, **kwargs)
+            finally:
+                self.duration += time.perf_counter() - start
+                self.calls += 1
+                if self.memory:
+                    self._record_allocations()
+                if tracing:
+                    tracemalloc.stop()
+
+    def _record_allocations(self):
+
+        _, peak = tracemalloc.get_traced_memory()
+        if self.peak is None or peak > self.peak:
+            self.peak = peak
+            self.snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+            ])
+
+    def save(self, directory: Path):
+        """ Save the profile to a directory, normally that of the task in the store, replacing
+            any previous profile of the task.
+
+        :param Path directory: The directory.
+        :return: None
+        """
+        directory.mkdir(exist_ok=True, parents=True)
+        self.profiler.dump_stats(directory / self.STATS_FILE)
+        snapshot_path = directory / self.SNAPSHOT_FILE
+        if self.snapshot is not None:
+            self.snapshot.dump(str(snapshot_path))
+        elif snapshot_path.exists():
+            snapshot_path.unlink()
+        summary = {'calls': self.calls, 'duration': self.duration, 'peak_memory': self.peak,
+                   'timestamp': time.time()}
+        atomic_write(directory / self.SUMMARY_FILE, json.dumps(summary).encode())
+
+
+class ProfileReport:
+    """ Summarizes the profile of a task saved by `TaskProfiler`. """
+
+    def __init__(self, directory: Path):
+        """
+        :param Path directory: The directory in which the profile was saved.
+        """
+
+        self.directory = Path(directory)
+        summary_path = self.directory / TaskProfiler.SUMMARY_FILE
+        if not summary_path.exists():
+            raise NoProfileError(f'No profile found in {self.directory}')
+
+        with open(summary_path, 'r') as f:
+            self.summary = json.load(f)
+
+    def cpu(self, sort: str = 'cumulative', limit: int = 20) -> str:
+        """ Format the functions that took the most time.
+
+        :param str sort: The key by which to sort the functions, as accepted by `pstats.Stats.sort_stats`.
+        :param int limit: The number of functions to list.
+        :return: The report.
+        :rtype: str
+        """
+        output = io.StringIO()
+        stats = pstats.Stats(str(self.directory / TaskProfiler.STATS_FILE), stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+
+        return output.getvalue()
+
+    def memory(self, limit: int = 20) -> Optional[str]:
+        """ Format the lines that allocated the most memory, if allocations were traced.
+
+        :param int limit: The number of lines to list.
+        :return: The report, or None.
+        :rtype: str
+        """
+        snapshot_path = self.directory / TaskProfiler.SNAPSHOT_FILE
+        if not snapshot_path.exists():
+            return None
+
+        snapshot = tracemalloc.Snapshot.load(str(snapshot_path))
+        lines = [f'Peak traced memory: {self.summary["peak_memory"] / 1024:.1f} KiB']
+        lines.extend(str(statistic) for statistic in snapshot.statistics('lineno')[:limit])
+
+        return '\n'.join(lines)
@@ -0,0 +1,162 @@
+import heapq
+import logging
+
+from typing import Dict, List, Optional
+
+import networkx as nx
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Scheduler', 'upward_ranks']
+
+
+def upward_ranks(task_graph: nx.DiGraph, task_names: List[str], durations: Dict[str, float],
+                 default_duration: Optional[float] = None) -> Dict[str, float]:
+    """ Compute the upward rank of each task, i.e. the length of the longest path from the start
+        of the task to the end of the run, as used by the HEFT scheduling heuristic. Ready tasks
+        with a higher rank lie on a longer remaining path and should be started first.
+
+    :param nx.DiGraph task_graph: The task graph of the pipeline.
+    :param List[str] task_names: The tasks of the run, in topological order.
+    :param Dict[str, float] durations: The known duration of each task, e.g. from previous runs.
+    :param float default_duration: The duration assumed for tasks without a known duration; defaults
+                                   to the median of the known durations, or 1 if there are none.
+    :return: The upward rank of each task.
+    :rtype: Dict[str, float]
+    """
+
+    if default_duration is None:
+        known = sorted(durations[task_name] for task_name in task_names if task_name in durations)
+        default_duration = known[len(known) // 2] if known else 1.0
+
+    ranks = {}
+    for task_name in reversed(task_names):
+        successor_ranks = [ranks[successor] for successor in task_graph.successors(task_name) if successor in ranks]
+        ranks[task_name] = durations.get(task_name, default_duration) + max(successor_ranks, default=0)
+
+    return ranks
+
+
+class Scheduler:
+    """ Keeps track of which tasks of a pipeline run are ready to be dispatched, and hands
+        them out in order of priority while respecting the capacity of named resource pools.
+
+        A task is ready once all of its dependencies that are part of the run have completed.
+        Each task may require some amount of any number of named resources (e.g. `cpu`,
+        `mem_gb` or `db`); a task is only dispatched if the amounts it requires are available
+        in every pool that has a capacity. Resources without a capacity are not limited, and a
+        requirement that exceeds the capacity of its pool is reduced to that capacity, so that
+        the task can still run once the pool is otherwise idle.
+    """
+
+    def __init__(self, task_graph: nx.DiGraph, task_names: List[str],
+                 capacities: Optional[Dict[str, float]] = None,
+                 requirements: Optional[Dict[str, Dict[str, float]]] = None,
+                 priorities: Optional[Dict[str, float]] = None):
+        """
+        :param nx.DiGraph task_graph: The task graph of the pipeline.
+        :param List[str] task_names: The tasks to schedule, in their default (topological) order.
+        :param Dict[str, float] capacities: The capacity of each named resource pool.
+        :param Dict[str, Dict[str, float]] requirements: The resources required by each task.
+        :param Dict[str, float] priorities: The priority of each task; higher priorities are
+                                            dispatched first, ties are broken by the default order.
+        """
+
+        self.capacities = dict(capacities or {})
+        self.available = dict(self.capacities)
+        self.running = set()
+        self.completed = set()
+
+        self._order = {task_name: index for index, task_name in enumerate(task_names)}
+        self._priorities = priorities or {}
+        self._requirements = {}
+        self._waiting = {}
+        self._successors = {}
+        self._ready = []
+
+        for task_name in task_names:
+            self._requirements[task_name] = self._clamp(task_name, (requirements or {}).get(task_name, None))
+            self._successors[task_name] = [successor for successor in task_graph.successors(task_name)
+                                           if successor in self._order]
+            self._waiting[task_name] = sum(1 for predecessor in task_graph.predecessors(task_name)
+                                           if predecessor in self._order)
+            if self._waiting[task_name] == 0:
+                self._push(task_name)
+
+    def _clamp(self, task_name: str, requirement: Optional[Dict[str, float]]) -> Dict[str, float]:
+
+        clamped = {}
+        for resource, amount in (requirement or {}).items():
+            if resource not in self.capacities:
+                continue
+            if amount > self.capacities[resource]:
+                logger.warning('Task %s requires %s %s but only %s is available; it will run alone',
+                               task_name, amount, resource, self.capacities[resource])
+                amount = self.capacities[resource]
+            clamped[resource] = amount
+
+        return clamped
+
+    def _push(self, task_name: str):
+
+        heapq.heappush(self._ready, (-self._priorities.get(task_name, 0), self._order[task_name], task_name))
+
+    def _fits(self, task_name: str) -> bool:
+
+        return all(self.available[resource] >= amount
+                   for resource, amount in self._requirements[task_name].items())
+
+    def has_pending(self) -> bool:
+        """ Whether there are tasks that have not completed yet.
+
+        :return: True or False
+        :rtype: bool
+        """
+        return len(self.completed) < len(self._order)
+
+    def next_tasks(self, slots: int) -> List[str]:
+        """ Hand out up to `slots` ready tasks whose resource requirements can currently be met,
+            highest priority first, and reserve their resources.
+
+        :param int slots: The maximum number of tasks to hand out.
+        :return: The names of the tasks to dispatch.
+        :rtype: List[str]
+        """
+
+        dispatched = []
+        blocked = []
+        while self._ready and len(dispatched) < slots:
+            entry = heapq.heappop(self._ready)
+            task_name = entry[2]
+            if self._fits(task_name):
+                for resource, amount in self._requirements[task_name].items():
+                    self.available[resource] -= amount
+                self.running.add(task_name)
+                dispatched.append(task_name)
+            else:
+                blocked.append(entry)
+
+        for entry in blocked:
+            heapq.heappush(self._ready, entry)
+
+        return dispatched
+
+    def complete(self, task_name: str):
+        """ Mark a task as completed, release its resources and make the successors whose
+            dependencies have all completed ready. Tasks that were skipped without ever being
+            dispatched must be completed as well.
+
+        :param str task_name: The name of the task.
+        :return: None
+        """
+
+        if task_name in self.running:
+            self.running.remove(task_name)
+            for resource, amount in self._requirements[task_name].items():
+                self.available[resource] += amount
+
+        self.completed.add(task_name)
+        for successor in self._successors[task_name]:
+            self._waiting[successor] -= 1
+            if self._waiting[successor] == 0:
+                self._push(successor)
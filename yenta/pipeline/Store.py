@@ -0,0 +1,420 @@
+import os
+import pickle
+import threading
+
+from collections.abc import Mapping, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from yenta.config import settings
+from yenta.pipeline.History import MemoryHistory
+from yenta.pipeline.Profile import TaskProfiler
+from yenta.utils.cache import LRUCache, load_pickle
+
+__all__ = ['StoredResults', 'Prefetcher', 'MemoryStore']
+
+# below this many task directories, a store is scanned serially, since starting threads costs more than it saves
+PARALLEL_SCAN_THRESHOLD = 32
+
+# returned by `Prefetcher.take` for a file that has not been loaded ahead
+MISSING = object()
+
+
+def _existing(directories: List[Tuple[str, str]]) -> List[bool]:
+
+    return [os.path.exists(path) for _, path in directories]
+
+
+def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class Prefetcher:
+    """ Unpickles stored files on a thread pool ahead of the tasks that need them, so that the
+        latency of reading them, which dominates on network file systems, overlaps with the work
+        of the run. A file that has been loaded is held until it is taken, which hands it over and
+        forgets it, or discarded; the sizes of the files held at once are kept within `budget`
+        bytes, and files that do not fit are left to be read when they are needed.
+
+        A file is only handed over if it has not been replaced since it was loaded.
+    """
+
+    def __init__(self, budget: int, max_workers: int = None):
+        """
+        :param int budget: The total size of the files that may be held at once, in bytes.
+        :param int max_workers: The number of files that are read at once; defaults to `settings.YENTA_IO_WORKERS`.
+        """
+
+        self.budget = budget
+        self.used = 0
+        self._entries: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or settings.YENTA_IO_WORKERS,
+                                            thread_name_prefix='yenta-prefetch')
+
+    def _load(self, path: str) -> Optional[Tuple[Tuple[int, int, int], int, Any]]:
+
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            with self._lock:
+                if self.used + stat.st_size > self.budget:
+                    return None
+                self.used += stat.st_size
+            try:
+                return _stat_key(stat), stat.st_size, pickle.load(f)
+            except BaseException:
+                self._release(stat.st_size)
+                raise
+
+    def _release(self, size: int):
+
+        with self._lock:
+            self.used -= size
+
+    def _forget(self, future: Future):
+
+        # the memory of a discarded file is released once it has been loaded, or right away if it never will be
+        def release(done: Future):
+            if not done.cancelled() and done.exception() is None and done.result() is not None:
+                self._release(done.result()[1])
+
+        if not future.cancel():
+            future.add_done_callback(release)
+
+    def prefetch(self, paths: Iterable[str]):
+        """ Start loading files, unless they are being loaded already.
+
+        :param paths: The files.
+        :return: None
+        """
+        with self._lock:
+            for path in paths:
+                path = os.fspath(path)
+                if path not in self._entries:
+                    self._entries[path] = self._executor.submit(self._load, path)
+
+    def take(self, path: str) -> Any:
+        """ Hand over a file that has been loaded ahead, waiting for it if it is still being loaded.
+
+        :param str path: The file.
+        :return: The unpickled contents of the file, or `MISSING` if it was not loaded ahead, did not
+                 fit into the budget, could not be read or has been replaced since.
+        """
+        with self._lock:
+            future = self._entries.pop(os.fspath(path), None)
+        if future is None or future.cancelled():
+            return MISSING
+        try:
+            loaded = future.result()
+        except Exception:
+            # reading the file again raises the error where it can be handled
+            return MISSING
+        if loaded is None:
+            return MISSING
+
+        key, size, value = loaded
+        self._release(size)
+        try:
+            if _stat_key(os.stat(path)) != key:
+                return MISSING
+        except OSError:
+            return MISSING
+        return value
+
+    def discard(self, paths: Iterable[str]):
+        """ Drop files that were loaded ahead but are no longer needed.
+
+        :param paths: The files.
+        :return: None
+        """
+        with self._lock:
+            futures = [self._entries.pop(os.fspath(path), None) for path in paths]
+        for future in futures:
+            if future is not None:
+                self._forget(future)
+
+    def close(self):
+        """ Drop all the files that are held and stop the threads that load them.
+
+        :return: None
+        """
+        with self._lock:
+            futures, self._entries = list(self._entries.values()), {}
+        for future in futures:
+            self._forget(future)
+        self._executor.shutdown()
+
+
+class MemoryStore:
+    """ A store that keeps what a pipeline would write to its directory in memory instead: the
+        pickled results and inputs of its tasks, the results of the elements of its mapped tasks,
+        the durations of its tasks, the history of its runs and the profiles of its profiled tasks,
+        which are kept as `TaskProfiler` objects in `profiles`. Entries are still pickled, so that
+        results that cannot be stored fail as they would on disk and a reused result is a copy,
+        but nothing touches the file system, which makes it suited to tests.
+
+        A store belongs to a single pipeline and lasts as long as the object. `FileHandle` values
+        are not copied into it and keep pointing at the files that the tasks wrote, and the claims
+        of tasks only exclude the runs in the same process.
+    """
+
+    def __init__(self):
+
+        self.durations: Dict[str, float] = {}
+        self.history = MemoryHistory()
+        self.profiles: Dict[str, TaskProfiler] = {}
+
+        self._files: Dict[str, Dict[str, bytes]] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def write(self, task_name: str, name: str, data: bytes):
+        """ Store a file of a task.
+
+        :param str task_name: The name of the task.
+        :param str name: The name of the file, e.g. `result.pk` or `elements/<key>.pk`.
+        :param bytes data: The contents of the file.
+        :return: None
+        """
+        with self._guard:
+            self._files.setdefault(task_name, {})[name] = data
+
+    def exists(self, task_name: str, name: str) -> bool:
+
+        return name in self._files.get(task_name, {})
+
+    def load(self, task_name: str, name: str) -> Any:
+        """ Unpickle a file of a task.
+
+        :param str task_name: The name of the task.
+        :param str name: The name of the file.
+        :return: The unpickled contents of the file.
+        :raises KeyError: If the file does not exist.
+        """
+        return pickle.loads(self._files.get(task_name, {})[name])
+
+    def names(self, task_name: str) -> List[str]:
+        """ List the files of a task.
+
+        :param str task_name: The name of the task.
+        :return: The names of the files.
+        :rtype: List[str]
+        """
+        with self._guard:
+            return list(self._files.get(task_name, {}))
+
+    def remove(self, task_name: str, name: str = None):
+        """ Delete a file of a task, or all of them.
+
+        :param str task_name: The name of the task.
+        :param str name: Optionally, the name of the file; defaults to all the files of the task.
+        :return: None
+        """
+        with self._guard:
+            if name is None:
+                self._files.pop(task_name, None)
+            else:
+                self._files.get(task_name, {}).pop(name, None)
+
+    def stored_tasks(self) -> Set[str]:
+        """ List the tasks that have a result in the store.
+
+        :return: The names of the tasks.
+        :rtype: Set[str]
+        """
+        with self._guard:
+            return {task_name for task_name, files in self._files.items() if 'result.pk' in files}
+
+    def lock(self, name: str) -> threading.Lock:
+        """ Return the lock that stands in for a lock file of the store.
+
+        :param str name: The name of the lock, e.g. the name of the task that it claims.
+        :return: The lock, which is shared by all the callers asking for the same name.
+        :rtype: threading.Lock
+        """
+        with self._guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def clear(self):
+
+        with self._guard:
+            self._files.clear()
+            self.durations.clear()
+            self.history = MemoryHistory()
+            self.profiles.clear()
+
+
+class StoredResults(MutableMapping):
+    """ A mapping from task names to the results (or inputs) of those tasks that is backed by
+        the pipeline store. Entries that are assigned are held in memory until they are
+        released; released entries, and entries that were found in the store, are unpickled
+        from their files whenever they are accessed and are not kept afterwards, so that
+        only the values that are still needed occupy memory.
+    """
+
+    def __init__(self, store_path: Path, file_name: str, cache: LRUCache = None, memory_store: MemoryStore = None):
+        """
+        :param Path store_path: The directory in which the pipeline is stored.
+        :param str file_name: The file holding each entry in the directory of its task,
+                              i.e. `result.pk` or `inputs.pk`.
+        :param LRUCache cache: Optionally, a cache of previously read files.
+        :param MemoryStore memory_store: Optionally, the store in memory from which entries are read instead.
+        """
+
+        self.store_path = Path(store_path)
+        self.file_name = file_name
+        self.cache = cache
+        self.memory_store = memory_store
+
+        self._directory = os.fspath(store_path)
+
+        self._held: Dict[str, Any] = {}
+        self._stored: Set[str] = set()
+
+        # set while a run reads the entries through a prefetcher
+        self.prefetcher: Optional[Prefetcher] = None
+
+    @staticmethod
+    def stored_tasks(store_path: Path, jobs: int = None) -> Set[str]:
+        """ List the tasks that have a result in the store. The directories of a large store are
+            checked in parallel, since on a network file system every check is a round trip.
+
+        :param Path store_path: The directory in which the pipeline is stored.
+        :param int jobs: The number of directories to check at once; defaults to `settings.YENTA_IO_WORKERS`.
+        :return: The names of the tasks.
+        :rtype: Set[str]
+        """
+        if not os.path.isdir(store_path):
+            return set()
+        with os.scandir(store_path) as entries:
+            directories = [(entry.name, os.path.join(entry.path, 'result.pk')) for entry in entries if entry.is_dir()]
+
+        jobs = settings.YENTA_IO_WORKERS if jobs is None else jobs
+        if jobs > 1 and len(directories) > PARALLEL_SCAN_THRESHOLD:
+            # every thread checks a contiguous slice, since a future per directory costs more than a local check
+            size = -(-len(directories) // jobs)
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                found = [exists for chunk in executor.map(_existing, (directories[start:start + size]
+                                                                      for start in range(0, len(directories), size)))
+                         for exists in chunk]
+        else:
+            found = _existing(directories)
+
+        return {name for (name, _), exists in zip(directories, found) if exists}
+
+    def entry_path(self, task_name: str) -> str:
+        """ Return the file that holds the entry of a task in the store.
+
+        :param str task_name: The name of the task.
+        :return: The path.
+        :rtype: str
+        """
+        return f'{self._directory}{os.sep}{task_name}{os.sep}{self.file_name}'
+
+    @classmethod
+    def from_store(cls, store_path: Path, file_name: str, cache: LRUCache = None,
+                   task_names: Iterable[str] = None, memory_store: MemoryStore = None) -> 'StoredResults':
+        """ Create a mapping of all the entries present in the store, without loading any of them.
+
+        :param Path store_path: The directory in which the pipeline is stored.
+        :param str file_name: The file holding each entry in the directory of its task.
+        :param LRUCache cache: Optionally, a cache of previously read files.
+        :param task_names: Optionally, the tasks in the store, as listed by `stored_tasks`.
+        :param MemoryStore memory_store: Optionally, the store in memory from which entries are read instead.
+        :return: The mapping.
+        :rtype: StoredResults
+        """
+        results = cls(store_path, file_name, cache, memory_store)
+        if task_names is None:
+            task_names = cls.stored_tasks(store_path) if memory_store is None else memory_store.stored_tasks()
+        results._stored = set(task_names)
+
+        return results
+
+    def __getitem__(self, task_name: str) -> Any:
+
+        if task_name in self._held:
+            return self._held[task_name]
+        if task_name in self._stored and self.memory_store is not None:
+            return self.memory_store.load(task_name, self.file_name)
+        if task_name in self._stored:
+            path = self.entry_path(task_name)
+            if self.prefetcher is not None:
+                value = self.prefetcher.take(path)
+                if value is not MISSING:
+                    return value
+            return load_pickle(path, self.cache)
+        raise KeyError(task_name)
+
+    def get(self, task_name: str, default: Any = None) -> Any:
+
+        # looked up for every task of a run, so a missing entry does not go through a KeyError
+        if task_name in self._held:
+            return self._held[task_name]
+        if task_name in self._stored:
+            return self[task_name]
+        return default
+
+    def __setitem__(self, task_name: str, value: Any):
+
+        self._held[task_name] = value
+
+    def __delitem__(self, task_name: str):
+
+        if task_name not in self:
+            raise KeyError(task_name)
+        self._held.pop(task_name, None)
+        self._stored.discard(task_name)
+
+    def __contains__(self, task_name) -> bool:
+
+        return task_name in self._held or task_name in self._stored
+
+    def __iter__(self) -> Iterator[str]:
+
+        yield from self._held
+        yield from (task_name for task_name in self._stored if task_name not in self._held)
+
+    def __len__(self) -> int:
+
+        return len(self._stored | set(self._held))
+
+    def release(self, task_name: str):
+        """ Drop an entry from memory; it must already have been written to the store, from
+            which it is loaded again if it is accessed later.
+
+        :param str task_name: The name of the task.
+        :return: None
+        """
+        if task_name in self._held:
+            del self._held[task_name]
+            self._stored.add(task_name)
+
+    def merged(self, other: Mapping) -> 'StoredResults':
+        """ Combine this mapping with another one without loading any entries. If they share
+            keys, the entries of the other mapping take precedence.
+
+        :param Mapping other: The other mapping, either a `StoredResults` of the same store or a dict.
+        :return: The combined mapping.
+        :rtype: StoredResults
+        """
+        merged = StoredResults(self.store_path, self.file_name, self.cache, self.memory_store)
+        merged._held = dict(self._held)
+        merged._stored = set(self._stored)
+        if isinstance(other, StoredResults):
+            for task_name in other._stored:
+                merged._held.pop(task_name, None)
+            merged._stored.update(other._stored)
+            merged._held.update(other._held)
+        else:
+            merged._held.update(other)
+
+        return merged
+
+    @property
+    def held(self) -> Set[str]:
+        """ The names of the tasks whose entries are currently held in memory. """
+
+        return set(self._held)
@@ -0,0 +1,158 @@
+import itertools
+import json
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+from pathlib import Path
+from typing import Any, Dict, List, Set
+
+from yenta.pipeline.Pipeline import Pipeline, PipelineResult
+from yenta.pipeline.Watch import affected_tasks
+from yenta.utils.files import atomic_write
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Sweep', 'SweepError', 'load_sweep', 'configuration_key']
+
+
+class SweepError(Exception):
+    pass
+
+
+def load_sweep(path: Path) -> List[Dict[str, Any]]:
+    """ Read the configurations of a sweep from a JSON file. The file holds either a list of
+        configurations, each a dict of parameter values, or a single dict in which every
+        parameter whose value is a list is swept over, so that the configurations are all the
+        combinations of the values of the swept parameters, while the other parameters are fixed.
+
+    :param Path path: The file.
+    :return: The configurations.
+    :rtype: List[Dict[str, Any]]
+    """
+    with open(path, 'r') as f:
+        spec = json.load(f)
+
+    if isinstance(spec, list):
+        if not all(isinstance(configuration, dict) for configuration in spec):
+            raise SweepError(f'Every configuration in {path} must be a dict of parameter values')
+        return spec
+    if not isinstance(spec, dict):
+        raise SweepError(f'{path} must hold a list of configurations or a dict of parameter values')
+
+    swept = [name for name, value in spec.items() if isinstance(value, list)]
+    return [{**spec, **dict(zip(swept, values))}
+            for values in itertools.product(*(spec[name] for name in swept))]
+
+
+def configuration_key(params: Dict[str, Any]) -> str:
+    """ Compute a short key identifying a configuration by its parameter values.
+
+    :param Dict[str, Any] params: The parameter values.
+    :return: The key.
+    :rtype: str
+    """
+    return sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+class Sweep:
+    """ Runs one set of tasks over many configurations of the pipeline parameters. Every
+        configuration is a pipeline of its own, named after the sweep and the key of the
+        configuration, whose store holds its results and a `params.json` of its parameters.
+
+        The tasks that do not depend on a parameter whose value differs between configurations,
+        directly or through their dependencies, are executed once; the pipelines of the
+        configurations then share the results of the pure ones through the result index of the
+        store, and are given a copy of the results of the impure ones, which they do not execute
+        again. The tasks that diverge are executed for up to `max_parallel` configurations at once.
+    """
+
+    def __init__(self, tasks, configurations: List[Dict[str, Any]], name: str = 'default',
+                 max_parallel: int = 4, **pipeline_options):
+        """
+        :param tasks: The tasks that make up the pipeline.
+        :param configurations: The parameter values of each configuration.
+        :param str name: The name of the sweep, from which the names of the pipelines are derived.
+        :param int max_parallel: The number of configurations that are run at once.
+        :param pipeline_options: Any other arguments to pass to the pipeline of each configuration.
+        """
+
+        if not configurations:
+            raise SweepError('A sweep needs at least one configuration')
+        if max_parallel < 1:
+            raise SweepError(f'A sweep needs to run at least one configuration at once, got {max_parallel}')
+
+        self.tasks = tasks
+        self.name = name
+        self.max_parallel = max_parallel
+
+        self.pipelines: Dict[str, Pipeline] = {}
+        self.configurations: Dict[str, Dict[str, Any]] = {}
+        for params in configurations:
+            key = configuration_key(params)
+            if key not in self.pipelines:
+                self.configurations[key] = params
+                self.pipelines[key] = Pipeline(*tasks, name=f'{name}@{key}', params=params, share_results=True,
+                                               **pipeline_options)
+
+    @property
+    def swept_params(self) -> Set[str]:
+        """ The parameters whose values differ between configurations. """
+
+        names = {name for params in self.configurations.values() for name in params}
+        return {name for name in names
+                if len({json.dumps(params.get(name, None), sort_keys=True, default=str)
+                        for params in self.configurations.values()}) > 1}
+
+    def divergent_tasks(self) -> Set[str]:
+        """ Find the tasks whose results may differ between configurations, i.e. the tasks that declare
+            a swept parameter and all the tasks that depend on them.
+
+        :return: The names of the tasks.
+        :rtype: Set[str]
+        """
+        swept = self.swept_params
+        pipeline = next(iter(self.pipelines.values()))
+        return affected_tasks(pipeline.task_graph, [task.task_def.name for task in self.tasks
+                                                    if swept.intersection(task.task_def.params)])
+
+    def run(self, up_to: str = None, force_rerun: List[str] = None) -> Dict[str, PipelineResult]:
+        """ Run the pipeline for every configuration.
+
+        :param str up_to: If supplied, run the pipelines only up to this task.
+        :param List[str] force_rerun: Optionally force the listed tasks to be executed; the shared
+                                      tasks among them are executed once.
+        :return: The final state of the pipeline of each configuration, by the key of the configuration.
+        :rtype: Dict[str, PipelineResult]
+        """
+        for key, pipeline in self.pipelines.items():
+            atomic_write(pipeline.store_path / 'params.json',
+                         json.dumps(self.configurations[key], indent=2, sort_keys=True, default=str).encode())
+
+        divergent = self.divergent_tasks()
+        first = next(iter(self.pipelines.values()))
+        shared = [task_name for task_name in first.execution_order if task_name not in divergent]
+        only = None
+        if shared and len(self.pipelines) > 1:
+            logger.info('Executing the %d tasks shared by all configurations of %s', len(shared), self.name)
+            first.run_pipeline(up_to, force_rerun, only=shared)
+            force_rerun = [task_name for task_name in (force_rerun or []) if task_name in divergent]
+
+            # impure tasks are never adopted from the result index, so their results are handed to
+            # every configuration, which then leaves them out of its run
+            impure = {task.task_def.name for task in self.tasks if not task.task_def.pure}.intersection(shared)
+            for task_name in impure:
+                stored = first.load_task(task_name)
+                if task_name not in stored.task_results:
+                    continue
+                for pipeline in self.pipelines.values():
+                    if pipeline is not first:
+                        pipeline.cache_result(task_name, stored)
+            if impure:
+                only = [task_name for task_name in first.execution_order if task_name not in impure]
+
+        logger.info('Running %d configurations of %s', len(self.pipelines), self.name)
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            futures = {key: executor.submit(pipeline.run_pipeline, up_to, force_rerun, only)
+                       for key, pipeline in self.pipelines.items()}
+            return {key: future.result() for key, future in futures.items()}
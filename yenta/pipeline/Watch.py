@@ -0,0 +1,219 @@
+import glob
+import logging
+import time
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set
+
+import networkx as nx
+from colorama import Fore, Style
+
+from yenta.artifacts.Artifact import file_artifacts
+from yenta.pipeline.Index import task_fingerprint
+from yenta.pipeline.Pipeline import Pipeline, PipelineResult
+from yenta.utils.files import stat_signature
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['FileMonitor', 'Watcher', 'affected_tasks']
+
+
+def affected_tasks(task_graph: nx.DiGraph, changed: Iterable[str]) -> Set[str]:
+    """ Return the tasks that may produce a different result when the given tasks do, i.e.
+        the tasks themselves and everything downstream of them.
+
+    :param nx.DiGraph task_graph: The task graph of the pipeline.
+    :param changed: The names of the tasks that changed.
+    :return: The names of the affected tasks.
+    :rtype: Set[str]
+    """
+    affected = set()
+    for task_name in changed:
+        if task_name in task_graph and task_name not in affected:
+            affected.add(task_name)
+            affected.update(nx.descendants(task_graph, task_name))
+
+    return affected
+
+
+class FileMonitor:
+    """ Detects changes to a set of files by polling them. The modification time and size of
+        every file are kept from one poll to the next, so that a poll only costs one `stat` per
+        file, and a file counts as changed when it appears, disappears or its stat differs.
+    """
+
+    def __init__(self):
+
+        self._stats: Optional[Dict[Path, tuple]] = None
+
+    def changed(self, paths: Iterable[Path]) -> Set[Path]:
+        """ Return the files that changed since the previous call, and remember their current
+            state. Nothing has changed on the first call. Files that were watched before but are
+            no longer in `paths` count as changed if they existed.
+
+        :param paths: The files to check.
+        :return: The files that changed.
+        :rtype: Set[Path]
+        """
+        current = {Path(path): stat_signature(path) for path in paths}
+        changed = set()
+        if self._stats is not None:
+            changed = {path for path, signature in current.items() if self._stats.get(path, None) != signature}
+            changed.update(path for path, signature in self._stats.items()
+                           if path not in current and signature is not None)
+        self._stats = current
+
+        return changed
+
+
+class Watcher:
+    """ Keeps a pipeline up to date while its sources change. The entry point, the files
+        declared as `input_files` by the tasks and the `FileArtifact` locations produced by
+        the tasks are polled; when any of them changes, only the tasks that depend on the change
+        are executed again:
+
+        * a task whose code changed in the entry point is executed, along with its descendants;
+        * a task one of whose input files changed is executed, along with its descendants;
+        * when an artifact changed, the tasks that consume it are executed, along with their descendants.
+
+        Descendants are executed only if their inputs actually changed, as in a normal run. The
+        tasks, task graph and stored results stay in memory between iterations.
+    """
+
+    def __init__(self, load_tasks: Callable[[], list], entry_point: Path,
+                 pipeline_factory: Callable[[list], Pipeline], poll_interval: float = 0.5):
+        """
+        :param Callable load_tasks: Loads the tasks from the entry point.
+        :param Path entry_point: The file containing the task definitions.
+        :param Callable pipeline_factory: Builds a pipeline from a list of tasks.
+        :param float poll_interval: How often to check for changes, in seconds.
+        """
+
+        self.load_tasks = load_tasks
+        self.entry_point = Path(entry_point)
+        self.pipeline_factory = pipeline_factory
+        self.poll_interval = poll_interval
+
+        self.pipeline: Optional[Pipeline] = None
+        self.result: Optional[PipelineResult] = None
+        self.monitor = FileMonitor()
+        self._fingerprints: Dict[str, str] = {}
+        self._watched: Dict[Path, Set[str]] = {}
+        self._artifacts: Dict[Path, Set[str]] = {}
+        self._stopped = False
+
+    def _load(self) -> Set[str]:
+
+        tasks = self.load_tasks()
+        fingerprints = {task.task_def.name: task_fingerprint(task) for task in tasks}
+        changed = {task_name for task_name, fingerprint in fingerprints.items()
+                   if self._fingerprints.get(task_name) != fingerprint}
+        self._fingerprints = fingerprints
+        self.pipeline = self.pipeline_factory(tasks)
+
+        return changed
+
+    def watched_files(self) -> Dict[Path, Set[str]]:
+        """ Collect the files to poll, along with the tasks that must be executed again when
+            each of them changes. The entry point maps to no task; changes to it are resolved
+            by comparing the code of the tasks.
+
+        :return: A dictionary whose keys are files and whose values are task names.
+        :rtype: Dict[Path, Set[str]]
+        """
+        watched = {self.entry_point: set()}
+        for task_name in self.pipeline.execution_order:
+            task = self.pipeline.task_graph.nodes[task_name].get('task', None)
+            if task is None:
+                continue
+            for pattern in task.task_def.input_files:
+                for path in glob.glob(pattern, recursive=True) or [pattern]:
+                    watched.setdefault(Path(path), set()).add(task_name)
+
+        for path, consumers in self._artifacts.items():
+            watched.setdefault(path, set()).update(consumers)
+
+        return watched
+
+    def _collect_artifacts(self):
+
+        # results are read from the store once per run rather than on every poll
+        self._artifacts = {}
+        for task_name, task_result in self.result.task_results.items():
+            if task_name not in self.pipeline.task_graph:
+                continue
+            consumers = set(self.pipeline.task_graph.successors(task_name))
+            for value in task_result.values.values():
+                for artifact in file_artifacts(value):
+                    self._artifacts.setdefault(Path(artifact.location), set()).update(consumers)
+
+    def start(self) -> PipelineResult:
+        """ Load the tasks and bring the whole pipeline up to date.
+
+        :return: The pipeline state.
+        :rtype: PipelineResult
+        """
+        self._load()
+        self.result = self.pipeline.run_pipeline()
+        self._collect_artifacts()
+        self._watched = self.watched_files()
+        self.monitor.changed(self._watched)
+
+        return self.result
+
+    def poll(self) -> Optional[PipelineResult]:
+        """ Check for changes once and execute the affected tasks.
+
+        :return: The pipeline state, or None if nothing changed.
+        :rtype: PipelineResult
+        """
+        watched = self.watched_files()
+        changed_files = self.monitor.changed(watched)
+        previously_watched, self._watched = self._watched, watched
+        if not changed_files:
+            return None
+
+        for path in sorted(changed_files):
+            print(Fore.WHITE + Style.BRIGHT + f'Change detected in {path}')
+
+        roots = set()
+        for path in changed_files:
+            roots.update(watched.get(path, previously_watched.get(path, set())))
+        if self.entry_point in changed_files:
+            roots.update(self._load())
+
+        affected = affected_tasks(self.pipeline.task_graph, roots)
+        if not affected:
+            return None
+
+        logger.info(f'Executing {len(affected)} affected task(s)')
+        self.result = self.pipeline.run_pipeline(force_rerun=sorted(roots), only=affected)
+        self._collect_artifacts()
+        # the run may have written artifacts itself; those writes are not changes to react to
+        self._watched = self.watched_files()
+        self.monitor.changed(self._watched)
+
+        return self.result
+
+    def run(self):
+        """ Bring the pipeline up to date, then keep polling until `stop` is called or the
+            process is interrupted.
+
+        :return: None
+        """
+        self.start()
+        print(Fore.WHITE + Style.BRIGHT + 'Watching for changes...')
+        try:
+            while not self._stopped:
+                time.sleep(self.poll_interval)
+                if self.poll() is not None:
+                    print(Fore.WHITE + Style.BRIGHT + 'Watching for changes...')
+        except KeyboardInterrupt:
+            pass
+
+    def stop(self):
+        """ Ask the watcher to return after its current iteration.
+
+        :return: None
+        """
+        self._stopped = True
@@ -1 +1,14 @@
+from .Delta import *
+from .Events import *
+from .Profile import *
+from .History import *
+from .Index import *
+from .Scheduler import *
+from .Store import *
 from .Pipeline import *
+from .Distributed import *
+from .Watch import *
+from .Sweep import *
+from .Group import *
+from .Graph import *
+from .Bundle import *
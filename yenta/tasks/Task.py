@@ -9,6 +9,7 @@ class ParameterType(int, Enum):
 
     PIPELINE_RESULTS = 1
     EXPLICIT = 2
+    PARAMETER = 3
 
 
 class ResultType(str, Enum):
@@ -40,13 +41,19 @@ class TaskDef:
     depends_on: Optional[List[str]]
     pure: bool
     param_specs: List[ParameterSpec] = field(default_factory=list)
+    map: bool = False
+    incremental: bool = False
+    resources: Dict[str, float] = field(default_factory=dict)
+    input_files: List[str] = field(default_factory=list)
+    params: List[str] = field(default_factory=list)
 
 
 class InvalidTaskDefinitionError(Exception):
     pass
 
 
-def build_parameter_spec(func, depends_on: List[str]):
+def build_parameter_spec(func, depends_on: List[str], selectors: Optional[Dict[str, Callable]] = None,
+                         params: Optional[List[str]] = None):
 
     sig = signature(func)
     param_names = list(sig.parameters.keys())
@@ -71,10 +78,44 @@ def build_parameter_spec(func, depends_on: List[str]):
             result_spec = ResultSpec(task_dep_name, var_dep_name)
             spec.append(ParameterSpec(param_name, param_type, result_spec))
 
+    for param_name, selector in (selectors or {}).items():
+        if param_name not in param_names:
+            raise InvalidTaskDefinitionError(
+                f'Selector supplied for parameter {param_name}, which is not a parameter of {func.__name__}.')
+        matching = [param_spec for param_spec in spec if param_spec.param_name == param_name]
+        if matching:
+            matching[0].selector = selector
+        else:
+            spec.append(ParameterSpec(param_name, ParameterType.PIPELINE_RESULTS, selector=selector))
+
+    for param_name in (params or []):
+        if param_name not in param_names:
+            raise InvalidTaskDefinitionError(
+                f'Pipeline parameter {param_name} is not a parameter of {func.__name__}.')
+        if any(param_spec.param_name == param_name for param_spec in spec):
+            raise InvalidTaskDefinitionError(
+                f'Parameter {param_name} of {func.__name__} cannot be both a pipeline parameter and a dependency.')
+        spec.append(ParameterSpec(param_name, ParameterType.PARAMETER))
+
     return spec
 
 
-def task(_func=None, *, depends_on: Optional[List[str]] = None, pure: bool = True, selectors=None):
+def validate_incremental_task(func, param_specs: List[ParameterSpec], mapped: bool):
+
+    if mapped:
+        raise InvalidTaskDefinitionError(f'Task {func.__name__} cannot be both mapped and incremental.')
+    if any(spec.param_type == ParameterType.PIPELINE_RESULTS and not spec.selector for spec in param_specs):
+        raise InvalidTaskDefinitionError(
+            f'Incremental task {func.__name__} must depend only on explicit or selected values and parameters.')
+    if 'previous' not in signature(func).parameters or \
+            any(spec.param_name == 'previous' for spec in param_specs):
+        raise InvalidTaskDefinitionError(
+            f'Incremental task {func.__name__} must accept a `previous` parameter after its dependencies.')
+
+
+def task(_func=None, *, depends_on: Optional[List[str]] = None, pure: bool = True, selectors=None,
+         map: bool = False, incremental: bool = False, resources: Optional[Dict[str, float]] = None,
+         input_files: Optional[List[str]] = None, params: Optional[List[str]] = None):
 
     depends_on = depends_on or []
 
@@ -84,11 +125,25 @@ def task(_func=None, *, depends_on: Optional[List[str]] = None, pure: bool = Tru
         def task_wrapper(*args, **kwargs):
             return func(*args, **kwargs)
 
+        param_specs = build_parameter_spec(func, depends_on, selectors, params)
+        if map and (not param_specs or (param_specs[0].param_type != ParameterType.EXPLICIT and
+                                        not param_specs[0].selector)):
+            raise InvalidTaskDefinitionError(
+                f'Mapped task {func.__name__} must depend on an explicit or selected value (e.g. foo.files) '
+                f'as its first parameter.')
+        if incremental:
+            validate_incremental_task(func, param_specs, map)
+
         setattr(task_wrapper, 'task_def', TaskDef(
             name=func.__name__,
             depends_on=depends_on,
             pure=pure,
-            param_specs=build_parameter_spec(func, depends_on)
+            param_specs=param_specs,
+            map=map,
+            incremental=incremental,
+            resources=dict(resources or {}),
+            input_files=list(input_files or []),
+            params=list(params or [])
         ))
 
         setattr(task_wrapper, '_yenta_task', True)
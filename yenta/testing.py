@@ -0,0 +1,81 @@
+""" Fixtures and assertions for testing pipelines with pytest. To use them, register the plugin in
+    the `conftest.py` at the root of the tests::
+
+        pytest_plugins = ['yenta.testing']
+
+    Every test gets a store of its own inside its temporary directory, so tests can run in parallel,
+    e.g. with pytest-xdist, and the pipelines made by `make_pipeline` keep their results in memory.
+"""
+
+from pathlib import Path
+from typing import Callable, Dict
+
+import pytest
+
+from yenta.config import settings
+from yenta.pipeline.Pipeline import Pipeline
+from yenta.pipeline.Store import MemoryStore
+
+__all__ = ['assert_executed', 'assert_reused', 'yenta_store', 'memory_store', 'make_pipeline']
+
+
+def _assert_tasks(kind: str, actual: set, expected: tuple):
+
+    expected = set(expected)
+    assert actual == expected, (f'Expected the tasks {sorted(expected)} to be {kind}, '
+                                f'but {sorted(actual)} were; missing {sorted(expected - actual)}, '
+                                f'unexpected {sorted(actual - expected)}')
+
+
+def assert_executed(pipeline: Pipeline, *task_names: str):
+    """ Assert that the latest run of a pipeline executed exactly the given tasks successfully.
+
+    :param Pipeline pipeline: The pipeline.
+    :param task_names: The names of the tasks.
+    :return: None
+    """
+    _assert_tasks('executed', set(pipeline._tasks_executed), task_names)
+
+
+def assert_reused(pipeline: Pipeline, *task_names: str):
+    """ Assert that the latest run of a pipeline reused the previous results of exactly the given tasks.
+
+    :param Pipeline pipeline: The pipeline.
+    :param task_names: The names of the tasks.
+    :return: None
+    """
+    _assert_tasks('reused', set(pipeline._tasks_reused), task_names)
+
+
+@pytest.fixture
+def yenta_store(tmp_path, monkeypatch) -> Path:
+    """ Point `settings.YENTA_STORE_PATH` at a store inside the temporary directory of the test,
+        which pytest removes, and keep the command line from forwarding to a daemon.
+    """
+    store_path = tmp_path / 'yenta_store'
+    monkeypatch.setattr(settings, 'YENTA_STORE_PATH', store_path)
+    monkeypatch.setattr(settings, 'YENTA_USE_DAEMON', False)
+    return store_path
+
+
+@pytest.fixture
+def memory_store() -> MemoryStore:
+    """ An empty store in memory. """
+
+    return MemoryStore()
+
+
+@pytest.fixture
+def make_pipeline(yenta_store) -> Callable[..., Pipeline]:
+    """ A factory of pipelines that takes the same arguments as `Pipeline`. Pipelines with the same
+        name share a store in memory for the duration of the test, so a pipeline made again reuses
+        the results of the previous one; pass `memory=False` to use the store on disk instead.
+    """
+    stores: Dict[str, MemoryStore] = {}
+
+    def make(*tasks, memory: bool = True, **kwargs) -> Pipeline:
+        if memory:
+            kwargs.setdefault('memory_store', stores.setdefault(kwargs.get('name', 'default'), MemoryStore()))
+        return Pipeline(*tasks, **kwargs)
+
+    return make
@@ -0,0 +1,91 @@
+import os
+import pickle
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, Optional, Union
+
+
+class LRUCache:
+    """ A thread-safe mapping that holds at most `maxsize` entries, discarding the least
+        recently used entry when it is full."""
+
+    def __init__(self, maxsize: int = 1024):
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+
+        with self._lock:
+            self._entries.clear()
+
+
+def read_bytes(path: Union[str, Path]) -> bytes:
+    """ Read the whole of a file without going through a buffered file object, which costs more
+        than the read itself for the small files of the store.
+
+    :param Union[str, Path] path: The file to read.
+    :return: The contents of the file.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        chunks = []
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(fd)
+
+    return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+
+def load_pickle(path: Union[str, Path], cache: Optional[LRUCache] = None) -> Any:
+    """ Unpickle the contents of a file. If a cache is supplied, the contents are kept in it,
+        keyed by the path, size and modification time of the file, so that the file is only read
+        again once it changes. The cache holds the pickled bytes rather than the object, so that
+        every caller gets an object of its own which it may modify freely.
+
+    :param Union[str, Path] path: The file to read.
+    :param LRUCache cache: Optionally, the cache of file contents.
+    :return: The unpickled object.
+    """
+    if cache is None:
+        return pickle.loads(read_bytes(path))
+
+    stat = os.stat(path)
+    key = (os.fspath(path), stat.st_mtime_ns, stat.st_size)
+    data = cache.get(key, None)
+    if data is None:
+        data = read_bytes(path)
+        cache.put(key, data)
+
+    return pickle.loads(data)
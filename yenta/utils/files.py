@@ -1,12 +1,27 @@
+import os
+import shutil
+import sys
+import uuid
+
 from hashlib import sha1
 from pathlib import Path
 
+from yenta.utils.trace import span
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# the ioctl that clones a file on Linux file systems with copy-on-write support, e.g. btrfs and xfs
+FICLONE = 0x40049409
+
 
 def file_hash(path: Path, block_size=65536):
     s = sha1()
 
     if path.exists():
-        with open(path, 'rb') as f:
+        with span('hash', 'io', path=str(path)), open(path, 'rb') as f:
             stop = False
             while not stop:
                 data = f.read(block_size)
@@ -16,3 +31,67 @@ def file_hash(path: Path, block_size=65536):
                     stop = True
 
     return s
+
+
+def atomic_write(path: Path, data: bytes):
+    """ Write data to a file such that readers see either the old or the new contents,
+        never a partially written file, by writing to a temporary file in the same
+        directory and renaming it over the target.
+    """
+    tmp_path = path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def stat_signature(path: Path):
+    """ Return the modification time, size and inode of a file, which change whenever the file
+        is written or replaced, or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _reflink(source: Path, target: Path) -> bool:
+
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False  # pragma: no cover
+    with open(source, 'rb') as f_in, open(target, 'wb') as f_out:
+        try:
+            fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+        except OSError:
+            return False
+    return True
+
+
+def copy_file(source: Path, target: Path, link: bool = False):
+    """ Copy a file, cloning it on file systems that support it, or hard link it if `link` is set
+        and the file system allows it. The file is written under a temporary name and renamed,
+        so that a partial file is never left at the target. A hard link shares its contents with
+        the source, so a change made in place to either one shows in the other.
+    """
+    target.parent.mkdir(exist_ok=True, parents=True)
+    tmp_path = target.with_name(f'.{target.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        linked = False
+        if link:
+            try:
+                os.link(source, tmp_path)
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            if not _reflink(source, tmp_path):
+                shutil.copyfile(source, tmp_path)
+            shutil.copymode(source, tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
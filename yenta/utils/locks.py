@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseLock:
+    """ An inter-process lock held by creating a file, which works across processes and, on
+        filesystems with atomic exclusive creation, across machines. The lock is a lease: its
+        holder renews it every `lease / 3` seconds from a background thread, and a lock that
+        has not been renewed for `lease` seconds, e.g. because its holder was killed, is
+        considered abandoned and may be broken by anyone waiting for it.
+    """
+
+    def __init__(self, path: Path, lease: float = 30.0, poll_interval: float = 0.05):
+        """
+        :param Path path: The lock file.
+        :param float lease: How long the lock stays valid without being renewed, in seconds.
+        :param float poll_interval: How often to retry acquiring a held lock, in seconds.
+        """
+
+        self.path = Path(path)
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.owner = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+        self._released: Optional[threading.Event] = None
+
+    @property
+    def held(self) -> bool:
+
+        return self._released is not None
+
+    def _try_acquire(self) -> bool:
+
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            self._break_if_expired()
+            return False
+
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'owner': self.owner, 'pid': os.getpid(), 'host': socket.gethostname()}, f)
+        return True
+
+    def _break_if_expired(self):
+
+        try:
+            expired = self.path.stat()
+        except FileNotFoundError:
+            return
+        if time.time() - expired.st_mtime <= self.lease:
+            return
+
+        # only one process at a time may break the lock, and it removes the lock only if it is still
+        # the file that was found to be expired, unrenewed; otherwise a process that checked the lock
+        # before someone else broke it could remove the lock that a third process acquired since
+        breaker_path = self.path.with_name(f'.{self.path.name}.breaking')
+        try:
+            os.close(os.open(breaker_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+        except FileExistsError:
+            # the breaker only holds the file for a moment, unless it died while holding it
+            try:
+                if time.time() - breaker_path.stat().st_mtime > self.lease:
+                    breaker_path.unlink()
+            except FileNotFoundError:
+                pass
+            return
+
+        try:
+            current = self.path.stat()
+            if (current.st_dev, current.st_ino, current.st_mtime_ns) == \
+                    (expired.st_dev, expired.st_ino, expired.st_mtime_ns):
+                logger.warning(f'Breaking the abandoned lock {self.path}')
+                self.path.unlink()
+        except FileNotFoundError:
+            pass
+        finally:
+            breaker_path.unlink()
+
+    def _renew(self, released: threading.Event):
+
+        while not released.wait(self.lease / 3):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                logger.warning(f'The lock {self.path} disappeared while it was held')
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """ Acquire the lock.
+
+        :param bool blocking: Whether to wait for the lock if it is held by someone else.
+        :param float timeout: Optionally, the longest time to wait, in seconds.
+        :return: Whether the lock was acquired.
+        :rtype: bool
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        while not self._try_acquire():
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(self.poll_interval)
+
+        self._released = threading.Event()
+        threading.Thread(target=self._renew, args=(self._released,), daemon=True).start()
+        return True
+
+    def release(self):
+        """ Release the lock.
+
+        :return: None
+        """
+        if self._released is None:
+            return
+        self._released.set()
+        self._released = None
+        try:
+            with open(self.path, 'r') as f:
+                owner = json.load(f).get('owner', None)
+            if owner == self.owner:
+                self.path.unlink()
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def __enter__(self):
+
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+
+        self.release()
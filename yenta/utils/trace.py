@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_local = threading.local()
+_no_span = contextlib.nullcontext()
+
+
+class Tracer:
+    """ Records spans of time spent in different parts of a run, on one track per thread, and
+        writes them in the Chrome trace event format, which can be opened in chrome://tracing
+        or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+
+        self._events: List[Dict[str, Any]] = []
+        self._tracks: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def _track(self) -> int:
+
+        ident = threading.get_ident()
+        track = self._tracks.get(ident, None)
+        if track is None:
+            with self._lock:
+                track = self._tracks[ident] = len(self._tracks)
+                self._events.append({'name': 'thread_name', 'ph': 'M', 'pid': self._pid, 'tid': track,
+                                     'args': {'name': threading.current_thread().name}})
+        return track
+
+    def record(self, name: str, start: float, end: float, category: str = 'yenta', **args):
+        """ Record a span on the track of the current thread.
+
+        :param str name: The name of the span.
+        :param float start: When the span started, as returned by `time.perf_counter`.
+        :param float end: When the span ended, as returned by `time.perf_counter`.
+        :param str category: The category of the span, by which spans can be filtered.
+        :param args: Any details to attach to the span; must be JSON-serializable.
+        :return: None
+        """
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self._pid, 'tid': self._track(),
+                 'ts': (start - self._origin) * 1e6, 'dur': (end - start) * 1e6}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = 'yenta', **args):
+        """ Record the time spent in a block as a span.
+
+        :param str name: The name of the span.
+        :param str category: The category of the span.
+        :param args: Any details to attach to the span.
+        :return: A context manager.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), category, **args)
+
+    @contextlib.contextmanager
+    def activate(self):
+        """ Make this the tracer to which `span` records spans in the current thread.
+
+        :return: A context manager.
+        """
+        previous = getattr(_local, 'tracer', None)
+        _local.tracer = self
+        try:
+            yield self
+        finally:
+            _local.tracer = previous
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+
+        with self._lock:
+            return list(self._events)
+
+    def write(self, path: Path):
+        """ Write the recorded spans to a file.
+
+        :param Path path: The file.
+        :return: None
+        """
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def current_tracer() -> Optional[Tracer]:
+    """ Return the tracer active in the current thread, if any.
+
+    :return: The tracer, or None.
+    :rtype: Tracer
+    """
+    return getattr(_local, 'tracer', None)
+
+
+def span(name: str, category: str = 'yenta', **args):
+    """ Record the time spent in a block as a span of the tracer active in the current thread,
+        or do nothing if there is none.
+
+    :param str name: The name of the span.
+    :param str category: The category of the span.
+    :param args: Any details to attach to the span.
+    :return: A context manager.
+    """
+    tracer = getattr(_local, 'tracer', None)
+    if tracer is None:
+        return _no_span
+    return tracer.span(name, category, **args)
+
+
+def no_span(name: str, category: str = 'yenta', **args):
+    """ Do nothing, in place of `span` in code that runs very often and knows that no tracer is active.
+
+    :param str name: The name of the span.
+    :param str category: The category of the span.
+    :param args: Any details to attach to the span.
+    :return: A context manager.
+    """
+    return _no_span